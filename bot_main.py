@@ -1,4 +1,11 @@
-from kypisa.bot_cli import main as bot_main
+from kypisa import startup
+
+# --startup-profile: профиль запуска до первого запроса к FunPay
+startup.init()
+
+from kypisa.bot_cli import main as bot_main  # noqa: E402
+
+startup.mark("импорт kypisa.bot_cli")
 
 if __name__ == "__main__":
     bot_main()
@@ -0,0 +1,6 @@
+import sys
+
+from kypisa.daemon import main as daemon_main
+
+if __name__ == "__main__":
+    sys.exit(daemon_main())
@@ -12,6 +12,7 @@ import requests
 from .settings import get_base_dir
 from .logger import log
 from .models import Lot
+from .filters import LotFilter
 
 AI_STATS_FILE = os.path.join(get_base_dir(), "ai_stats.json")
 
@@ -63,13 +64,17 @@ def fetch_external_robux_prices() -> List[ExternalPrice]:
     return res
 
 
-def analyze(funpay_lots: List[Lot]) -> Optional[dict]:
+def analyze(funpay_lots: List[Lot], lot_filter: Optional[LotFilter] = None) -> Optional[dict]:
     """
     Универсальный анализ цен на FunPay для ЛЮБОЙ категории.
 
     Берём все лоты с положительной ценой, режем крайние выбросы
     и считаем минимальную и среднюю цену за 1 лот.
+    lot_filter — анализировать только подходящие лоты (см. kypisa.filters).
     """
+    if lot_filter is not None:
+        funpay_lots = lot_filter.apply(funpay_lots)
+
     prices: List[float] = []
 
     # собираем корректные цены
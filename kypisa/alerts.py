@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import math
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from .models import Lot
+
+# рейтинг продавца на FunPay — от 0 до 5 звёзд
+MAX_RATING = 5
+
+
+@dataclass
+class PriceAlert:
+    """
+    Правило подписчика: "скажи, когда в категории цена станет <= max_price
+    у продавца с рейтингом >= min_rating".
+    """
+
+    owner: str
+    category_url: str
+    max_price: float
+    min_rating: int = 0
+    id: str = ""
+
+    def __post_init__(self) -> None:
+        self.min_rating = max(0, min(MAX_RATING, int(self.min_rating)))
+        if not self.id:
+            self.id = f"{self.owner}|{self.category_url}|{self.max_price:g}|{self.min_rating}"
+
+
+@dataclass
+class AlertMatch:
+    alert: PriceAlert
+    lot: Lot
+
+
+@dataclass
+class _Ladder:
+    """Правила одной категории с одним min_rating, отсортированные по порогу."""
+
+    thresholds: List[float] = field(default_factory=list)
+    ids: List[str] = field(default_factory=list)
+    best: float = math.inf  # лучшая цена на прошлом снимке
+
+    def add(self, alert: PriceAlert) -> None:
+        i = bisect_left(self.thresholds, alert.max_price)
+        self.thresholds.insert(i, alert.max_price)
+        self.ids.insert(i, alert.id)
+
+    def remove(self, alert: PriceAlert) -> None:
+        i = bisect_left(self.thresholds, alert.max_price)
+        while i < len(self.ids) and self.thresholds[i] == alert.max_price:
+            if self.ids[i] == alert.id:
+                del self.thresholds[i]
+                del self.ids[i]
+                return
+            i += 1
+
+
+class AlertIndex:
+    """
+    Индекс ценовых правил для тысяч подписчиков.
+
+    Правила разложены по категории и min_rating, внутри — отсортированы
+    по порогу. На каждом снимке считаем лучшую цену для каждого уровня
+    рейтинга (один проход по лотам), а дальше бисекцией находим ровно те
+    правила, условие которых только что стало истинным: порог в
+    промежутке [новая лучшая цена, прошлая лучшая цена). Правила, которые
+    уже были истинны, повторно не срабатывают — пока цена не поднимется
+    выше порога и не опустится снова.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._alerts: Dict[str, PriceAlert] = {}
+        # category_url -> min_rating -> лестница порогов
+        self._ladders: Dict[str, Dict[int, _Ladder]] = {}
+        # новые правила проверяем на первом же снимке целиком
+        self._fresh: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._alerts)
+
+    def categories(self) -> List[str]:
+        with self._lock:
+            return [url for url, ladders in self._ladders.items() if any(l.ids for l in ladders.values())]
+
+    def add(self, alert: PriceAlert) -> None:
+        with self._lock:
+            if alert.id in self._alerts:
+                return
+            self._alerts[alert.id] = alert
+            ladders = self._ladders.setdefault(alert.category_url, {})
+            ladders.setdefault(alert.min_rating, _Ladder()).add(alert)
+            self._fresh.setdefault(alert.category_url, []).append(alert.id)
+
+    def remove(self, alert_id: str) -> None:
+        with self._lock:
+            alert = self._alerts.pop(alert_id, None)
+            if alert is None:
+                return
+            ladder = self._ladders.get(alert.category_url, {}).get(alert.min_rating)
+            if ladder is not None:
+                ladder.remove(alert)
+
+    def replace_owner(self, owner: str, alerts: Iterable[PriceAlert]) -> None:
+        """Заменить все правила подписчика новым набором."""
+        new = {a.id: a for a in alerts}
+        with self._lock:
+            old_ids = [a.id for a in self._alerts.values() if a.owner == owner]
+        for aid in old_ids:
+            if aid not in new:
+                self.remove(aid)
+        for alert in new.values():
+            self.add(alert)
+
+    @staticmethod
+    def _best_by_rating(lots: Iterable[Lot]) -> tuple[List[float], List[Optional[Lot]]]:
+        """best[r] — самый дешёвый лот у продавцов с рейтингом >= r."""
+        best = [math.inf] * (MAX_RATING + 1)
+        best_lot: List[Optional[Lot]] = [None] * (MAX_RATING + 1)
+        for lot in lots:
+            if not lot.price or lot.price <= 0:
+                continue
+            r = max(0, min(MAX_RATING, lot.seller.rating_stars or 0))
+            if lot.price < best[r]:
+                best[r] = lot.price
+                best_lot[r] = lot
+        # суффиксный минимум: рейтинг 5 подходит и под ">= 3"
+        for r in range(MAX_RATING - 1, -1, -1):
+            if best[r + 1] < best[r]:
+                best[r] = best[r + 1]
+                best_lot[r] = best_lot[r + 1]
+        return best, best_lot
+
+    def evaluate(self, category_url: str, lots: Iterable[Lot]) -> List[AlertMatch]:
+        """Прогнать снимок категории; вернуть сработавшие только что правила."""
+        with self._lock:
+            ladders = self._ladders.get(category_url)
+            if not ladders:
+                return []
+            best, best_lot = self._best_by_rating(lots)
+            fired: Dict[str, AlertMatch] = {}
+
+            for level, ladder in ladders.items():
+                now = best[level]
+                prev = ladder.best
+                ladder.best = now
+                if now >= prev or now == math.inf:
+                    continue
+                lo = bisect_left(ladder.thresholds, now)
+                hi = bisect_left(ladder.thresholds, prev)
+                lot = best_lot[level]
+                for aid in ladder.ids[lo:hi]:
+                    fired[aid] = AlertMatch(self._alerts[aid], lot)
+
+            for aid in self._fresh.pop(category_url, []):
+                alert = self._alerts.get(aid)
+                if alert is None or aid in fired:
+                    continue
+                lot = best_lot[alert.min_rating]
+                if lot is not None and lot.price <= alert.max_price:
+                    fired[aid] = AlertMatch(alert, lot)
+
+            return list(fired.values())
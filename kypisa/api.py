@@ -1,26 +1,160 @@
 from __future__ import annotations
-from typing import List
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
 
 from bs4 import BeautifulSoup
 
+from . import events
 from .models import Category, Lot
 from .parser import parse_categories, parse_lots
+from .ratelimit import RateLimiter
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Kypisa CLI)"
+
+
+def _safe_user_agent(user_agent: str | None) -> str:
+    """Заголовки уходят в latin-1: нелатинские символы из User-Agent выкидываем."""
+    ua = user_agent or DEFAULT_USER_AGENT
+    try:
+        ua.encode("latin-1")
+    except UnicodeEncodeError:
+        ua = ua.encode("latin-1", "ignore").decode("latin-1")
+    return ua.strip() or DEFAULT_USER_AGENT
+
+
+def _endpoint(url: str) -> str:
+    """Группа для метрик: первый сегмент пути (/chat/, /runner/, /lots/ ...)."""
+    path = urlparse(url).path.strip("/")
+    return "/" + path.split("/")[0] + "/" if path else "/"
+
+
+# время установки новых соединений (DNS + TCP + TLS) в текущем запросе;
+# requests синхронный, так что запрос и connect() идут в одном потоке
+_phase = threading.local()
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _phase.connect = getattr(_phase, "connect", 0.0) + time.perf_counter() - started
+
+
+class _TimedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter, который замеряет установку соединений (для событий connect)."""
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            "https": _TimedHTTPSPool,
+        }
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    cache_hits: int = 0
+
+    @property
+    def avg_ms(self) -> float:
+        return self.seconds * 1000.0 / self.requests if self.requests else 0.0
+
+
+class ClientMetrics:
+    """Счётчики запросов FunPayClient по группам URL (потокобезопасные)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: Dict[str, EndpointStats] = {}
+
+    def record(self, endpoint: str, seconds: float, size: int, error: bool = False) -> None:
+        with self._lock:
+            st = self._stats.setdefault(endpoint, EndpointStats())
+            st.requests += 1
+            st.errors += int(error)
+            st.bytes += size
+            st.seconds += seconds
+
+    def cache_hit(self, endpoint: str) -> None:
+        with self._lock:
+            self._stats.setdefault(endpoint, EndpointStats()).cache_hits += 1
+
+    def snapshot(self) -> Dict[str, EndpointStats]:
+        with self._lock:
+            return {name: replace(st) for name, st in self._stats.items()}
+
+    def summary(self) -> str:
+        stats = self.snapshot()
+        total = sum(st.requests for st in stats.values())
+        errors = sum(st.errors for st in stats.values())
+        size = sum(st.bytes for st in stats.values())
+        hits = sum(st.cache_hits for st in stats.values())
+        parts = [
+            f"{name} {st.requests}×{st.avg_ms:.0f} мс"
+            for name, st in sorted(stats.items(), key=lambda item: -item[1].requests)
+            if st.requests
+        ]
+        text = f"HTTP: {total} запросов ({errors} ошибок), {size / 1024:.0f} КБ, из кэша {hits}"
+        return text + ("; " + ", ".join(parts) if parts else "")
 
 
 class FunPayClient:
+    """
+    Клиент FunPay: одна сессия с пулом соединений на весь процесс.
+
+    Все запросы (витрины, чаты, /runner/) идут через request(): общий
+    лимит запросов в минуту (rate_limiter, если задан), общие метрики
+    (metrics) и, для GET через get_text(), короткий кэш ответов —
+    одинаковая страница, запрошенная двумя подписками в течение
+    cache_ttl секунд, скачивается один раз.
+    """
+
     BASE_URL = "https://funpay.com"
 
-    def __init__(self, golden_key: str, user_agent: str | None = None) -> None:
+    def __init__(
+        self,
+        golden_key: str,
+        user_agent: str | None = None,
+        max_requests_per_minute: float | None = None,
+        pool_size: int = 8,
+        cache_ttl: float = 0.0,
+        timeout: float = 20.0,
+    ) -> None:
         self.golden_key = golden_key
-        self.user_agent = user_agent or "Mozilla/5.0 (Kypisa CLI)"
+        self.user_agent = _safe_user_agent(user_agent)
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
         self.session = requests.Session()
-        self.session.headers.update(
-            {
-                "cookie": f"golden_key={self.golden_key}",
-                "user-agent": self.user_agent,
-            }
+        adapter = _TimedAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"user-agent": self.user_agent})
+        # кукой, а не заголовком: иначе сессия не сохранит PHPSESSID,
+        # к которому привязан csrf-token чатов
+        self.session.cookies.set("golden_key", self.golden_key, domain="funpay.com")
+        self.rate_limiter = (
+            RateLimiter(max_requests_per_minute, burst=10) if max_requests_per_minute else None
         )
+        self.metrics = ClientMetrics()
+        self._cache_lock = threading.Lock()
+        self._cache: Dict[Tuple[str, str], Tuple[float, str]] = {}
         self._categories_cache: List[Category] | None = None
 
     def _absolute_url(self, href: str) -> str:
@@ -32,27 +166,88 @@ class FunPayClient:
             href = "/" + href
         return self.BASE_URL + href
 
+    # ---------- транспорт ----------
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Любой запрос к FunPay: общий пул соединений, лимит и метрики.
+        В журнал событий (kypisa.events) уходят этапы connect (только если
+        открывалось новое соединение), wait (до заголовков ответа) и
+        transfer (скачивание тела).
+        """
+        url = self._absolute_url(url)
+        kwargs.setdefault("timeout", self.timeout)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        endpoint = _endpoint(url)
+        _phase.connect = 0.0
+        started = time.perf_counter()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            self.metrics.record(endpoint, time.perf_counter() - started, 0, error=True)
+            events.emit("http_error", endpoint=endpoint, error=type(e).__name__)
+            raise
+        total = time.perf_counter() - started
+        self.metrics.record(endpoint, total, len(resp.content), error=resp.status_code >= 400)
+
+        connect = _phase.connect
+        headers_at = resp.elapsed.total_seconds()
+        if connect > 0:
+            events.record_span("connect", connect, endpoint=endpoint)
+        events.record_span("wait", max(0.0, headers_at - connect), endpoint=endpoint, status=resp.status_code)
+        events.record_span("transfer", max(0.0, total - headers_at), endpoint=endpoint, bytes=len(resp.content))
+        return resp
+
+    def get_text(
+        self,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        ttl: Optional[float] = None,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """GET с raise_for_status; ответ кэшируется на ttl секунд (по умолчанию cache_ttl)."""
+        url = self._absolute_url(url)
+        ttl = self.cache_ttl if ttl is None else ttl
+        key = (url, repr(sorted((params or {}).items())))
+        if ttl > 0:
+            with self._cache_lock:
+                hit = self._cache.get(key)
+            if hit is not None and hit[0] > time.monotonic():
+                self.metrics.cache_hit(_endpoint(url))
+                return hit[1]
+
+        r = self.request("GET", url, params=params or None, timeout=timeout or self.timeout)
+        r.raise_for_status()
+        if ttl > 0:
+            now = time.monotonic()
+            with self._cache_lock:
+                # заодно выкидываем протухшее, чтобы кэш не рос
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+                self._cache[key] = (now + ttl, r.text)
+        return r.text
+
+    # ---------- витрины ----------
+
     def get_lots_by_url(self, url: str) -> List[Lot]:
         """
         Загружает лоты по ЛЮБОЙ странице FunPay с витриной:
         просто даём URL категории/игры.
         """
-        abs_url = self._absolute_url(url)
-        r = self.session.get(abs_url, timeout=20)
-        r.raise_for_status()
-        lots = parse_lots(r.text)
+        text = self.get_text(url)
+        with events.span("parse"):
+            lots = parse_lots(text)
         for lot in lots:
             lot.url = self._absolute_url(lot.url)
         return lots
 
     def get_username(self) -> str | None:
         try:
-            r = self.session.get(self.BASE_URL + "/", timeout=10)
-            r.raise_for_status()
+            text = self.get_text(self.BASE_URL + "/", ttl=0, timeout=10)
         except Exception:
             return None
 
-        soup = BeautifulSoup(r.text, "html.parser")
+        soup = BeautifulSoup(text, "html.parser")
         link = soup.find("a", href=lambda h: h and "/users/" in h)
         if link:
             text = link.get_text(strip=True)
@@ -63,10 +258,7 @@ class FunPayClient:
         if self._categories_cache is not None:
             return self._categories_cache
 
-        url = self.BASE_URL + "/chips/99/"
-        r = self.session.get(url, timeout=20)
-        r.raise_for_status()
-        cats = parse_categories(r.text)
+        cats = parse_categories(self.get_text(self.BASE_URL + "/chips/99/"))
         for c in cats:
             c.url = self._absolute_url(c.url)
         self._categories_cache = cats
@@ -96,34 +288,15 @@ class FunPayClient:
         Для страниц типа 'Прочие игры Roblox' можно дополнительно
         указать фильтры 'Игра' (f-game) и 'Тип' (f-type).
         """
-        url = self._absolute_url(category.url)
-
         params: dict[str, str] = {}
         if game:
             params["f-game"] = game
         if type_:
             params["f-type"] = type_
 
-        if params:
-            r = self.session.get(url, params=params, timeout=20)
-        else:
-            r = self.session.get(url, timeout=20)
-
-        r.raise_for_status()
-        lots = parse_lots(r.text)
+        text = self.get_text(category.url, params=params)
+        with events.span("parse"):
+            lots = parse_lots(text)
         for lot in lots:
             lot.url = self._absolute_url(lot.url)
         return lots
-
-    def search_categories(self, query: str) -> List[Category]:
-        cats = self.fetch_categories()
-        q = query.lower()
-
-        if any(alias in q for alias in ("roblox", "робл", "робукс", "robux", "rob ")):
-            robux = [c for c in cats if c.name.lower().startswith("робукс")]
-            if robux:
-                return robux
-
-        starts = [c for c in cats if c.name.lower().startswith(q)]
-        contains = [c for c in cats if q in c.name.lower() and c not in starts]
-        return starts + contains
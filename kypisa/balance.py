@@ -1,11 +1,19 @@
 from __future__ import annotations
 
+import threading
+import time
 from dataclasses import dataclass
 from typing import Optional
 
-import requests
 from bs4 import BeautifulSoup
 
+from .api import FunPayClient
+from .logger import log
+
+BALANCE_URL = "https://funpay.com/account/balance"
+# как часто фоновый поток обновляет баланс
+BALANCE_TTL_SECONDS = 60.0
+
 
 @dataclass
 class BalanceInfo:
@@ -14,6 +22,20 @@ class BalanceInfo:
     eur: float
 
 
+@dataclass
+class BalanceSnapshot:
+    """Последний известный баланс для меню: info None — ещё ни разу не получили."""
+
+    info: Optional[BalanceInfo]
+    updated: Optional[float]  # time.time() последнего успешного обновления
+    error: Optional[str]  # ошибка последней попытки (None — удалась)
+    stale: bool
+
+    @property
+    def age(self) -> Optional[float]:
+        return time.time() - self.updated if self.updated is not None else None
+
+
 def _parse_amount(text: str) -> float:
     # '4.42 ₽' -> 4.42 ; '0 $' -> 0.0
     parts = text.strip().split()
@@ -26,23 +48,9 @@ def _parse_amount(text: str) -> float:
         return 0.0
 
 
-def fetch_balance(golden_key: str, user_agent: Optional[str]) -> BalanceInfo:
-    """
-    Получает общий баланс аккаунта с https://funpay.com/account/balance.
-    Берёт три значения из .balances-value: RUB, USD, EUR.
-    """
-    headers = {
-        "cookie": f"golden_key={golden_key}; cookie_prefs=1",
-        "accept": "*/*",
-    }
-    if user_agent:
-        headers["user-agent"] = user_agent
-
-    url = "https://funpay.com/account/balance"
-    r = requests.get(url, headers=headers, timeout=15)
-    r.raise_for_status()
-
-    soup = BeautifulSoup(r.text, "lxml")
+def parse_balance(html: str) -> BalanceInfo:
+    """Три значения из .balances-value страницы /account/balance: RUB, USD, EUR."""
+    soup = BeautifulSoup(html, "lxml")
 
     # базовая проверка, что мы залогинены
     user_link = soup.find("div", class_="user-link-name")
@@ -58,3 +66,80 @@ def fetch_balance(golden_key: str, user_agent: Optional[str]) -> BalanceInfo:
     eur = _parse_amount(vals[2].get_text(" ", strip=True))
 
     return BalanceInfo(rub=rub, usd=usd, eur=eur)
+
+
+def fetch_balance(client: FunPayClient) -> BalanceInfo:
+    """
+    Получает общий баланс аккаунта с https://funpay.com/account/balance
+    через сессию клиента (общий пул соединений и метрики).
+    """
+    # страница баланса всегда запрашивалась с cookie_prefs=1 (согласие на куки)
+    client.session.cookies.set("cookie_prefs", "1", domain="funpay.com")
+    return parse_balance(client.get_text(BALANCE_URL, ttl=0, timeout=15))
+
+
+class BalanceService:
+    """
+    Баланс для главного меню без ожидания сети.
+
+    Фоновый поток kypisa-balance обновляет баланс раз в ttl секунд, а
+    snapshot() мгновенно отдаёт последнее известное значение. stale —
+    значение могло устареть: последняя попытка не удалась или обновления
+    не было дольше двух ttl (например, нет сети и запрос висит).
+    """
+
+    def __init__(self, client: FunPayClient, ttl: float = BALANCE_TTL_SECONDS) -> None:
+        self.client = client
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._info: Optional[BalanceInfo] = None
+        self._updated: Optional[float] = None
+        self._error: Optional[str] = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name="kypisa-balance", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    def refresh_soon(self) -> None:
+        """Обновить, не дожидаясь конца ttl (например, после покупки)."""
+        self._wake.set()
+
+    def refresh(self) -> bool:
+        """Одно обновление в текущем потоке. True — баланс получен."""
+        try:
+            info = fetch_balance(self.client)
+        except Exception as e:
+            log(f"BALANCE: ошибка получения баланса: {e}")
+            with self._lock:
+                self._error = str(e) or type(e).__name__
+            return False
+        with self._lock:
+            self._info = info
+            self._updated = time.time()
+            self._error = None
+        return True
+
+    def snapshot(self) -> BalanceSnapshot:
+        with self._lock:
+            info, updated, error = self._info, self._updated, self._error
+        stale = error is not None or (updated is not None and time.time() - updated > 2 * self.ttl)
+        return BalanceSnapshot(info=info, updated=updated, error=error, stale=stale)
+
+    def _loop(self) -> None:
+        while not self._stopped.is_set():
+            self.refresh()
+            self._wake.wait(self.ttl)
+            self._wake.clear()
@@ -5,6 +5,7 @@ from .settings import load_settings
 from .color import apply_color
 from .logger import log
 from .cli import run_ai_for_category
+from . import startup
 
 
 def main() -> None:
@@ -16,6 +17,7 @@ def main() -> None:
     apply_color(cfg.get("color_code", ""))
 
     client = FunPayClient(cfg["golden_key"], cfg["user_agent"] or None)
+    startup.ready("bot_main.py", ["kypisa.bot_cli"])
     log("Запуск отдельного ИИ-бота (bot_main)")
 
     cats = client.search_categories("Робуксы")
@@ -0,0 +1,1109 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+from urllib3.exceptions import NewConnectionError
+
+from .api import FunPayClient
+from .logger import log
+from .settings import get_base_dir
+
+CHAT_URL = FunPayClient.BASE_URL + "/chat/"
+RUNNER_URL = FunPayClient.BASE_URL + "/runner/"
+ARCHIVE_FILE = os.path.join(get_base_dir(), "chat_archive.db")
+
+# лимит запросов для отдельного процесса чатов (плагин Chat): монитор,
+# открытые чаты и фоновая подгрузка делят его через общий FunPayClient.
+# С нотификатором и демоном он не общий — у каждого процесса свой клиент
+CHAT_REQUESTS_PER_MINUTE = 60
+
+
+# ---------- список диалогов ----------
+
+def _int_attr(tag, name: str) -> Optional[int]:
+    try:
+        return int(tag.get(name) or "")
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_contact_items(soup: BeautifulSoup) -> List[Dict]:
+    """
+    Диалоги из .contact-item — и на странице /chat/, и во фрагменте html,
+    который /runner/ присылает в объекте chat_bookmarks.
+    """
+    items: List[Dict] = []
+
+    # пробуем сразу два варианта селектора
+    for a in soup.select(".contact-list .contact-item, .contact-item"):
+        classes = a.get("class", [])
+        unread = "unread" in classes
+
+        name_el = a.select_one(".media-user-name")
+        msg_el = a.select_one(".contact-item-message")
+        time_el = a.select_one(".contact-item-time")
+
+        name = name_el.get_text(strip=True) if name_el else "???"
+        last_message = msg_el.get_text(" ", strip=True) if msg_el else ""
+        time_str = time_el.get_text(strip=True) if time_el else ""
+
+        href = a.get("href") or ""
+        if href.startswith("http"):
+            chat_url = href
+        else:
+            chat_url = FunPayClient.BASE_URL + href
+
+        items.append(
+            {
+                "name": name,
+                "last_message": last_message,
+                "time": time_str,
+                "url": chat_url,
+                "unread": unread,
+                # data-id — id диалога, data-node-msg — id последнего сообщения в нём
+                "node_id": _int_attr(a, "data-id"),
+                "last_message_id": _int_attr(a, "data-node-msg"),
+            }
+        )
+    return items
+
+
+def fetch_chat_page(client: FunPayClient) -> Tuple[List[Dict], Dict]:
+    """
+    Страница https://funpay.com/chat/ целиком: список диалогов и
+    data-app-data (csrf-token, userId), нужные для /runner/.
+    """
+    resp = client.request("GET", CHAT_URL)
+    log(f"CHAT: /chat/ -> {resp.status_code}")
+    resp.raise_for_status()
+
+    html = resp.text
+    soup = BeautifulSoup(html, "html.parser")
+    items = _parse_contact_items(soup)
+
+    if not items:
+        # Если вообще ничего не нашли – сохраним HTML, чтобы можно было посмотреть.
+        debug_path = os.path.join(get_base_dir(), "chat_debug.html")
+        try:
+            with open(debug_path, "w", encoding="utf-8") as f:
+                f.write(html)
+            log(f"CHAT: в списке чатов 0 диалогов, HTML сохранён в {debug_path}")
+        except Exception as e:
+            log(f"CHAT: не удалось сохранить chat_debug.html: {e}")
+
+    return items, _extract_app_data(soup)
+
+
+def fetch_chat_list(client: FunPayClient) -> List[Dict]:
+    """
+    Забирает список диалогов с https://funpay.com/chat/
+
+    Возвращает список словарей:
+        {
+            "name": str,
+            "last_message": str,
+            "time": str,
+            "url": str,
+            "unread": bool,
+            "node_id": int | None,
+            "last_message_id": int | None,
+        }
+    """
+    items, _ = fetch_chat_page(client)
+    return items
+
+
+# ---------- /runner/ ----------
+
+def _runner_headers(referer: str) -> Dict[str, str]:
+    return {
+        "Origin": FunPayClient.BASE_URL,
+        "Referer": referer,
+        "Accept": "application/json, text/javascript, */*; q=0.01",
+        "X-Requested-With": "XMLHttpRequest",
+        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+    }
+
+
+def runner_request(
+    client: FunPayClient,
+    csrf_token: str,
+    objects: List[Dict],
+    request=False,
+    referer: str = CHAT_URL,
+) -> Tuple[Dict, int]:
+    """
+    Один POST на /runner/. Возвращает (JSON-ответ, размер ответа в байтах).
+    HTTP-ошибки (в т.ч. протухший csrf-token — 400/403) — исключение.
+    """
+    payload = {
+        "objects": json.dumps(objects, separators=(",", ":")),
+        "request": json.dumps(request, separators=(",", ":")),
+        "csrf_token": csrf_token,
+    }
+    resp = client.request("POST", RUNNER_URL, data=payload, headers=_runner_headers(referer))
+    resp.raise_for_status()
+    return resp.json(), len(resp.content)
+
+
+class ChatListWatcher:
+    """
+    Следит за списком диалогов через /runner/ вместо перезагрузки /chat/.
+
+    Страница /chat/ (десятки КБ HTML) грузится один раз — ради списка и
+    csrf-token/userId. Дальше каждые несколько секунд уходит маленький
+    запрос на /runner/ с объектами chat_bookmarks и orders_counters и их
+    последними тегами: пока ничего не поменялось, сервер отвечает теми же
+    тегами, и парсить нечего. Если тег chat_bookmarks сменился, в ответе
+    приходит html одного только списка контактов — разбираем его.
+    Полную страницу перезагружаем, только если /runner/ отказал
+    (например, протух csrf-token).
+
+    С cache (MessageCache) тот же запрос заодно синхронизирует все
+    закэшированные диалоги: в chat_bookmarks уходят пары
+    [node_id, last_message_id], а для каждого диалога — объект chat_node
+    с его last_message_id. Сервер присылает только новые сообщения, они
+    сразу ложатся в кэш. Сотня диалогов — всё равно один запрос за цикл.
+    """
+
+    def __init__(self, client: FunPayClient, cache: Optional["MessageCache"] = None) -> None:
+        self.client = client
+        self.cache = cache
+        self.app: Dict = {}
+        self.chats: List[Dict] = []
+        self.counters: Dict = {}
+        self._tags: Dict[str, str] = {}
+        # статистика для строки состояния монитора
+        self.page_loads = 0
+        self.runner_polls = 0
+        self.last_bytes = 0
+        self.synced_nodes = 0
+        self.synced_messages = 0
+
+    def _reload_page(self) -> None:
+        self.chats, self.app = fetch_chat_page(self.client)
+        self._tags = {}
+        self.page_loads += 1
+
+    def _objects(self) -> List[Dict]:
+        user_id = str(self.app.get("userId") or "")
+        bookmarks = self.cache.bookmarks() if self.cache is not None else []
+        objects = [
+            {
+                "type": "orders_counters",
+                "id": user_id,
+                "tag": self._tags.get("orders_counters", "00000000"),
+                "data": False,
+            },
+            {
+                "type": "chat_bookmarks",
+                "id": user_id,
+                "tag": self._tags.get("chat_bookmarks", "00000000"),
+                "data": [[b["node_id"], b["last_message_id"]] for b in bookmarks] or False,
+            },
+        ]
+        for b in bookmarks:
+            objects.append(
+                {
+                    "type": "chat_node",
+                    "id": b["node_name"],
+                    "tag": "00000000",
+                    "data": {"node": b["node_name"], "last_message": b["last_message_id"], "content": ""},
+                }
+            )
+        self.synced_nodes = len(bookmarks)
+        return objects
+
+    def poll(self) -> bool:
+        """Обновить список. True — список диалогов поменялся."""
+        if not self.app.get("csrf-token") or not self.app.get("userId"):
+            self._reload_page()
+            return True
+
+        try:
+            data, size = runner_request(self.client, self.app["csrf-token"], self._objects())
+        except (requests.RequestException, ValueError) as e:
+            log(f"CHAT: /runner/ не ответил ({e}), перезагружаю /chat/ целиком")
+            self._reload_page()
+            return True
+        self.last_bytes = size
+        self.runner_polls += 1
+
+        changed = False
+        if self.cache is not None:
+            self.synced_messages = self.cache.apply_runner_objects(data.get("objects") or [])
+        for obj in data.get("objects") or []:
+            kind = obj.get("type")
+            tag = obj.get("tag")
+            if not tag or tag == self._tags.get(kind):
+                continue
+            self._tags[kind] = tag
+            payload = obj.get("data")
+            if kind == "orders_counters" and isinstance(payload, dict):
+                self.counters = payload
+            elif kind == "chat_bookmarks" and isinstance(payload, dict) and payload.get("html"):
+                fragment = BeautifulSoup(payload["html"], "html.parser")
+                self.chats = _parse_contact_items(fragment)
+                changed = True
+        return changed
+
+
+
+
+# ---------- сообщения одного чата ----------
+
+def _extract_app_data(soup: BeautifulSoup) -> dict:
+    """
+    В <body data-app-data="..."> лежит JSON с csrf-token и userId.
+    """
+    body = soup.select_one("body")
+    if not body:
+        return {}
+
+    raw = body.get("data-app-data") or ""
+    if not raw:
+        return {}
+
+    try:
+        decoded = unescape(raw)
+        return json.loads(decoded)
+    except Exception:
+        return {}
+
+
+def _parse_message_items(items) -> Tuple[List[Dict], Optional[int]]:
+    """
+    Сообщения из элементов .chat-msg-item (страница чата или html,
+    который /runner/ присылает в объекте chat_node).
+    Возвращает (messages, id последнего сообщения).
+    """
+    messages: List[Dict] = []
+    last_message_id: Optional[int] = None
+
+    # Каждый .chat-msg-item — одно сообщение
+    for item in items:
+        # id="message-4031282597"
+        mid: Optional[int] = None
+        msg_id_str = item.get("id") or ""
+        if msg_id_str.startswith("message-"):
+            try:
+                mid = int(msg_id_str.replace("message-", ""))
+                last_message_id = max(last_message_id or 0, mid)
+            except ValueError:
+                pass
+
+        # день (типа "30 ноября")
+        day_el = item.select_one(".chat-message-list-date .inside")
+        day_label = day_el.get_text(strip=True) if day_el else None
+
+        msg_block = item.select_one(".chat-message")
+        if not msg_block:
+            continue
+
+        author_el = msg_block.select_one(".media-user-name a.chat-msg-author-link")
+        time_el = msg_block.select_one(".chat-msg-date")
+        text_el = msg_block.select_one(".chat-msg-text")
+
+        if text_el is None:
+            continue
+
+        author = author_el.get_text(strip=True) if author_el else "?"
+        time_str = time_el.get_text(strip=True) if time_el else ""
+        text = text_el.get_text("\n", strip=True)
+
+        messages.append(
+            {
+                "id": mid,
+                "author": author,
+                "time": time_str,
+                "day": day_label,
+                "text": text,
+            }
+        )
+    return messages, last_message_id
+
+
+def fetch_chat_messages(
+    client: FunPayClient,
+    chat_url: str,
+    limit: int = 50,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Забирает сообщения из конкретного диалога (/chat/?node=...).
+
+    Возвращает (messages, meta).
+
+    messages: список словарей:
+        {
+            "id": int | None,
+            "author": str,
+            "time": str,
+            "day": str | None,
+            "text": str,
+        }
+
+    meta:
+        {
+            "node_id": int,
+            "node_name": str,
+            "user_id": int,
+            "other_id": int | None,
+            "csrf_token": str | None,
+            "last_message_id": int | None,
+            "chat_url": str,
+        }
+    """
+    resp = client.request("GET", chat_url)
+    resp.raise_for_status()
+
+    soup = BeautifulSoup(resp.text, "html.parser")
+
+    # данные из div.chat.chat-float
+    chat_div = soup.select_one(".chat.chat-float")
+    node_id = None
+    node_name = None
+    other_id = None
+
+    if chat_div:
+        try:
+            node_id = int(chat_div.get("data-id") or 0)
+        except (TypeError, ValueError):
+            node_id = None
+
+        node_name = chat_div.get("data-name")  # типа "users-10380273-17799650"
+        if node_name and "-" in node_name:
+            try:
+                other_id = int(node_name.split("-")[-1])
+            except ValueError:
+                other_id = None
+
+    # csrf-token и userId из data-app-data
+    app_data = _extract_app_data(soup)
+    csrf_token = app_data.get("csrf-token")
+    user_id = app_data.get("userId")
+
+    messages, last_message_id = _parse_message_items(soup.select(".chat-message-list .chat-msg-item"))
+
+    if limit and len(messages) > limit:
+        messages = messages[-limit:]
+
+    meta = {
+        "node_id": node_id,
+        "node_name": node_name,
+        "user_id": user_id,
+        "other_id": other_id,
+        "csrf_token": csrf_token,
+        "last_message_id": last_message_id,
+        "chat_url": chat_url,
+    }
+
+    return messages, meta
+
+
+# ---------- архив сообщений ----------
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogs (
+    node    TEXT PRIMARY KEY,
+    name    TEXT NOT NULL,
+    url     TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id      INTEGER PRIMARY KEY,
+    node    TEXT NOT NULL,
+    msg_id  INTEGER NOT NULL,
+    author  TEXT NOT NULL,
+    day     TEXT,
+    time    TEXT,
+    text    TEXT NOT NULL,
+    seen    REAL NOT NULL,
+    preview INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (node, msg_id)
+);
+"""
+
+# полнотекстовый индекс поверх messages (external content) + триггеры
+_ARCHIVE_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, author, content='messages', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text, author) VALUES (new.id, new.text, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text, author) VALUES ('delete', old.id, old.text, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text, author) VALUES ('delete', old.id, old.text, old.author);
+    INSERT INTO messages_fts(rowid, text, author) VALUES (new.id, new.text, new.author);
+END;
+"""
+
+
+class ChatArchive:
+    """
+    Локальный архив всех увиденных сообщений (chat_archive.db в корне
+    проекта) с полнотекстовым поиском SQLite FTS5.
+
+    Пополняется сам: всё, что прошло через MessageCache (открытые
+    диалоги), и последние сообщения из списка диалогов в мониторе
+    (как "превью" — когда придёт полное сообщение, оно его заменит).
+    Если sqlite собран без FTS5, поиск работает через LIKE — медленнее,
+    но работает.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or ARCHIVE_FILE
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_ARCHIVE_SCHEMA)
+        try:
+            self._conn.executescript(_ARCHIVE_FTS)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def add_dialogs(self, chats: List[Dict]) -> None:
+        """Имена/ссылки диалогов и превью последних сообщений из списка."""
+        now = time.time()
+        dialogs = []
+        previews = []
+        for ch in chats:
+            node = _node_from_url(ch.get("url") or "")
+            if not node:
+                continue
+            dialogs.append((node, ch.get("name") or "", ch.get("url") or "", now))
+            if ch.get("last_message_id") and ch.get("last_message"):
+                previews.append((node, ch["last_message_id"], "", None, ch.get("time"), ch["last_message"], now))
+        self._write_batch(
+            "список диалогов",
+            [
+                (
+                    "INSERT INTO dialogs (node, name, url, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(node) DO UPDATE SET name = excluded.name, url = excluded.url, "
+                    "updated = excluded.updated",
+                    dialogs,
+                ),
+                (
+                    "INSERT OR IGNORE INTO messages (node, msg_id, author, day, time, text, seen, preview) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                    previews,
+                ),
+            ],
+        )
+
+    def add_messages(self, node: str, messages: List[Dict]) -> None:
+        now = time.time()
+        rows = [
+            (node, m["id"], m.get("author") or "", m.get("day"), m.get("time"), m.get("text") or "", now)
+            for m in messages
+            if m.get("id") is not None
+        ]
+        if not rows:
+            return
+        # полное сообщение заменяет превью, уже известное — не трогаем
+        self._write_batch(
+            f"сообщения диалога {node}",
+            [
+                (
+                    "INSERT INTO messages (node, msg_id, author, day, time, text, seen, preview) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, 0) "
+                    "ON CONFLICT(node, msg_id) DO UPDATE SET author = excluded.author, day = excluded.day, "
+                    "time = excluded.time, text = excluded.text, preview = 0 WHERE messages.preview = 1",
+                    rows,
+                ),
+            ],
+        )
+
+    def _write_batch(self, what: str, statements: List[Tuple[str, List[tuple]]]) -> None:
+        """
+        Одна транзакция на пачку. При ошибке (база занята, кривое значение)
+        откатываем её, иначе соединение так и осталось бы внутри BEGIN и
+        все следующие записи падали бы до перезапуска.
+        """
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN")
+                for sql, rows in statements:
+                    self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                try:
+                    self._conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                log(f"CHAT: архив: не удалось сохранить {what}: {e}")
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def search(self, query: str, limit: int = 30) -> List[Dict]:
+        """Сообщения, где встречаются все слова запроса (по префиксу), последние попавшие в архив — сверху."""
+        words = [w for w in query.split() if w]
+        if not words:
+            return []
+        if self.fts:
+            match = " ".join('"' + w.replace('"', '""') + '"*' for w in words)
+            sql = (
+                "SELECT m.node, m.msg_id, m.author, m.day, m.time, "
+                "snippet(messages_fts, 0, '[', ']', '…', 12), d.name, d.url "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                "LEFT JOIN dialogs d ON d.node = m.node "
+                "WHERE messages_fts MATCH ? ORDER BY messages_fts.rowid DESC LIMIT ?"
+            )
+            params: tuple = (match, limit)
+        else:
+            where = " AND ".join("m.text LIKE ?" for _ in words)
+            sql = (
+                "SELECT m.node, m.msg_id, m.author, m.day, m.time, m.text, d.name, d.url "
+                "FROM messages m LEFT JOIN dialogs d ON d.node = m.node "
+                f"WHERE {where} ORDER BY m.msg_id DESC LIMIT ?"
+            )
+            params = tuple(f"%{w}%" for w in words) + (limit,)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {
+                "node": r[0],
+                "msg_id": r[1],
+                "author": r[2],
+                "day": r[3],
+                "time": r[4],
+                "text": r[5],
+                "name": r[6] or f"node {r[0]}",
+                "url": r[7] or f"{CHAT_URL}?node={r[0]}",
+            }
+            for r in rows
+        ]
+
+
+# ---------- кэш сообщений ----------
+
+def _node_from_url(chat_url: str) -> Optional[str]:
+    """https://funpay.com/chat/?node=123 -> "123"."""
+    values = parse_qs(urlparse(chat_url).query).get("node")
+    return values[0] if values else None
+
+
+class MessageCache:
+    """
+    Разобранные сообщения по диалогам, ключ — id сообщения.
+
+    Первый раз диалог грузится страницей целиком (fetch_chat_messages),
+    дальше — только дельта: на /runner/ уходит объект chat_node с
+    last_message_id из кэша, и сервер присылает html лишь тех сообщений,
+    что новее. Повторно открыть длинный диалог — один маленький запрос,
+    без загрузки и разбора всей страницы.
+    """
+
+    MAX_PER_NODE = 500
+
+    def __init__(self, client: FunPayClient, archive: Optional[ChatArchive] = None) -> None:
+        self.client = client
+        self.archive = archive
+        self._lock = threading.Lock()
+        # ключ — node из URL чата
+        self._messages: Dict[str, "OrderedDict[int, Dict]"] = {}
+        self._meta: Dict[str, Dict] = {}
+        self.full_loads = 0
+        self.delta_loads = 0
+
+    def cached(self, chat_url: str) -> bool:
+        with self._lock:
+            return _node_from_url(chat_url) in self._meta
+
+    def _store(self, key: str, messages: List[Dict], meta: Dict, replace: bool) -> None:
+        with self._lock:
+            bucket = self._messages.get(key)
+            if bucket is None or replace:
+                bucket = self._messages[key] = OrderedDict()
+            for msg in messages:
+                # без id (редко, но бывает) — ключом служит порядковый номер
+                mid = msg.get("id") if msg.get("id") is not None else -len(bucket) - 1
+                bucket[mid] = msg
+            while len(bucket) > self.MAX_PER_NODE:
+                bucket.popitem(last=False)
+            old = self._meta.get(key) or {}
+            last_id = max(meta.get("last_message_id") or 0, old.get("last_message_id") or 0)
+            self._meta[key] = {**old, **{k: v for k, v in meta.items() if v is not None}}
+            self._meta[key]["last_message_id"] = last_id or None
+        if self.archive is not None:
+            try:
+                self.archive.add_messages(key, messages)
+            except sqlite3.Error as e:
+                log(f"CHAT: не удалось записать в архив: {e}")
+
+    def _load_full(self, key: str, chat_url: str) -> None:
+        messages, meta = fetch_chat_messages(self.client, chat_url, limit=0)
+        self.full_loads += 1
+        self._store(key, messages, meta, replace=True)
+
+    def _load_delta(self, key: str, chat_url: str) -> int:
+        """Догрузить сообщения новее закэшированных. Возвращает, сколько пришло."""
+        with self._lock:
+            meta = dict(self._meta[key])
+        node_name = meta.get("node_name")
+        if not meta.get("csrf_token") or not node_name:
+            raise ValueError("нет csrf_token / node_name для дельта-запроса")
+        objects = [
+            {
+                "type": "chat_node",
+                "id": node_name,
+                "tag": "00000000",
+                "data": {"node": node_name, "last_message": meta.get("last_message_id") or 0, "content": ""},
+            }
+        ]
+        data, _ = runner_request(self.client, meta["csrf_token"], objects, referer=chat_url)
+        self.delta_loads += 1
+        fresh = self.apply_runner_objects(data.get("objects") or [])
+        return fresh
+
+    def apply_runner_objects(self, objects: List[Dict]) -> int:
+        """Применить объекты chat_node из любого ответа /runner/. Возвращает число новых сообщений."""
+        total = 0
+        for obj in objects:
+            if obj.get("type") != "chat_node" or not isinstance(obj.get("data"), dict):
+                continue
+            data = obj["data"]
+            node = data.get("node") or {}
+            node_id = node.get("id") if isinstance(node, dict) else None
+            key = str(node_id) if node_id is not None else None
+            if key is None:
+                # в ответе нет id узла — ищем по имени (users-1-2)
+                with self._lock:
+                    key = next((k for k, m in self._meta.items() if m.get("node_name") == obj.get("id")), None)
+            if key is None:
+                continue
+            html = "".join(m.get("html") or "" for m in data.get("messages") or [] if isinstance(m, dict))
+            if not html:
+                continue
+            soup = BeautifulSoup(html, "html.parser")
+            messages, last_id = _parse_message_items(soup.select(".chat-msg-item"))
+            with self._lock:
+                known = self._messages.get(key) or {}
+                messages = [m for m in messages if m.get("id") not in known]
+            self._store(key, messages, {"last_message_id": last_id}, replace=False)
+            total += len(messages)
+        return total
+
+    def fetch(self, chat_url: str, limit: int = 50) -> Tuple[List[Dict], Dict]:
+        """
+        Как fetch_chat_messages, но через кэш: если диалог уже загружали —
+        только дельта через /runner/, иначе (или если дельта не удалась)
+        вся страница.
+        """
+        key = _node_from_url(chat_url) or chat_url
+        if self.cached(chat_url):
+            try:
+                self._load_delta(key, chat_url)
+            except Exception as e:
+                log(f"CHAT: дельта-запрос не удался ({e}), загружаю чат целиком")
+                self._load_full(key, chat_url)
+        else:
+            self._load_full(key, chat_url)
+        return self.get(chat_url, limit)
+
+    def reload(self, chat_url: str) -> None:
+        """Загрузить диалог страницей целиком (свежие csrf-token и метаданные)."""
+        self._load_full(_node_from_url(chat_url) or chat_url, chat_url)
+
+    def bookmarks(self) -> List[Dict]:
+        """Закладки всех закэшированных диалогов: node_id, node_name, last_message_id."""
+        with self._lock:
+            return [
+                {
+                    "node_id": int(meta["node_id"]),
+                    "node_name": meta["node_name"],
+                    "last_message_id": int(meta.get("last_message_id") or 0),
+                }
+                for meta in self._meta.values()
+                if meta.get("node_id") and meta.get("node_name")
+            ]
+
+    def is_fresh(self, chat_url: str, last_message_id: Optional[int]) -> bool:
+        """В кэше уже есть сообщение last_message_id (из списка диалогов)?"""
+        key = _node_from_url(chat_url) or chat_url
+        with self._lock:
+            cached_id = (self._meta.get(key) or {}).get("last_message_id")
+        return cached_id is not None and last_message_id is not None and cached_id >= last_message_id
+
+    def get(self, chat_url: str, limit: int = 50) -> Tuple[List[Dict], Dict]:
+        """Что уже лежит в кэше, без сети."""
+        key = _node_from_url(chat_url) or chat_url
+        with self._lock:
+            messages = list((self._messages.get(key) or {}).values())
+            meta = dict(self._meta.get(key) or {})
+        if limit and len(messages) > limit:
+            messages = messages[-limit:]
+        return messages, meta
+
+
+class UnreadPrefetcher:
+    """
+    Фоновая подгрузка непрочитанных диалогов в MessageCache.
+
+    Пока пользователь смотрит на список в мониторе, max_workers потоков
+    тянут сообщения всех непрочитанных диалогов (дельтой, если диалог
+    уже в кэше). Запросы идут через лимит общего FunPayClient, так что
+    монитор и открытый чат не останавливаются. Когда диалог открывают, он уже в
+    кэше — show_chat рисует его без сети.
+    """
+
+    def __init__(self, cache: MessageCache, max_workers: int = 3, on_done=None) -> None:
+        self.cache = cache
+        self.on_done = on_done
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-prefetch")
+        self._lock = threading.Lock()
+        self._inflight: set[str] = set()
+
+    def schedule(self, chats: List[Dict]) -> int:
+        """Поставить в очередь непрочитанные диалоги, которых нет в кэше. Возвращает, сколько добавлено."""
+        added = 0
+        for ch in chats:
+            url = ch.get("url") or ""
+            if not ch.get("unread") or not url:
+                continue
+            if self.cache.is_fresh(url, ch.get("last_message_id")):
+                continue
+            with self._lock:
+                if url in self._inflight:
+                    continue
+                self._inflight.add(url)
+            self._pool.submit(self._run, url)
+            added += 1
+        return added
+
+    def _run(self, url: str) -> None:
+        ok = False
+        try:
+            self.cache.fetch(url, limit=0)
+            ok = True
+        except Exception as e:
+            log(f"CHAT: фоновая загрузка {url} не удалась: {e}")
+        finally:
+            with self._lock:
+                self._inflight.discard(url)
+        if self.on_done is not None:
+            self.on_done(url, ok)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------- отправка сообщения ----------
+
+def _post_chat_message(
+    client: FunPayClient,
+    meta: Dict,
+    content: str,
+) -> Optional[requests.Response]:
+    """
+    Отправка сообщения через /runner/ так же, как это делает браузер.
+
+    В HAR видно, что:
+    - параметр request = JSON: {"action":"chat_message","data":{...}}
+    - параметр objects = JSON-массив с orders_counters, chat_node, chat_bookmarks, c-p-u
+
+    None — в meta не хватает данных для отправки.
+    """
+
+    csrf_token = meta.get("csrf_token")
+    user_id = meta.get("user_id")
+    node_name = meta.get("node_name")
+    node_id = meta.get("node_id")
+    last_message_id = meta.get("last_message_id")
+    other_id = meta.get("other_id")
+    chat_url = meta.get("chat_url") or CHAT_URL
+
+    if not csrf_token or not user_id or not node_name or not node_id:
+        log("CHAT: нет csrf_token / user_id / node_name / node_id — не могу отправить сообщение")
+        return None
+
+    if last_message_id is None:
+        last_message_id = 0
+
+    # То, что браузер кладёт в параметр request
+    request_obj = {
+        "action": "chat_message",
+        "data": {
+            "node": node_name,
+            "last_message": last_message_id,
+            "content": content,
+        },
+    }
+
+    # Минимальный набор объектов, как в HAR:
+    objects = [
+        {
+            "type": "orders_counters",
+            "id": str(user_id),
+            "tag": "cli-oc",
+            "data": False,
+        },
+        {
+            "type": "chat_node",
+            "id": node_name,
+            "tag": "cli-chat",
+            "data": {
+                "node": node_name,
+                "last_message": last_message_id,
+                "content": content,
+            },
+        },
+        {
+            "type": "chat_bookmarks",
+            "id": str(user_id),
+            "tag": "cli-bm",
+            "data": [
+                [int(node_id), int(last_message_id)],
+            ],
+        },
+        {
+            "type": "c-p-u",
+            "id": str(other_id) if other_id is not None else "",
+            "tag": "cli-cpu",
+            "data": False,
+        },
+    ]
+
+    payload = {
+        "objects": json.dumps(objects, separators=(",", ":")),
+        "request": json.dumps(request_obj, separators=(",", ":")),
+        "csrf_token": csrf_token,
+    }
+
+    return client.request("POST", RUNNER_URL, data=payload, headers=_runner_headers(chat_url))
+
+
+def send_chat_message(
+    client: FunPayClient,
+    meta: Dict,
+    content: str,
+) -> bool:
+    """
+    Разовая отправка по готовой meta (из fetch_chat_messages). Ничего не
+    печатает: причину отказа пишет в лог, сообщить о ней — дело интерфейса.
+    """
+    resp = _post_chat_message(client, meta, content)
+    if resp is None:
+        log("CHAT: нет данных диалога для отправки")
+        return False
+    error = _runner_error(resp)
+    if error is not None:
+        log(f"CHAT: /runner/ не принял сообщение: {error}; ответ: {(resp.text or '')[:300]!r}")
+    return error is None
+
+
+def _runner_error(resp: requests.Response) -> Optional[str]:
+    """Текст ошибки из ответа /runner/ (None — всё хорошо)."""
+    if resp.status_code != 200:
+        return f"HTTP {resp.status_code}"
+    try:
+        data = resp.json()
+    except ValueError:
+        return "ответ не JSON"
+    response = data.get("response") if isinstance(data, dict) else None
+    if isinstance(response, dict) and response.get("error"):
+        return str(response.get("error"))
+    if isinstance(data, dict) and data.get("error"):
+        return str(data.get("msg") or data.get("error"))
+    return None
+
+
+def _never_sent(e: requests.RequestException) -> bool:
+    """
+    Запрос точно не дошёл до сервера: не удалось соединиться (DNS, TCP,
+    TLS). Таймаут чтения или обрыв после отправки сюда не относятся —
+    сервер мог уже принять сообщение.
+    """
+    if isinstance(e, (requests.ConnectTimeout, requests.exceptions.SSLError)):
+        return True
+    if isinstance(e, requests.ConnectionError):
+        reason = getattr(e.args[0], "reason", None) if e.args else None
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+class ChatSendError(RuntimeError):
+    """Сервер явно отклонил сообщение — оно не отправлено."""
+
+
+class ChatSendUncertain(RuntimeError):
+    """
+    Неизвестно, дошло ли сообщение (нет ответа после отправки, ответ не
+    разобрать). Повторять нельзя: покупатель получил бы его дважды.
+    """
+
+
+class ChatSession:
+    """
+    Быстрая отправка сообщений: одна POST на /runner/ вместо GET + POST.
+
+    csrf-token и userId (data-app-data) и метаданные диалогов (node_name,
+    node_id, last_message_id) берутся из MessageCache — туда они попадают
+    при первом открытии/фоновой подгрузке диалога. Страницу заново не
+    грузим, пока /runner/ не отклонит запрос (протух csrf-token), — тогда
+    перечитываем метаданные и повторяем один раз.
+
+    Повторяем только то, что точно не ушло: если не удалось соединиться,
+    сообщение встаёт в очередь, и фоновый поток пробует ещё раз с паузами
+    RETRY_DELAYS. Когда попытки кончились (или сервер отклонил отложенное
+    сообщение), вызывается on_failed(chat_url, content, error) — интерфейс
+    должен сказать об этом пользователю. Таймаут ответа и непонятный ответ
+    не повторяются (ChatSendUncertain). Новые сообщения из ответа сразу
+    кладутся в кэш.
+    """
+
+    RETRY_DELAYS = (2.0, 5.0, 15.0, 30.0)
+
+    def __init__(
+        self,
+        client: FunPayClient,
+        cache: MessageCache,
+        on_failed: Optional[Callable[[str, str, str], None]] = None,
+    ) -> None:
+        self.client = client
+        self.cache = cache
+        self.on_failed = on_failed
+        self._queue: "queue.Queue[tuple[str, str, int]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        # почему не удалась последняя send() — для интерфейса
+        self.last_error = ""
+
+    def _meta(self, chat_url: str, reload: bool = False) -> Dict:
+        _, meta = self.cache.get(chat_url, limit=1)
+        if reload or not meta.get("node_name") or not meta.get("csrf_token"):
+            # диалог ещё не открывали (или токен протух) — одна загрузка страницы
+            try:
+                self.cache.reload(chat_url)
+            except requests.HTTPError as e:
+                # 404 (не тот адрес), истекшая сессия — повтор не поможет
+                status = e.response.status_code if e.response is not None else "?"
+                raise ChatSendError(f"диалог не загрузился: HTTP {status}") from e
+            except requests.RequestException as e:
+                # в очередь повторов — только если не удалось соединиться
+                if _never_sent(e):
+                    raise
+                raise ChatSendError(f"диалог не загрузился: {type(e).__name__}") from e
+            _, meta = self.cache.get(chat_url, limit=1)
+        return meta
+
+    def _post(self, meta: Dict, content: str) -> Optional[requests.Response]:
+        try:
+            return _post_chat_message(self.client, meta, content)
+        except requests.RequestException as e:
+            if _never_sent(e):
+                raise
+            raise ChatSendUncertain(
+                f"нет ответа сервера ({type(e).__name__}); сообщение могло уйти — проверьте диалог"
+            ) from e
+
+    def _send_once(self, chat_url: str, content: str) -> None:
+        """
+        Отправить. requests.RequestException — соединиться не удалось (можно
+        повторить), ChatSendError — отклонено, ChatSendUncertain — см. класс.
+        """
+        meta = self._meta(chat_url)
+        for attempt in range(2):
+            resp = self._post(meta, content)
+            if resp is None:
+                error = "нет данных диалога"
+            else:
+                error = _runner_error(resp)
+                if error is None:
+                    break
+                if error == "ответ не JSON" or resp.status_code >= 500:
+                    raise ChatSendUncertain(f"{error}; сообщение могло уйти — проверьте диалог")
+            if attempt == 1:
+                raise ChatSendError(error)
+            # отказ сервера — скорее всего, протух csrf-token: обновляем и пробуем ещё раз
+            meta = self._meta(chat_url, reload=True)
+        try:
+            self.cache.apply_runner_objects(resp.json().get("objects") or [])
+        except ValueError:
+            pass
+        self.sent += 1
+
+    def send(self, chat_url: str, content: str) -> bool:
+        """
+        Отправить сразу. False — не вышло (причина в last_error): сообщение
+        поставлено в очередь повторов, если соединиться не удалось, иначе
+        не повторяется.
+        """
+        self.last_error = ""
+        try:
+            self._send_once(chat_url, content)
+            return True
+        except requests.RequestException as e:
+            self.last_error = f"сеть недоступна ({e}), сообщение в очереди на повтор"
+            self._enqueue(chat_url, content, 0)
+        except ChatSendUncertain as e:
+            self.last_error = str(e)
+        except Exception as e:
+            self.last_error = f"сервер не принял сообщение: {e}"
+            self.failed += 1
+        log(f"CHAT: отправка в {chat_url}: {self.last_error}")
+        return False
+
+    def _enqueue(self, chat_url: str, content: str, attempt: int) -> None:
+        self._queue.put((chat_url, content, attempt))
+        # один долгоживущий поток: очередь он не бросает, так что сообщение,
+        # положенное в любой момент, будет разобрано
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._retry_loop, name="chat-send", daemon=True)
+                self._worker.start()
+
+    def _give_up(self, chat_url: str, content: str, error: str) -> None:
+        self.failed += 1
+        log(f"CHAT: отложенное сообщение не отправлено ({chat_url}): {error}")
+        if self.on_failed is not None:
+            try:
+                self.on_failed(chat_url, content, error)
+            except Exception as e:
+                log(f"CHAT: ошибка в on_failed: {e}")
+
+    def _retry_loop(self) -> None:
+        while True:
+            chat_url, content, attempt = self._queue.get()
+            time.sleep(self.RETRY_DELAYS[min(attempt, len(self.RETRY_DELAYS) - 1)])
+            try:
+                self._send_once(chat_url, content)
+                log(f"CHAT: отложенное сообщение отправлено ({chat_url})")
+            except requests.RequestException as e:
+                if attempt + 1 < len(self.RETRY_DELAYS):
+                    self._queue.put((chat_url, content, attempt + 1))
+                else:
+                    self._give_up(chat_url, content, f"сеть недоступна ({e})")
+            except Exception as e:
+                self._give_up(chat_url, content, str(e))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
@@ -1,18 +1,24 @@
 from __future__ import annotations
 
 import os
+import threading
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, List, Optional
 
-from .api import FunPayClient
 from .models import Category, Lot
-from .settings import load_settings, save_settings, get_base_dir
+from .filters import FilterError, LotFilter, compile_filter
+from .settings import load_settings, save_settings, get_base_dir, subscribe
 from .color import apply_color, color_description
 from .logger import log
+from .render import clear_screen
 from .utils import greet_time_phrase
-from . import ai_bot
-from . import games_index
-from .balance import fetch_balance
+from . import startup
+
+# requests/bs4 (через api и balance) и ai_bot грузятся при первом
+# обращении: до первого меню они не нужны
+if TYPE_CHECKING:
+    from .api import FunPayClient
+    from .balance import BalanceService
 
 # ---------- цвета ANSI для CLI ----------
 
@@ -49,7 +55,7 @@ def _clean_account_name(name: str | None) -> str | None:
 
 def initial_setup(cfg: dict) -> dict:
     """Первичный запуск: обращение (обязательно), User-Agent, golden_key."""
-    os.system("cls")
+    clear_screen()
 
     print("=== Первичная настройка Kypisa CLI ===")
     print("Если что-то не знаешь — просто нажми Enter, кроме полей, которые нельзя оставить пустыми.\n")
@@ -103,6 +109,8 @@ def initial_setup(cfg: dict) -> dict:
 
         # Пытаемся в фоне узнать имя аккаунта, но НЕ ломаем настройку, если не получилось
         try:
+            from .api import FunPayClient
+
             test_client = FunPayClient(gk, cfg.get("user_agent"))
             username = _clean_account_name(test_client.get_username())
         except Exception:
@@ -177,6 +185,8 @@ def settings_menu(cfg: dict) -> dict:
                 cfg["golden_key"] = new_gk
 
                 try:
+                    from .api import FunPayClient
+
                     test_client = FunPayClient(new_gk, cfg.get("user_agent"))
                     username = _clean_account_name(test_client.get_username())
                 except Exception:
@@ -292,6 +302,8 @@ def select_category(client: FunPayClient) -> Category | None:
     1) сначала выбираем игру,
     2) потом выбираем, что в ней смотреть (робуксы, аккаунты, режимы и т.п.).
     """
+    from . import games_index
+
     while True:
         raw_query = input(
             "Введите название ИГРЫ (rust, roblox, cs2, ...) "
@@ -374,6 +386,25 @@ def select_category(client: FunPayClient) -> Category | None:
             return Category(name=f"{game_name} — {sel_name}", url=sel_url, count=None)
 
 
+# ───────────────────── Фильтр лотов ─────────────────────
+
+
+def ask_lot_filter() -> LotFilter | None:
+    """Спрашиваем фильтр (см. kypisa.filters); пусто — без фильтра."""
+    print(
+        "Фильтр лотов, например: price < 100 and rating >= 4 and online\n"
+        "Поля: price, rating, reviews, online, game, type, method, desc, seller, stock."
+    )
+    while True:
+        raw = input("Фильтр (Enter — без фильтра): ").strip()
+        if not raw:
+            return None
+        try:
+            return compile_filter(raw)
+        except FilterError as e:
+            print(f"Ошибка в фильтре: {e}")
+
+
 # ───────────────────── Таблица лотов ─────────────────────
 
 
@@ -439,7 +470,11 @@ def show_lots(lots: List[Lot], nickname: str) -> None:
 
 # ───────────────────── ИИ-анализ ─────────────────────
 
-def run_ai_for_category(client: FunPayClient, category: Category) -> None:
+def run_ai_for_category(
+    client: FunPayClient,
+    category: Category,
+    lot_filter: LotFilter | None = None,
+) -> None:
     print(f"Загружаю лоты для: {category.name} ...")
     try:
         lots = client.get_lots_for_category(category)
@@ -452,7 +487,9 @@ def run_ai_for_category(client: FunPayClient, category: Category) -> None:
         print("Лоты не найдены, ИИ нечего анализировать.")
         return
 
-    result = ai_bot.analyze(lots)
+    from . import ai_bot
+
+    result = ai_bot.analyze(lots, lot_filter)
     if not result:
         print("ИИ не смог посчитать цены (нет подходящих лотов).")
         return
@@ -473,6 +510,8 @@ def run_ai_for_category(client: FunPayClient, category: Category) -> None:
         )
 
     # ищем просто самый дешёвый лот с положительной ценой
+    if lot_filter is not None:
+        lots = lot_filter.apply(lots)
     valid_lots = [l for l in lots if l.price and l.price > 0]
     cheapest = min(valid_lots, key=lambda l: l.price) if valid_lots else None
     if cheapest and cheapest.url:
@@ -486,28 +525,106 @@ def run_ai_for_category(client: FunPayClient, category: Category) -> None:
 # ───────────────────── Баланс ─────────────────────
 
 
-def print_balance_inline(cfg: dict) -> None:
-    """Краткий баланс под строкой 'Держу жизнь...' в главном меню."""
-    golden_key = cfg.get("golden_key")
-    if not golden_key:
+def _format_age(seconds: float) -> str:
+    if seconds < 60:
+        return "только что"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} мин назад"
+    return f"{int(seconds // 3600)} ч назад"
+
+
+class _Backend:
+    """
+    FunPayClient (а с ним requests и bs4) и BalanceService создаются в
+    потоке kypisa-startup, пока рисуется первое меню; client() дожидается
+    готовности. balance — None, пока сервис не запущен.
+
+    Сменились golden_key или User-Agent (в настройках или в config.json
+    снаружи) — старые клиент и сервис баланса останавливаются и
+    создаются заново с новыми значениями.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self._cfg = cfg
+        self._ready = threading.Event()
+        self._client: Optional[FunPayClient] = None
+        self._error: Optional[BaseException] = None
+        self.balance: Optional[BalanceService] = None
+        self._start()
+        self._unsubscribe = subscribe(self._on_settings, keys=("golden_key", "user_agent"))
+
+    def _start(self) -> None:
+        self._ready.clear()
+        threading.Thread(target=self._run, name="kypisa-startup", daemon=True).start()
+
+    def _on_settings(self, changed: set, cfg: dict) -> None:
+        # дожидаемся текущего запуска, чтобы не остался второй BalanceService
+        self._ready.wait()
+        log(f"Сменились {', '.join(sorted(changed))} — пересоздаю клиент FunPay")
+        if self.balance is not None:
+            self.balance.stop()
+        self.balance = None
+        self._client = None
+        self._error = None
+        self._cfg = cfg
+        self._start()
+
+    def _run(self) -> None:
+        try:
+            from .api import FunPayClient
+            from .balance import BalanceService
+
+            self._client = FunPayClient(self._cfg["golden_key"], self._cfg.get("user_agent"))
+            # баланс обновляется в фоне той же сессией; меню его только показывает
+            balance = BalanceService(self._client)
+            balance.start()
+            self.balance = balance
+        except BaseException as e:
+            self._error = e
+            log(f"Ошибка при запуске клиента FunPay: {e}")
+        finally:
+            self._ready.set()
+
+    def client(self) -> FunPayClient:
+        self._ready.wait()
+        if self._client is None:
+            raise self._error or RuntimeError("клиент FunPay не создан")
+        return self._client
+
+    def stop(self) -> None:
+        self._unsubscribe()
+        if self.balance is not None:
+            self.balance.stop()
+
+
+def print_balance_inline(balance: BalanceService | None) -> None:
+    """
+    Краткий баланс под строкой 'Держу жизнь...' в главном меню.
+    Сеть здесь не трогаем: берём то, что уже получил фоновый поток
+    (None — клиент ещё запускается).
+    """
+    if balance is None:
+        print(f"Баланс: {DIM}загружается...{RESET}")
         return
-    user_agent = cfg.get("user_agent")
-    try:
-        info = fetch_balance(golden_key, user_agent)
-    except Exception:
-        print("Баланс: [ошибка получения]")
+    snap = balance.snapshot()
+    if snap.info is None:
+        if snap.error is not None:
+            print("Баланс: [ошибка получения]")
+        else:
+            print(f"Баланс: {DIM}загружается...{RESET}")
         return
 
-    print(f"Баланс: ₽ {info.rub:.2f} | $ {info.usd:.2f} | € {info.eur:.2f}")
+    info = snap.info
+    line = f"Баланс: ₽ {info.rub:.2f} | $ {info.usd:.2f} | € {info.eur:.2f}"
+    if snap.stale:
+        why = "ошибка обновления, " if snap.error is not None else ""
+        line += f" {GRAY}[устарел: {why}обновлено {_format_age(snap.age or 0.0)}]{RESET}"
+    print(line)
 
 
 # ───────────────────── Пчелиный дизайн ─────────────────────
 
 
-def clear_screen() -> None:
-    os.system("cls")
-
-
 def print_bee_header(cfg: dict) -> None:
     logs = "ON" if cfg.get("log_enabled", True) else "OFF"
     acc_name = cfg.get("account_name") or "—"
@@ -529,7 +646,7 @@ def print_bee_header(cfg: dict) -> None:
     print()
 
 
-def print_main_menu(cfg: dict) -> None:
+def print_main_menu(cfg: dict, balance: BalanceService | None = None) -> None:
     print(f"{MAGENTA}┌ Главное меню ──────────────────────────────────────────────────────┐{RESET}")
     print(f"{MAGENTA}│{RESET}  1 — Найти игру / предложение и показать лоты                      {MAGENTA}│{RESET}")
     print(f"{MAGENTA}│{RESET}  2 — Настройки Kypisa                                              {MAGENTA}│{RESET}")
@@ -540,7 +657,7 @@ def print_main_menu(cfg: dict) -> None:
     print(f"{GREEN}FunPay: CONNECTED{RESET} | {YELLOW}Golden key: OK{RESET} | {BLUE}User-Agent: OK{RESET}")
     print(f"{DIM}Держу жизнь — мониторю самые дешёвые лоты ради тебя 🐝{RESET}")
     print()
-    print_balance_inline(cfg)
+    print_balance_inline(balance)
     print()
 
 
@@ -560,13 +677,15 @@ def main() -> None:
         cfg["color_code"] = "E"
         save_settings(cfg)
     apply_color(cfg.get("color_code", ""))
+    startup.mark("настройки и цвет")
 
-    client = FunPayClient(cfg["golden_key"], cfg.get("user_agent"))
+    # клиент FunPay и баланс поднимаются в фоне, пока рисуется меню
+    backend = _Backend(cfg)
 
     # Подтягиваем реальное имя аккаунта, если вдруг его ещё нет
     if not cfg.get("account_name"):
         try:
-            acc_name = _clean_account_name(client.get_username())
+            acc_name = _clean_account_name(backend.client().get_username())
         except Exception:
             acc_name = None
         if acc_name:
@@ -581,11 +700,13 @@ def main() -> None:
     while True:
         clear_screen()
         print_bee_header(cfg)
-        print_main_menu(cfg)
+        print_main_menu(cfg, backend.balance)
+        startup.ready("main.py", ["kypisa.cli", "kypisa.api", "kypisa.balance"])
         cmd = input("> ").strip()
 
         if cmd == "1":
             log("Меню: поиск игры/предложения")
+            client = backend.client()
             cat = select_category(client)
             if not cat:
                 continue
@@ -599,6 +720,10 @@ def main() -> None:
                 input("\nНажми Enter, чтобы продолжить...")
                 continue
             log(f"Загружено лотов: {len(lots)}")
+            lot_filter = ask_lot_filter()
+            if lot_filter is not None:
+                lots = lot_filter.apply(lots)
+                log(f"Фильтр '{lot_filter.source}': осталось лотов {len(lots)}")
             show_lots(lots, cfg.get("nickname") or "—")
             input("\nНажми Enter, чтобы вернуться в меню...")
 
@@ -610,6 +735,7 @@ def main() -> None:
             log("Открыта аналитика ИИ")
 
             # Используем общий выбор категории через games_from_main.json
+            client = backend.client()
             category = select_category(client)
             if not category:
                 print("Категория не выбрана.")
@@ -617,7 +743,7 @@ def main() -> None:
                 continue
 
             log(f"ИИ-анализ для категории: {category.name} ({category.url})")
-            run_ai_for_category(client, category)
+            run_ai_for_category(client, category, ask_lot_filter())
             input("\nНажми Enter, чтобы вернуться в меню...")
 
 
@@ -627,6 +753,7 @@ def main() -> None:
 
         elif cmd == "0":
             log("Выход из программы")
+            backend.stop()
             print("Пока, от Кипси :)")
             break
 
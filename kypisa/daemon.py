@@ -0,0 +1,591 @@
+"""
+Нотификатор без вопросов в консоли — для запуска как сервис.
+
+Все подписки описываются в JSON-файле (по умолчанию watches.json рядом
+с config.json):
+
+    {
+      "max_concurrency": 4,
+      "max_requests_per_minute": 60,
+      "report_every": 300,
+      "channels": ["telegram"],
+      "telegram": {"token": "...", "chat_ids": ["123"]},
+      "defaults": {"interval": 30, "price_floor": 0.3},
+      "watches": [
+        {"url": "https://funpay.com/lots/1234/", "name": "Robux",
+         "interval": 20, "filter": "rating >= 4 and online", "top_k": 3},
+        {"url": "https://funpay.com/chips/99/", "adaptive": true,
+         "channels": ["telegram", "windows"]}
+      ]
+    }
+
+Файл целиком проверяется до запуска (все ошибки сразу, с путём до поля).
+Пока демон работает, изменения файла подхватываются на ходу: подписки
+добавляются/убираются без потери состояния. Если новый вариант файла с
+ошибкой — работаем дальше со старым. Общие настройки (telegram,
+max_concurrency, лимит запросов) применяются только при перезапуске.
+
+Тысячи категорий можно разнести по процессам: --workers N запускает N
+воркеров, каждый берёт свою долю категорий по консистентному хешу URL
+(kypisa.shards). Воркеры отмечаются в общем watch_state.db, и когда
+кто-то приходит или уходит, категории перераспределяются. Двойных
+уведомлений при этом не бывает: отправку "забирает" атомарный
+claim_alert в том же файле. max_requests_per_minute — общий лимит на
+всех: каждый воркер берёт себе долю по числу живых воркеров.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+from .api import FunPayClient
+from .filters import FilterError, compile_filter
+from .models import Category
+from .notifier import SUBS_FILE, WATCH_CACHE_TTL_SECONDS, _get_chat_ids, watch_many
+from .ratelimit import RateLimiter
+from .scheduler import Watch
+from .shards import ShardRegistry
+from .telegram import SubscriberService
+from .settings import get_base_dir, load_settings
+from .logger import log
+
+WATCH_FILE = os.path.join(get_base_dir(), "watches.json")
+
+# воркер, упавший быстрее, чем за столько секунд после запуска, считается
+# "быстрым падением"; после WORKER_MAX_FAST_FAILS подряд его не перезапускаем
+WORKER_FAST_FAIL_SECONDS = 30.0
+WORKER_MAX_FAST_FAILS = 5
+# код выхода воркера при ошибках в файле подписок — перезапуск не поможет
+EXIT_CONFIG_ERROR = 2
+
+CHANNELS = ("telegram", "windows")
+
+_WATCH_KEYS = {
+    "url", "name", "key", "interval", "jitter", "price_floor", "method",
+    "filter", "top_k", "adaptive", "min_interval", "max_interval", "channels",
+}
+_TOP_KEYS = {
+    "watches", "defaults", "channels", "telegram", "max_concurrency",
+    "max_requests_per_minute", "report_every",
+}
+
+
+class DaemonConfigError(ValueError):
+    """Ошибки в файле подписок; errors — по одной строке на проблему."""
+
+    def __init__(self, errors: List[str]) -> None:
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+@dataclass
+class DaemonConfig:
+    watches: List[Watch]
+    max_concurrency: int = 4
+    max_requests_per_minute: Optional[float] = 60.0
+    report_every: float = 300.0
+    tg_token: str = ""
+    tg_chat_ids: List[str] = field(default_factory=list)
+
+
+def _number(errors: List[str], where: str, value: Any, minimum: float, integer: bool = False) -> Any:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        errors.append(f"{where}: нужно число, а не {value!r}")
+        return None
+    if integer and int(value) != value:
+        errors.append(f"{where}: нужно целое число, а не {value!r}")
+        return None
+    if value < minimum:
+        errors.append(f"{where}: должно быть >= {minimum:g}")
+        return None
+    return int(value) if integer else float(value)
+
+
+def _channels(errors: List[str], where: str, value: Any) -> Optional[List[str]]:
+    if value is None:
+        return None
+    if not isinstance(value, list) or not all(isinstance(c, str) for c in value):
+        errors.append(f"{where}: нужен список каналов, например [\"telegram\"]")
+        return None
+    unknown = [c for c in value if c not in CHANNELS]
+    if unknown:
+        errors.append(f"{where}: неизвестные каналы {', '.join(unknown)}; есть: {', '.join(CHANNELS)}")
+        return None
+    return list(value)
+
+
+def _parse_watch(errors: List[str], where: str, raw: Any, defaults: Dict[str, Any]) -> Optional[Watch]:
+    if not isinstance(raw, dict):
+        errors.append(f"{where}: нужен объект с полями подписки")
+        return None
+    unknown = set(raw) - _WATCH_KEYS
+    if unknown:
+        errors.append(f"{where}: неизвестные поля {', '.join(sorted(unknown))}")
+    spec = {**defaults, **raw}
+    n_errors = len(errors)
+
+    url = spec.get("url")
+    if not isinstance(url, str) or not url.strip():
+        errors.append(f"{where}.url: нужна ссылка на категорию FunPay")
+        url = ""
+    url = url.strip()
+    name = spec.get("name") or url
+
+    interval = _number(errors, f"{where}.interval", spec.get("interval", 30), 1)
+    jitter = spec.get("jitter")
+    if jitter is not None:
+        jitter = _number(errors, f"{where}.jitter", jitter, 0)
+    price_floor = _number(errors, f"{where}.price_floor", spec.get("price_floor", 0.30), 0)
+    top_k = _number(errors, f"{where}.top_k", spec.get("top_k", 1), 1, integer=True)
+    min_interval = _number(errors, f"{where}.min_interval", spec.get("min_interval", 5), 1)
+    max_interval = _number(errors, f"{where}.max_interval", spec.get("max_interval", 600), 1)
+
+    method = spec.get("method")
+    if method is not None and not isinstance(method, str):
+        errors.append(f"{where}.method: нужна строка")
+    filter_expr = spec.get("filter")
+    if filter_expr is not None:
+        if not isinstance(filter_expr, str):
+            errors.append(f"{where}.filter: нужна строка")
+        else:
+            try:
+                compile_filter(filter_expr)
+            except FilterError as e:
+                errors.append(f"{where}.filter: {e}")
+    adaptive = spec.get("adaptive", False)
+    if not isinstance(adaptive, bool):
+        errors.append(f"{where}.adaptive: нужно true или false")
+    channels = _channels(errors, f"{where}.channels", spec.get("channels"))
+
+    if len(errors) > n_errors:
+        return None
+    return Watch(
+        category=Category(name=str(name), url=url),
+        interval_seconds=interval,
+        jitter_seconds=jitter if jitter is not None else min(5.0, interval * 0.1),
+        price_floor=price_floor,
+        method_filter=method or None,
+        filter_expr=filter_expr or None,
+        key=str(spec.get("key") or url),
+        adaptive=adaptive,
+        min_interval_seconds=min_interval,
+        max_interval_seconds=max_interval,
+        top_k=top_k,
+        channels=channels,
+    )
+
+
+def parse_config(data: Any, cfg: Dict[str, Any] | None = None) -> DaemonConfig:
+    """Проверить содержимое файла подписок целиком; при ошибках — DaemonConfigError."""
+    cfg = cfg or {}
+    errors: List[str] = []
+    if not isinstance(data, dict):
+        raise DaemonConfigError(["файл подписок должен быть JSON-объектом"])
+    unknown = set(data) - _TOP_KEYS
+    if unknown:
+        errors.append(f"неизвестные поля {', '.join(sorted(unknown))}")
+
+    defaults = data.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        errors.append("defaults: нужен объект")
+        defaults = {}
+    channels = _channels(errors, "channels", data.get("channels"))
+    if channels is not None:
+        defaults = {"channels": channels, **defaults}
+
+    watches: List[Watch] = []
+    raw_watches = data.get("watches")
+    if not isinstance(raw_watches, list) or not raw_watches:
+        errors.append("watches: нужен непустой список подписок")
+        raw_watches = []
+    seen: Dict[str, int] = {}
+    for i, raw in enumerate(raw_watches):
+        watch = _parse_watch(errors, f"watches[{i}]", raw, defaults)
+        if watch is None:
+            continue
+        if watch.key in seen:
+            errors.append(f"watches[{i}]: та же подписка, что и watches[{seen[watch.key]}] ({watch.key})")
+            continue
+        seen[watch.key] = i
+        watches.append(watch)
+
+    max_concurrency = _number(errors, "max_concurrency", data.get("max_concurrency", 4), 1, integer=True)
+    rpm = data.get("max_requests_per_minute", cfg.get("notifier_max_rpm") or 60)
+    if rpm is not None:
+        rpm = _number(errors, "max_requests_per_minute", rpm, 1)
+    report_every = _number(errors, "report_every", data.get("report_every", 300), 10)
+
+    tg = data.get("telegram") or {}
+    if not isinstance(tg, dict):
+        errors.append("telegram: нужен объект {\"token\": ..., \"chat_ids\": [...]}")
+        tg = {}
+    token = tg.get("token", cfg.get("tg_bot_token") or "")
+    raw_ids = tg.get("chat_ids", cfg.get("tg_chat_id") or "")
+    if isinstance(raw_ids, list):
+        raw_ids = ",".join(str(c) for c in raw_ids)
+    if not isinstance(token, str) or not isinstance(raw_ids, (str, int)):
+        errors.append("telegram: token — строка, chat_ids — список или строка через запятую")
+        token, raw_ids = "", ""
+    token = token.strip()
+    if token.lower() == "no":
+        token = ""
+
+    if errors:
+        raise DaemonConfigError(errors)
+    return DaemonConfig(
+        watches=watches,
+        max_concurrency=max_concurrency,
+        max_requests_per_minute=rpm,
+        report_every=report_every,
+        tg_token=token,
+        tg_chat_ids=_get_chat_ids(str(raw_ids)) if token else [],
+    )
+
+
+def load_config(path: str, cfg: Dict[str, Any] | None = None) -> DaemonConfig:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        raise DaemonConfigError([f"файл подписок не найден: {path}"]) from None
+    except (OSError, ValueError) as e:
+        raise DaemonConfigError([f"не удалось прочитать {path}: {e}"]) from None
+    return parse_config(data, cfg)
+
+
+class _Reloader:
+    """Следит за mtime файла подписок; при изменении — перечитывает и проверяет."""
+
+    def __init__(self, path: str, cfg: Dict[str, Any], check_every: float = 2.0) -> None:
+        self.path = path
+        self.cfg = cfg
+        self.check_every = check_every
+        self._mtime = self._stat()
+        self._next_check = time.monotonic() + check_every
+
+    def _stat(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def __call__(self) -> Optional[List[Watch]]:
+        now = time.monotonic()
+        if now < self._next_check:
+            return None
+        self._next_check = now + self.check_every
+        mtime = self._stat()
+        if mtime is None or mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            config = load_config(self.path, self.cfg)
+        except DaemonConfigError as e:
+            print(f"Файл подписок изменён, но в нём ошибки — продолжаю со старым:\n{e}")
+            log(f"DAEMON: новый {self.path} не принят:\n{e}")
+            return None
+        log(f"DAEMON: {self.path} изменён, подписок: {len(config.watches)}")
+        return config.watches
+
+
+def resource_usage() -> str:
+    """Потребление процесса: CPU, пиковая память, потоки."""
+    parts = [f"CPU: {time.process_time():.1f} с", f"потоков: {threading.active_count()}"]
+    if resource is not None:
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        parts.append(f"пик памяти: {rss_kb / 1024:.1f} МБ")
+    return "Ресурсы процесса — " + ", ".join(parts)
+
+
+def _stop_on_sigterm() -> None:
+    """SIGTERM от менеджера сервисов останавливаем так же, как Ctrl+C."""
+
+    def handler(signum: int, frame: Any) -> None:
+        raise KeyboardInterrupt
+
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, handler)
+
+
+class _ShardedReloader:
+    """
+    Подписки одного воркера шарда: из файла подписок берём только те
+    категории, которые кольцо (kypisa.shards.HashRing) отдаёт этому
+    воркеру. Заодно отмечаем heartbeat и следим за составом воркеров:
+    кто-то пришёл или ушёл — пересчитываем свою долю.
+
+    Общий лимит запросов (rpm) делится поровну между живыми воркерами:
+    частота limiter пересчитывается при каждой смене состава. min_workers —
+    сколько воркеров заведомо будет (их запускает один координатор), чтобы
+    до первого heartbeat соседей никто не взял себе весь лимит.
+    """
+
+    def __init__(
+        self,
+        registry: ShardRegistry,
+        source: _Reloader,
+        watches: List[Watch],
+        rpm: Optional[float] = None,
+        min_workers: int = 1,
+    ) -> None:
+        self.registry = registry
+        self.source = source
+        self.watches = watches
+        self.rpm = rpm
+        self.min_workers = max(1, min_workers)
+        self._ring = registry.ring()
+        self._next_beat = time.monotonic() + registry.ttl / 3
+        self.limiter = RateLimiter(self._share()) if rpm else None
+
+    def _share(self) -> float:
+        return float(self.rpm or 0) / max(self.min_workers, len(self._ring.nodes))
+
+    def owns(self, url: str) -> bool:
+        return self._ring.owner(url) == self.registry.worker_id
+
+    def owned(self) -> List[Watch]:
+        return [w for w in self.watches if self.owns(w.category.url)]
+
+    def __call__(self) -> Optional[List[Watch]]:
+        changed = False
+        new_watches = self.source()
+        if new_watches is not None:
+            self.watches = new_watches
+            changed = True
+        now = time.monotonic()
+        if now >= self._next_beat:
+            self._next_beat = now + self.registry.ttl / 3
+            self.registry.heartbeat()
+            ring = self.registry.ring()
+            if ring.nodes != self._ring.nodes:
+                log(f"SHARD: состав воркеров: {', '.join(ring.nodes) or '—'}")
+                self._ring = ring
+                changed = True
+                if self.limiter is not None:
+                    self.limiter.set_rate(self._share())
+                    log(f"SHARD: {self.registry.worker_id}: лимит {self.limiter.per_minute:.1f} запросов в минуту")
+        return self.owned() if changed else None
+
+
+def _run_worker(watch_file: str, worker_id: str, min_workers: int = 1) -> int:
+    """
+    Один воркер шарда (отдельный процесс или отдельная машина). Его доля
+    общего лимита запросов — rpm / число живых воркеров в ShardRegistry.
+    """
+    started = time.perf_counter()
+    cfg = load_settings()
+    try:
+        config = load_config(watch_file, cfg)
+    except DaemonConfigError as e:
+        print(f"[{worker_id}] Ошибки в {watch_file}:\n{e}")
+        return EXIT_CONFIG_ERROR
+    client = FunPayClient(cfg["golden_key"], cfg.get("user_agent") or None, cache_ttl=WATCH_CACHE_TTL_SECONDS)
+    _stop_on_sigterm()
+
+    registry = ShardRegistry(worker_id)
+    registry.join()
+    reloader = _ShardedReloader(
+        registry,
+        _Reloader(watch_file, cfg),
+        config.watches,
+        rpm=config.max_requests_per_minute,
+        min_workers=min_workers,
+    )
+    owned = reloader.owned()
+    startup_ms = (time.perf_counter() - started) * 1000
+    print(f"[{worker_id}] Воркер: {len(owned)} из {len(config.watches)} подписок, запуск {startup_ms:.0f} мс.")
+    log(f"DAEMON: воркер {worker_id}, подписок {len(owned)}, запуск {startup_ms:.0f} мс")
+
+    try:
+        watch_many(
+            client,
+            owned,
+            max_concurrency=config.max_concurrency,
+            rate_limiter=reloader.limiter,
+            tg_token=config.tg_token,
+            tg_chat_ids=config.tg_chat_ids,
+            reload=reloader,
+            status=lambda: f"[{worker_id}] {resource_usage()}",
+            report_every=config.report_every,
+            owns=reloader.owns,
+            poll_updates=False,
+            outbox_path=os.path.join(get_base_dir(), f"notify_outbox.{worker_id}.json"),
+        )
+    finally:
+        registry.leave()
+        registry.close()
+    return 0
+
+
+def _worker_process(watch_file: str, worker_id: str, min_workers: int) -> None:
+    """Точка входа процесса-воркера: код возврата _run_worker уходит в exitcode."""
+    sys.exit(_run_worker(watch_file, worker_id, min_workers))
+
+
+def _supervise(watch_file: str, config: DaemonConfig, workers: int, poll_updates: bool) -> int:
+    """
+    Запустить workers процессов-шардов и следить за ними: упавший воркер
+    перезапускаем под тем же id (он подхватит свою очередь доставки).
+    Сам процесс-координатор опросов не делает — только getUpdates бота,
+    чтобы подписчики и правила /alert велись в одном месте.
+
+    Не перезапускаем воркер, который вышел сам (код 0), нашёл ошибки в
+    файле подписок (EXIT_CONFIG_ERROR) или падает сразу после старта
+    WORKER_MAX_FAST_FAILS раз подряд; паузы между быстрыми падениями
+    растут. Когда не осталось ни одного воркера, координатор выходит
+    с кодом последнего из них.
+    """
+    host = socket.gethostname()
+    ctx = multiprocessing.get_context("spawn")
+    procs: Dict[int, Any] = {}
+    started_at: Dict[int, float] = {}
+    fast_fails: Dict[int, int] = {}
+    restart_at: Dict[int, float] = {}
+    exit_code = 0
+
+    def spawn(i: int) -> None:
+        proc = ctx.Process(
+            target=_worker_process,
+            args=(watch_file, f"{host}-{i}", workers),
+            name=f"kypisa-shard-{i}",
+        )
+        proc.start()
+        procs[i] = proc
+        started_at[i] = time.monotonic()
+
+    subscribers: Optional[SubscriberService] = None
+    if config.tg_token and poll_updates:
+        subscribers = SubscriberService(config.tg_token, SUBS_FILE)
+        subscribers.start()
+
+    _stop_on_sigterm()
+    for i in range(workers):
+        spawn(i)
+    print(f"Запущено воркеров: {workers} (Ctrl+C — остановить все).")
+    try:
+        while procs or restart_at:
+            time.sleep(1.0)
+            now = time.monotonic()
+            for i, proc in list(procs.items()):
+                if proc.is_alive():
+                    continue
+                del procs[i]
+                code = proc.exitcode
+                exit_code = code if code is not None else 1
+                name = f"{host}-{i}"
+                if code == 0:
+                    print(f"Воркер {name} завершился.")
+                    log(f"DAEMON: воркер {name} завершился (код 0)")
+                    continue
+                if code == EXIT_CONFIG_ERROR:
+                    print(f"Воркер {name} остановлен: ошибки в {watch_file}.")
+                    log(f"DAEMON: воркер {name}: ошибки в {watch_file}, не перезапускаю")
+                    continue
+                if now - started_at[i] < WORKER_FAST_FAIL_SECONDS:
+                    fast_fails[i] = fast_fails.get(i, 0) + 1
+                else:
+                    fast_fails[i] = 0
+                if fast_fails[i] >= WORKER_MAX_FAST_FAILS:
+                    print(f"Воркер {name} падает сразу после запуска (код {code}) — больше не перезапускаю.")
+                    log(f"DAEMON: воркер {name}: {fast_fails[i]} быстрых падений подряд, не перезапускаю")
+                    continue
+                delay = min(60.0, 2.0 ** fast_fails[i])
+                print(f"Воркер {name} завершился (код {code}), перезапуск через {delay:.0f} с.")
+                log(f"DAEMON: воркер {name} упал с кодом {code}, перезапуск через {delay:.0f} с")
+                restart_at[i] = now + delay
+            for i, due in list(restart_at.items()):
+                if now >= due:
+                    del restart_at[i]
+                    spawn(i)
+        print("Все воркеры остановлены.")
+    except KeyboardInterrupt:
+        print("\nОстанавливаю воркеров...")
+        exit_code = 0
+    finally:
+        for proc in procs.values():
+            if proc.is_alive():
+                proc.terminate()
+        for proc in procs.values():
+            proc.join(10)
+        if subscribers is not None:
+            subscribers.stop()
+    return exit_code
+
+
+def main(argv: List[str] | None = None) -> int:
+    started = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Нотификатор FunPay без интерактивных вопросов")
+    parser.add_argument("watch_file", nargs="?", default=WATCH_FILE, help="JSON-файл с подписками")
+    parser.add_argument("--check", action="store_true", help="только проверить файл и выйти")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="разбить подписки на N процессов-шардов (консистентное хеширование URL)",
+    )
+    parser.add_argument(
+        "--worker-id",
+        help=(
+            "запустить один воркер шарда с этим id (например, на второй машине с общим "
+            "watch_state.db); getUpdates бота такой воркер не опрашивает"
+        ),
+    )
+    parser.add_argument(
+        "--no-tg-updates", action="store_true",
+        help="не опрашивать getUpdates бота (его ведёт другой экземпляр)",
+    )
+    args = parser.parse_args(argv)
+
+    cfg = load_settings()
+    try:
+        config = load_config(args.watch_file, cfg)
+    except DaemonConfigError as e:
+        print(f"Ошибки в {args.watch_file}:\n{e}")
+        return 2
+    if args.check:
+        print(f"{args.watch_file}: OK, подписок: {len(config.watches)}")
+        return 0
+    if not cfg.get("golden_key"):
+        print("В config.json нет golden_key — сначала настройте клиент (python main.py).")
+        return 2
+
+    if args.worker_id:
+        return _run_worker(args.watch_file, args.worker_id)
+    if args.workers > 1:
+        return _supervise(args.watch_file, config, args.workers, not args.no_tg_updates)
+
+    client = FunPayClient(cfg["golden_key"], cfg.get("user_agent") or None, cache_ttl=WATCH_CACHE_TTL_SECONDS)
+    _stop_on_sigterm()
+
+    startup_ms = (time.perf_counter() - started) * 1000
+    print(
+        f"Демон нотификатора: {len(config.watches)} подписок из {args.watch_file}, "
+        f"запуск занял {startup_ms:.0f} мс."
+    )
+    log(f"DAEMON: старт, подписок {len(config.watches)}, запуск {startup_ms:.0f} мс; {resource_usage()}")
+
+    watch_many(
+        client,
+        config.watches,
+        max_concurrency=config.max_concurrency,
+        max_requests_per_minute=config.max_requests_per_minute,
+        tg_token=config.tg_token,
+        tg_chat_ids=config.tg_chat_ids,
+        reload=_Reloader(args.watch_file, cfg),
+        status=resource_usage,
+        report_every=config.report_every,
+        poll_updates=not args.no_tg_updates,
+    )
+    return 0
@@ -0,0 +1,192 @@
+"""
+Структурированный журнал событий (JSONL) с замерами этапов опроса.
+
+Каждая строка kypisa_events.jsonl — один JSON-объект:
+
+    {"ts": 1760000000.123, "event": "span", "stage": "parse", "ms": 12.4,
+     "watch": "https://funpay.com/chips/99/", "cycle": "3f9c1a2b7d4e"}
+
+- event "span" — один этап: connect / wait / transfer (HTTP: установка
+  соединения вместе с DNS и TLS, ожидание ответа, скачивание тела),
+  parse, alerts, filter, diff, notify;
+- event "cycle" — весь цикл опроса подписки целиком (ms, ok, changed).
+
+watch и cycle — id корреляции: все этапы одного опроса несут один cycle,
+все опросы подписки — один watch. Отчёт по перцентилям:
+
+    python -m kypisa.events [kypisa_events.jsonl] [--by-watch]
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+from .logger import LogWriter
+from .settings import get_base_dir, get_setting
+
+EVENTS_FILE = os.path.join(get_base_dir(), "kypisa_events.jsonl")
+
+# порядок этапов в отчёте
+STAGES = ("connect", "wait", "transfer", "parse", "alerts", "filter", "diff", "notify", "cycle")
+
+
+@dataclass
+class Cycle:
+    """Один опрос подписки: id корреляции и итог для события cycle."""
+
+    watch: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started: float = field(default_factory=time.perf_counter)
+    changed: Optional[bool] = None
+
+
+_current: ContextVar[Optional[Cycle]] = ContextVar("kypisa_cycle", default=None)
+_writer: Optional[LogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> LogWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LogWriter(EVENTS_FILE)
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def events_enabled() -> bool:
+    """events_enabled в config.json (по умолчанию вкл.), из кэша настроек."""
+    return bool(get_setting("events_enabled", True))
+
+
+def emit(event: str, **fields) -> None:
+    """Записать событие; к нему добавляются ts и id текущего цикла, если он есть."""
+    if not events_enabled():
+        return
+    record = {"ts": round(time.time(), 3), "event": event}
+    cycle = _current.get()
+    if cycle is not None:
+        record["watch"] = cycle.watch
+        record["cycle"] = cycle.id
+    record.update(fields)
+    _get_writer().put(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def record_span(stage: str, seconds: float, **fields) -> None:
+    emit("span", stage=stage, ms=round(seconds * 1000.0, 3), **fields)
+
+
+@contextmanager
+def span(stage: str, **fields) -> Iterator[None]:
+    """Замерить этап: with span("parse"): ..."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - started, **fields)
+
+
+@contextmanager
+def poll_cycle(watch: str) -> Iterator[Cycle]:
+    """
+    Цикл опроса подписки: все span внутри (в этом же потоке) получают
+    его id, а в конце пишется событие cycle с общей длительностью.
+    """
+    cycle = Cycle(watch)
+    token = _current.set(cycle)
+    ok = False
+    try:
+        yield cycle
+        ok = True
+    finally:
+        _current.reset(token)
+        ms = round((time.perf_counter() - cycle.started) * 1000.0, 3)
+        emit("cycle", watch=cycle.watch, cycle=cycle.id, ms=ms, ok=ok, changed=cycle.changed)
+
+
+# ---------- отчёт ----------
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу (values уже отсортированы)."""
+    if not values:
+        return 0.0
+    rank = max(1, int(-(-q * len(values) // 100)))
+    return values[min(rank, len(values)) - 1]
+
+
+def load_durations(path: str, by_watch: bool = False) -> Dict[str, List[float]]:
+    """Длительности (мс) по этапам (или по "подписка / этап") из файла событий."""
+    durations: Dict[str, List[float]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            event = record.get("event")
+            if event == "cycle":
+                stage = "cycle"
+            elif event == "span":
+                stage = record.get("stage") or "?"
+            else:
+                continue
+            ms = record.get("ms")
+            if not isinstance(ms, (int, float)):
+                continue
+            key = f"{record.get('watch') or '-'} / {stage}" if by_watch else stage
+            durations.setdefault(key, []).append(float(ms))
+    return durations
+
+
+def format_summary(durations: Dict[str, List[float]]) -> str:
+    order = {stage: i for i, stage in enumerate(STAGES)}
+
+    def sort_key(key: str):
+        watch, _, stage = key.rpartition(" / ")
+        return watch, order.get(stage, len(order)), stage
+
+    lines = [
+        f"{'Этап':<40} | {'Кол-во':>7} | {'p50, мс':>9} | {'p95, мс':>9} | {'p99, мс':>9} | {'max, мс':>9}",
+        "-" * 98,
+    ]
+    for key in sorted(durations, key=sort_key):
+        values = sorted(durations[key])
+        lines.append(
+            f"{key[-40:]:<40} | {len(values):7d} | {percentile(values, 50):9.1f} | "
+            f"{percentile(values, 95):9.1f} | {percentile(values, 99):9.1f} | {values[-1]:9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Перцентили длительностей этапов из журнала событий")
+    parser.add_argument("events_file", nargs="?", default=EVENTS_FILE, help="JSONL-файл событий")
+    parser.add_argument("--by-watch", action="store_true", help="отдельно по каждой подписке")
+    args = parser.parse_args(argv)
+
+    try:
+        durations = load_durations(args.events_file, args.by_watch)
+    except OSError as e:
+        print(f"Не удалось прочитать {args.events_file}: {e}")
+        return 1
+    if not durations:
+        print("В файле нет событий с замерами.")
+        return 0
+    print(format_summary(durations))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,270 @@
+"""
+Мини-язык фильтров по лотам.
+
+Примеры:
+    price < 0.5 and rating >= 4
+    online and reviews > 100 and not desc ~ "аренда"
+    (method ~ трейд or type ~ валюта) and price >= 0.3
+
+Поля: price, rating, reviews, online, promo, game, type, method,
+desc (description), seller, stock. Операторы: < <= > >= == != ,
+~ (содержит, без учёта регистра) и !~ (не содержит); связки and/or/not
+(можно и/или/не). Выражение компилируется один раз в обычную
+python-функцию Lot -> bool, дальше её можно гонять по тысячам лотов.
+"""
+from __future__ import annotations
+
+import operator
+import re
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Callable, Iterable, List, Optional
+
+from .models import Lot
+
+
+class FilterError(ValueError):
+    """Ошибка в тексте фильтра."""
+
+
+def _text(value: Any) -> str:
+    return str(value or "").lower()
+
+
+# поле -> (достать значение из лота, строковое ли поле)
+_FIELDS: dict[str, tuple[Callable[[Lot], Any], bool]] = {
+    "price": (lambda l: l.price, False),
+    "rating": (lambda l: l.seller.rating_stars, False),
+    "reviews": (lambda l: l.seller.reviews, False),
+    "online": (lambda l: l.seller.online, False),
+    "promo": (lambda l: l.promo, False),
+    "game": (lambda l: _text(l.game), True),
+    "type": (lambda l: _text(l.type), True),
+    "method": (lambda l: _text(l.method), True),
+    "desc": (lambda l: _text(l.description), True),
+    "seller": (lambda l: _text(l.seller.name), True),
+    "stock": (lambda l: _text(l.stock), True),
+}
+
+_ALIASES = {
+    "description": "desc",
+    "цена": "price",
+    "рейтинг": "rating",
+    "отзывы": "reviews",
+    "онлайн": "online",
+    "игра": "game",
+    "тип": "type",
+    "способ": "method",
+    "описание": "desc",
+    "продавец": "seller",
+    "наличие": "stock",
+}
+
+_KEYWORDS = {
+    "and": "and", "и": "and",
+    "or": "or", "или": "or",
+    "not": "not", "не": "not",
+    "true": "true", "false": "false",
+}
+
+_TOKEN_RE = re.compile(
+    r"""
+    \s*(?:
+        (?P<num>\d+(?:[.,]\d+)?)
+      | (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<op><=|>=|==|!=|!~|<|>|~|=)
+      | (?P<paren>[()])
+      | (?P<word>[^\s()<>=!~"']+)
+    )
+    """,
+    re.VERBOSE,
+)
+
+LotPredicate = Callable[[Lot], bool]
+
+
+def _tokenize(text: str) -> List[tuple[str, str]]:
+    tokens: List[tuple[str, str]] = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise FilterError(f"не понял фильтр около: {text[pos:pos + 20]!r}")
+        pos = m.end()
+        kind = m.lastgroup or ""
+        value = m.group(kind)
+        if kind == "str":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "num":
+            value = value.replace(",", ".")
+        elif kind == "op" and value == "=":
+            value = "=="
+        elif kind == "word" and value.lower() in _KEYWORDS and not (tokens and tokens[-1][0] == "op"):
+            # сразу после оператора сравнения это значение ("desc ~ не"), а не и/или/не
+            kind, value = "kw", _KEYWORDS[value.lower()]
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """Рекурсивный спуск: or < and < not < сравнение / скобки."""
+
+    def __init__(self, tokens: List[tuple[str, str]]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def _peek(self) -> Optional[tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self) -> tuple[str, str]:
+        tok = self._peek()
+        if tok is None:
+            raise FilterError("фильтр оборвался на середине")
+        self.pos += 1
+        return tok
+
+    def parse(self) -> LotPredicate:
+        pred = self._or()
+        if self._peek() is not None:
+            raise FilterError(f"лишнее в конце фильтра: {self._peek()[1]!r}")
+        return pred
+
+    def _or(self) -> LotPredicate:
+        parts = [self._and()]
+        while self._peek() == ("kw", "or"):
+            self._take()
+            parts.append(self._and())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda lot: any(p(lot) for p in parts)
+
+    def _and(self) -> LotPredicate:
+        parts = [self._not()]
+        while self._peek() == ("kw", "and"):
+            self._take()
+            parts.append(self._not())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda lot: all(p(lot) for p in parts)
+
+    def _not(self) -> LotPredicate:
+        if self._peek() == ("kw", "not"):
+            self._take()
+            inner = self._not()
+            return lambda lot: not inner(lot)
+        return self._atom()
+
+    def _atom(self) -> LotPredicate:
+        kind, value = self._take()
+        if (kind, value) == ("paren", "("):
+            pred = self._or()
+            if self._take() != ("paren", ")"):
+                raise FilterError("не хватает закрывающей скобки")
+            return pred
+        if kind == "kw" and value in ("true", "false"):
+            result = value == "true"
+            return lambda lot: result
+        if kind != "word":
+            raise FilterError(f"ожидалось имя поля, а не {value!r}")
+
+        name = _ALIASES.get(value.lower(), value.lower())
+        if name not in _FIELDS:
+            raise FilterError(f"неизвестное поле {value!r}; есть: {', '.join(_FIELDS)}")
+        getter, is_text = _FIELDS[name]
+
+        nxt = self._peek()
+        if nxt is None or nxt[0] != "op":
+            # голое поле: online, promo — просто "истинно ли"
+            return lambda lot: bool(getter(lot))
+
+        op = self._take()[1]
+        vkind, raw = self._take()
+        if vkind not in ("num", "str", "word", "kw"):
+            raise FilterError(f"ожидалось значение после {op!r}")
+        return _compare(name, getter, is_text, op, raw, vkind)
+
+
+def _compare(
+    name: str,
+    getter: Callable[[Lot], Any],
+    is_text: bool,
+    op: str,
+    raw: str,
+    vkind: str,
+) -> LotPredicate:
+    if op in ("~", "!~"):
+        if not is_text:
+            raise FilterError(f"оператор {op} работает только с текстовыми полями, а {name} — нет")
+        needle = raw.lower()
+        if op == "~":
+            return lambda lot: needle in getter(lot)
+        return lambda lot: needle not in getter(lot)
+
+    if is_text:
+        target: Any = raw.lower()
+    elif vkind in ("kw", "word") and raw.lower() in ("true", "false"):
+        target = raw.lower() == "true"
+    else:
+        try:
+            target = float(raw)
+        except ValueError:
+            raise FilterError(f"для поля {name} нужно число, а не {raw!r}") from None
+
+    if op == "==":
+        return lambda lot: getter(lot) == target
+    if op == "!=":
+        return lambda lot: getter(lot) != target
+
+    cmp = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}[op]
+
+    def pred(lot: Lot) -> bool:
+        value = getter(lot)
+        # нет рейтинга/отзывов — под числовое условие не подходит
+        return value is not None and cmp(value, target)
+
+    return pred
+
+
+class LotFilter:
+    """Скомпилированный фильтр: вызывается как функция Lot -> bool."""
+
+    def __init__(self, source: str, predicate: LotPredicate) -> None:
+        self.source = source
+        self._predicate = predicate
+
+    def __call__(self, lot: Lot) -> bool:
+        return self._predicate(lot)
+
+    def apply(self, lots: Iterable[Lot]) -> List[Lot]:
+        pred = self._predicate
+        return [lot for lot in lots if pred(lot)]
+
+    def __repr__(self) -> str:
+        return f"LotFilter({self.source!r})"
+
+
+@lru_cache(maxsize=256)
+def compile_filter(source: str) -> LotFilter:
+    """Компилируем текст фильтра (с кэшем: одинаковые правила собираются один раз)."""
+    tokens = _tokenize(source)
+    if not tokens:
+        return LotFilter(source, lambda lot: True)
+    return LotFilter(source, _Parser(tokens).parse())
+
+
+def quote(value: str) -> str:
+    """Строковое значение для подстановки в фильтр."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def legacy_filter(price_floor: float | None, method_filter: str | None) -> str:
+    """Старые настройки нотификатора (мин. цена + тип/способ) в виде фильтра."""
+    parts: List[str] = []
+    if price_floor is not None:
+        # без экспоненты: 1e-05 парсер фильтров не понимает
+        parts.append(f"price >= {format(Decimal(repr(float(price_floor))), 'f')}")
+    if method_filter:
+        q = quote(method_filter)
+        parts.append(f"(method ~ {q} or type ~ {q})")
+    return " and ".join(parts)
@@ -1,21 +1,198 @@
 from __future__ import annotations
+import atexit
 import os
+import queue
+import threading
+import time
 from datetime import datetime
-from .settings import load_settings, get_base_dir
+from typing import List, Optional
+from .settings import get_base_dir, get_setting
+
+# ротация: kypisa.log -> kypisa.log.1 -> ... -> kypisa.log.{LOG_BACKUPS}
+LOG_MAX_BYTES = 2 * 1024 * 1024
+LOG_MAX_AGE_SECONDS = 7 * 24 * 3600
+LOG_BACKUPS = 5
+
+# сколько строк ждёт записи; если писатель не успевает — новые строки
+# отбрасываются (и это отмечается в логе), вызывающий никогда не ждёт
+LOG_QUEUE_SIZE = 10000
+# как часто писатель сбрасывает накопленное на диск и сколько строк максимум за раз
+LOG_FLUSH_SECONDS = 0.5
+LOG_BATCH_LINES = 1000
+
+_TS_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
 def get_log_path() -> str:
     return os.path.join(get_base_dir(), "kypisa.log")
 
 
+def _file_started(path: str) -> Optional[float]:
+    """Время первой строки лог-файла (по её метке), None — файла нет или он пуст."""
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            head = f.readline(64)
+    except OSError:
+        return None
+    try:
+        return datetime.strptime(head[1:20], _TS_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+class LogWriter:
+    """
+    Фоновая запись лога: log() только кладёт строку в очередь, а поток
+    kypisa-log раз в LOG_FLUSH_SECONDS (или как только набралось) пишет
+    всё накопленное одной записью. Файл открывается на пачку, а не на
+    строку, и ротируется по размеру и по возрасту первой строки.
+
+    Несколько процессов (шарды демона) могут писать в один файл: запись
+    в режиме append, а чужую ротацию замечаем по уменьшившемуся размеру.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = LOG_MAX_BYTES,
+        max_age: float = LOG_MAX_AGE_SECONDS,
+        backups: int = LOG_BACKUPS,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.dropped = 0
+        self._queue: "queue.Queue[object]" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._started: Optional[float] = None
+        self._size = -1
+
+    def put(self, line: str) -> None:
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """Дождаться, пока всё, что уже в очереди, окажется на диске."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="kypisa-log", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch: List[str] = []
+            waiters: List[threading.Event] = []
+            item = self._queue.get()
+            deadline = time.monotonic() + LOG_FLUSH_SECONDS
+            while True:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    # просили сбросить — не ждём конца интервала
+                    deadline = 0.0
+                else:
+                    batch.append(item)
+                    if len(batch) >= LOG_BATCH_LINES:
+                        break
+                try:
+                    left = deadline - time.monotonic()
+                    item = self._queue.get(timeout=left) if left > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                ts = datetime.now().strftime(_TS_FORMAT)
+                batch.append(f"[{ts}] LOG: очередь переполнена, пропущено строк: {dropped}\n")
+            if batch:
+                self._write("".join(batch))
+            for event in waiters:
+                event.set()
+
+    def _write(self, data: str) -> None:
+        try:
+            self._maybe_rotate()
+        except OSError:
+            # не удалось ротировать (на Windows файл держит другой процесс) —
+            # пишем в текущий файл, попробуем ротировать со следующей пачкой
+            pass
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+            if self._started is None:
+                self._started = time.time()
+            self._size = max(self._size, 0) + len(data.encode("utf-8"))
+        except Exception:
+            pass
+
+    def _maybe_rotate(self) -> None:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self._started, self._size = None, 0
+            return
+        if size < self._size or self._size < 0:
+            # файл ещё не видели или его ротировал другой процесс
+            self._started = _file_started(self.path)
+        self._size = size
+        too_big = size >= self.max_bytes
+        too_old = self._started is not None and time.time() - self._started >= self.max_age
+        if size == 0 or not (too_big or too_old):
+            return
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._started, self._size = None, 0
+
+
+_writer: Optional[LogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> LogWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LogWriter(get_log_path())
+                atexit.register(flush_log)
+    return _writer
+
+
+def _log_enabled() -> bool:
+    # из кэша SettingsStore: config.json здесь не читается
+    return bool(get_setting("log_enabled", True))
+
+
+def flush_log(timeout: float = 2.0) -> bool:
+    """Дописать на диск всё, что уже отправлено в log() (вызывается и при выходе)."""
+    return _writer.flush(timeout) if _writer is not None else True
+
+
 def log(message: str) -> None:
-    cfg = load_settings()
-    if not cfg.get("log_enabled", True):
+    if not _log_enabled():
         return
-    path = get_log_path()
-    try:
-        with open(path, "a", encoding="utf-8") as f:
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"[{ts}] {message}\n")
-    except Exception:
-        pass
+    ts = datetime.now().strftime(_TS_FORMAT)
+    _get_writer().put(f"[{ts}] {message}\n")
@@ -1,76 +1,42 @@
 from __future__ import annotations
 
 import time
-from typing import Optional, List
+from contextlib import nullcontext, redirect_stdout
+from typing import Callable, Optional, List
 
 import os
-import json
-import requests
-from winotify import Notification, audio
 
+from . import events, startup
 from .api import FunPayClient
 from .models import Category
-from .settings import load_settings, save_settings, get_base_dir
+from .filters import FilterError, LotFilter, compile_filter, legacy_filter
+from .alerts import AlertIndex, PriceAlert
+from .topk import TopKTracker
+from .outbox import Outbox
+from .state import WatchStateStore
+from .telegram import SubscriberService, TelegramSender
+from .scheduler import Watch, WatchScheduler, WatchStats, format_stats
+from .ratelimit import RateLimiter
+from .render import OutputTail, Screen
+from .settings import get_base_dir, get_store, load_settings, save_settings
 from .logger import log
 from . import games_index
 
 SUBS_FILE = os.path.join(get_base_dir(), "tg_subscribers.json")
-
-
-def _load_subscribers() -> set[str]:
-    """Читаем список подписчиков из tg_subscribers.json."""
-    subs: set[str] = set()
-    if os.path.exists(SUBS_FILE):
-        try:
-            with open(SUBS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if isinstance(data, list):
-                for x in data:
-                    subs.add(str(x))
-        except Exception as e:
-            log(f"TG_SUB: ошибка чтения {SUBS_FILE}: {e}")
-    return subs
-
-
-def _save_subscribers(subs: set[str]) -> None:
-    try:
-        with open(SUBS_FILE, "w", encoding="utf-8") as f:
-            json.dump(sorted(list(subs)), f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        log(f"TG_SUB: ошибка записи {SUBS_FILE}: {e}") 
-
-
-def _collect_subscribers_from_telegram(token: str) -> list[str]:
-    """Обновляем список подписчиков через getUpdates и сохраняем.
-
-    Логика:
-      * читаем текущий список из файла;
-      * через getUpdates берём все chat_id, которые писали боту (/start и т.п.);
-      * добавляем их в множество и сохраняем.
-    """ 
-    subs = _load_subscribers()
-    if not token:
-        return sorted(list(subs))
-
-    try:
-        resp = requests.get(
-            f"https://api.telegram.org/bot{token}/getUpdates", timeout=10
-        )
-        data = resp.json()
-        if data.get("ok") and isinstance(data.get("result"), list):
-            for upd in data["result"]:
-                msg = upd.get("message") or upd.get("channel_post") or {}
-                chat = msg.get("chat") or {}
-                cid = chat.get("id")
-                if cid is not None:
-                    subs.add(str(cid))
-    except Exception as e:
-        log(f"TG_SUB: ошибка getUpdates: {e}")
-
-    _save_subscribers(subs)
-    return sorted(list(subs))
-
-
+OUTBOX_FILE = os.path.join(get_base_dir(), "notify_outbox.json")
+
+DIGEST_WINDOW_SECONDS = 2.0
+# как часто опрашивать категории, которые нужны только правилам /alert
+ALERT_WATCH_INTERVAL = 60
+DIGEST_MAX_ITEMS = 20
+# сколько последних сообщений показывать внизу живой панели
+DASHBOARD_EVENTS = 8
+# кэш страниц категорий в мониторинге: подписки на одну категорию, сработавшие
+# почти одновременно, делят один запрос. Меньше минимального интервала
+# опроса (Watch.min_interval_seconds), чтобы одна подписка не получала
+# старую страницу. Кэш и лимит запросов — свои у каждого процесса
+# (нотификатор, демон, плагин Chat): общего бюджета между ними нет.
+WATCH_CACHE_TTL_SECONDS = 3.0
 
 
 def _parse_stock_amount(stock: str | None) -> str:
@@ -90,100 +56,238 @@ def _get_chat_ids(raw: str | None) -> List[str]:
     return parts
 
 
+def _alert_payload(lot, fun_min_per_1000: float, price_floor: float, category_name: str) -> dict:
+    """Всё, что нужно каналам доставки, в виде JSON-совместимого словаря."""
+    return {
+        "category_name": category_name,
+        "description": getattr(lot, "description", "") or "",
+        "seller": lot.seller.name,
+        "price": lot.price,
+        "fun_min_per_1000": fun_min_per_1000,
+        "stock": _parse_stock_amount(getattr(lot, "stock", None)),
+        "price_floor": price_floor,
+        "url": getattr(lot, "url", None) or "",
+    }
+
+
+def _telegram_text(alert: dict) -> str:
+    if alert.get("rule"):
+        title = f"🔔 *Сработало правило*: {alert['rule']}\n"
+    elif alert.get("rank"):
+        title = f"🟢 *Новый лот в топ-{alert['top_k']} на FunPay* (место #{alert['rank']})\n"
+    else:
+        title = "🟢 *Новый самый дешёвый лот на FunPay*\n"
+    text = (
+        title
+        + f"Категория: {alert['description']}\n"
+        f"Продавец: `{alert['seller']}`\n"
+        f"Цена: *{alert['price']:.4f} ₽* за единицу\n"
+        f"≈ *{alert['fun_min_per_1000']:.2f} ₽* за 1000 (если применимо)\n"
+        f"Наличие: *{alert['stock']}*\n"
+        f"Фильтр минимальной цены: *{alert['price_floor']:.2f} ₽*\n"
+    )
+    if alert.get("url"):
+        text += f"\nСсылка: {alert['url']}"
+    return text
+
+
+def _digest_text(alerts: list[dict]) -> str:
+    """Несколько событий подряд — одно сообщение-дайджест."""
+    if len(alerts) == 1:
+        return _telegram_text(alerts[0])
+    lines = [f"🟢 *Новые минимумы на FunPay* ({len(alerts)})", ""]
+    for alert in alerts[:DIGEST_MAX_ITEMS]:
+        line = (
+            f"• {alert['category_name']}: `{alert['seller']}` — "
+            f"*{alert['price']:.4f} ₽* (наличие: {alert['stock']})"
+        )
+        if alert.get("url"):
+            line += f"\n  {alert['url']}"
+        lines.append(line)
+    if len(alerts) > DIGEST_MAX_ITEMS:
+        lines.append(f"… и ещё {len(alerts) - DIGEST_MAX_ITEMS}")
+    return "\n".join(lines)
+
+
 def _send_telegram(
-    lot,
-    fun_min_per_1000: float,
-    price_floor: float,
-    token: str,
+    alerts: list[dict],
+    sender: TelegramSender,
     chat_ids: list[str],
+    subscribers: SubscriberService | None = None,
 ) -> None:
     """
-    Отправка уведомления в Telegram.
+    Отправка пачки уведомлений в Telegram (вызывается доставщиком outbox).
 
-    Токен берётся из аргумента, список chat_id:
+    Список chat_id:
       * если передан вручную — используется как есть;
-      * если пустой — берём/обновляем подписчиков из tg_subscribers.json
-        через getUpdates (все, кто нажали /start у бота).
-    """
-    if not token:
-        # токен пустой — телега выключена
-        return
+      * если пустой — берём подписчиков из SubscriberService (все, кто
+        нажали /start у бота); список уже в памяти, в Telegram не ходим.
 
+    В alert["delivered"] копятся chat_id, куда уже отправили, чтобы при
+    повторной попытке не слать одно и то же дважды. Если хоть один чат
+    не получил сообщение — бросаем исключение, outbox повторит позже.
+    """
     # авто-режим: chat_ids не задан → берём всех подписчиков
     if not chat_ids:
-        chat_ids = _collect_subscribers_from_telegram(token)
-        if not chat_ids:
-            print("TG: нет подписчиков (никто не нажал /start?).")
+        chat_ids = subscribers.snapshot() if subscribers is not None else []
+
+    # уведомления по личным правилам (/alert) идут только их владельцам
+    groups: dict[tuple[str, ...], list[dict]] = {}
+    for alert in alerts:
+        groups.setdefault(tuple(alert.get("targets") or ()), []).append(alert)
+
+    failed: list[str] = []
+    for targets, group in groups.items():
+        recipients = list(targets) or chat_ids
+        if not recipients:
             log("TG: нет подписчиков — список пуст.")
-            return
+            continue
 
-    stock_str = _parse_stock_amount(getattr(lot, "stock", None))
+        # в повторной пачке пропускаем чаты, которые уже получили все её события
+        done = set.intersection(*(set(a.get("delivered", [])) for a in group))
+        pending = [cid for cid in recipients if cid not in done]
 
-    text = (
-        "🟢 *Новый самый дешёвый лот на FunPay*\n"
-        f"Категория: {getattr(lot, 'description', '')}\n"
-        f"Продавец: `{lot.seller.name}`\n"
-        f"Цена: *{lot.price:.4f} ₽* за единицу\n"
-        f"≈ *{fun_min_per_1000:.2f} ₽* за 1000 (если применимо)\n"
-        f"Наличие: *{stock_str}*\n"
-        f"Фильтр минимальной цены: *{price_floor:.2f} ₽*\n"
-    )
-    if getattr(lot, "url", None):
-        text += f"\nСсылка: {lot.url}"
+        group_failed = sender.broadcast(pending, _digest_text(group))
+        delivered = sorted(done | (set(pending) - set(group_failed)))
+        for alert in group:
+            alert["delivered"] = delivered
+        failed.extend(group_failed)
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    if failed:
+        raise RuntimeError(f"не доставлено в chat_id: {', '.join(failed)}")
 
-    for cid in chat_ids:
-        payload = {
-            "chat_id": cid,
-            "text": text,
-            "parse_mode": "Markdown",
-        }
-        try:
-            print(f"Пробую отправить уведомление в Telegram, chat_id={cid}...")
-            r = requests.post(url, json=payload, timeout=10)
-            if r.status_code != 200:
-                print(f"TG ERROR {r.status_code}: {r.text}")
-                log(f"TG: ошибка отправки ({r.status_code}) для chat_id={cid}: {r.text}")
-            else:
-                print(f"TG: сообщение успешно отправлено в chat_id={cid}")
-        except Exception as e:
-            print(f"TG: исключение при отправке в chat_id={cid}: {e}")
-            log(f"TG: исключение при отправке в chat_id={cid}: {e}")
 
+_winotify = None
+_winotify_checked = False
+
+
+def _toast_backend():
+    """
+    winotify, если он есть (Windows и пакет установлен); None — тостов не
+    будет. Ищем при первом уведомлении, а не при импорте: на других
+    системах нотификатор работает и без него.
+    """
+    global _winotify, _winotify_checked
+    if not _winotify_checked:
+        _winotify_checked = True
+        try:
+            import winotify
 
+            _winotify = winotify
+        except Exception as e:
+            log(f"NOTIFY: winotify недоступен, Windows-уведомлений не будет ({e})")
+    return _winotify
 
 
-def _notify_windows(lot, fun_min_per_1000: float, category_name: str) -> None:
-    title = f"FunPay CLI Bot: новый минимум ({category_name})"
-    stock_str = _parse_stock_amount(lot.stock)
+def _notify_windows(alert: dict) -> None:
+    backend = _toast_backend()
+    if backend is None:
+        return
+    title = f"FunPay CLI Bot: новый минимум ({alert['category_name']})"
     msg = (
-        f"Продавец: {lot.seller.name}\n"
-        f"Цена: {lot.price:.4f} ₽\n"
-        f"≈ {fun_min_per_1000:.2f} ₽ за 1000 (если применимо)\n"
-        f"Наличие: {stock_str}"
+        f"Продавец: {alert['seller']}\n"
+        f"Цена: {alert['price']:.4f} ₽\n"
+        f"≈ {alert['fun_min_per_1000']:.2f} ₽ за 1000 (если применимо)\n"
+        f"Наличие: {alert['stock']}"
     )
 
     try:
-        toast = Notification(
+        toast = backend.Notification(
             app_id="FunPay CLI Bot",
             title=title,
             msg=msg,
             duration="short",
         )
         try:
-            toast.set_audio(audio.Default, loop=False)
+            toast.set_audio(backend.audio.Default, loop=False)
         except Exception:
             pass
 
-        if lot.url:
-            toast.add_actions(label="Открыть лот", launch=lot.url)
+        if alert.get("url"):
+            toast.add_actions(label="Открыть лот", launch=alert["url"])
 
         toast.show()
     except Exception as e:
         log(f"NOTIFY: ошибка при показе уведомления: {e}")
 
 
+def _make_outbox(
+    token: str,
+    chat_ids: list[str],
+    on_rules_changed: Callable[[str, list[PriceAlert]], None] | None = None,
+    poll_updates: bool = True,
+    outbox_path: str = OUTBOX_FILE,
+) -> tuple[Outbox, SubscriberService | None, TelegramSender | None]:
+    """
+    Outbox с каналами windows и (если есть токен) telegram.
+    С токеном заодно поднимаем сервис подписчиков: он нужен и для
+    авто-режима (chat_id не заданы), и для личных правил /alert.
+    poll_updates=False — getUpdates не запускаем (его ведёт другой
+    процесс), подписчиков только читаем из файла.
+    """
+    handlers = {"windows": _notify_windows}
+    batch_windows: dict[str, float] = {}
+    subscribers: SubscriberService | None = None
+    sender: TelegramSender | None = None
+    if token:
+        subscribers = SubscriberService(token, SUBS_FILE, on_rules_changed=on_rules_changed)
+        if poll_updates:
+            subscribers.start()
+        sender = TelegramSender(token)
+        handlers["telegram"] = lambda alerts: _send_telegram(alerts, sender, chat_ids, subscribers)
+        # всплеск событий за пару секунд уходит одним дайджестом
+        batch_windows["telegram"] = DIGEST_WINDOW_SECONDS
+    return Outbox(outbox_path, handlers, batch_windows=batch_windows), subscribers, sender
+
+
+def _stop_delivery(
+    outbox: Outbox,
+    subscribers: SubscriberService | None,
+    sender: TelegramSender | None,
+) -> None:
+    outbox.stop()
+    # после outbox: доставщики уже не шлют, пул соединений можно закрывать
+    if sender is not None:
+        sender.close()
+    if subscribers is not None:
+        subscribers.stop()
+
+
+def _enqueue_alert(outbox: Outbox, alert: dict, channels: tuple[str, ...] | None = None) -> None:
+    for channel in outbox.channels:
+        if channels is not None and channel not in channels:
+            continue
+        # у каждого канала своя копия: доставщики меняют payload независимо
+        outbox.enqueue(channel, dict(alert))
+
+
+def _match_alerts(
+    alert_index: AlertIndex | None,
+    category: Category,
+    lots: list,
+    outbox: Outbox,
+    state: WatchStateStore,
+) -> int:
+    """Личные правила подписчиков по свежему снимку. Возвращает число сработавших."""
+    if alert_index is None or not len(alert_index):
+        return 0
+    fired = 0
+    with events.span("alerts", rules=len(alert_index)):
+        for match in alert_index.evaluate(category.url, lots):
+            alert, lot = match.alert, match.lot
+            lot_key = f"{lot.seller.name}|{lot.price:.6f}|{lot.url}"
+            if not state.claim_alert(category.url, f"alert:{alert.id}", lot_key):
+                continue
+            payload = _alert_payload(lot, lot.price * 1000, 0.0, category.name)
+            payload["rule"] = f"≤ {alert.max_price:g} ₽, рейтинг ≥ {alert.min_rating}"
+            payload["targets"] = [alert.owner]
+            _enqueue_alert(outbox, payload, channels=("telegram",))
+            fired += 1
+    if fired:
+        log(f"NOTIFY: по правилам подписчиков сработало {fired} ({category.url})")
+    return fired
+
+
 def _choose_category(client: FunPayClient) -> Category | None:
     """
     1) Ищем игру по имени (rust, roblox, cs2, ...).
@@ -281,18 +385,32 @@ def _choose_category(client: FunPayClient) -> Category | None:
             return Category(name=f"{game_name} — {sel_name}", url=sel_url, count=None)
 
 
-def watch_cheapest(
-    client: FunPayClient,
-    category: Category,
-    interval_seconds: int = 30,
-    price_floor: float = 0.30,
-    method_filter: str | None = None,
-    tg_token: str | None = None,
-    tg_chat_ids: list[str] | None = None,
-) -> None:
-    token = tg_token or ""
-    chat_ids = tg_chat_ids or []
+def _fetch_lots(client: FunPayClient, category: Category) -> list:
+    if category.name == "Custom":
+        return client.get_lots_by_url(category.url)
+    return client.get_lots_for_category(category)
+
 
+def _build_filter(
+    price_floor: float,
+    method_filter: str | None,
+    filter_expr: str | None = None,
+) -> LotFilter:
+    """
+    Мин. цена и тип/способ — это тоже фильтр; дополнительное выражение
+    (rating >= 4 and online ...) просто добавляется через and.
+    """
+    source = legacy_filter(price_floor, method_filter)
+    if filter_expr:
+        source = f"{source} and ({filter_expr})" if source else filter_expr
+    return compile_filter(source)
+
+
+def _filter_lots(lots: list, lot_filter: LotFilter) -> list:
+    return lot_filter.apply(lots)
+
+
+def _print_tg_status(token: str, chat_ids: list[str]) -> None:
     print("=== Telegram настройки (плагин) ===")
     if not token:
         # вообще нет токена — телега реально выключена
@@ -308,76 +426,515 @@ def watch_cheapest(
             print("Токен есть, chat_id не заданы — используется авто-режим.")
             print("Все, кто нажали /start у бота, будут получать уведомления (через список подписчиков).")
 
-    last_best_key: Optional[str] = None
 
-    while True:
-        try:
-            if category.name == "Custom":
-                lots = client.get_lots_by_url(category.url)
-            else:
-                lots = client.get_lots_for_category(category)
-        except Exception as e:
-            print(f"Ошибка при загрузке лотов: {e}")
-            log(f"NOTIFY: ошибка при загрузке лотов: {e}")
-            time.sleep(interval_seconds)
-            continue
+def _poll_cheapest(
+    client: FunPayClient,
+    category: Category,
+    price_floor: float,
+    lot_filter: LotFilter,
+    outbox: Outbox,
+    state: WatchStateStore,
+    watch_key: str,
+    last_best_key: Optional[str],
+    alert_index: AlertIndex | None = None,
+    channels: tuple[str, ...] | None = None,
+) -> Optional[str]:
+    """
+    Один цикл опроса категории: загрузка, фильтры, уведомление.
+    Уведомления только кладутся в outbox — доставка идёт в фоне.
+    Заодно снимок прогоняется через личные правила подписчиков (alert_index).
+    Новый минимум сохраняется в state, а уведомление отправляется,
+    только если о нём ещё не уведомляли в окне дедупликации.
+    Возвращает ключ текущего самого дешёвого лота (или прежний, если
+    загрузить/найти не получилось).
+    """
+    prefix = "" if category.name == "Custom" else f"[{category.name}] "
+    try:
+        lots = _fetch_lots(client, category)
+    except Exception as e:
+        print(f"{prefix}Ошибка при загрузке лотов: {e}")
+        log(f"NOTIFY: ошибка при загрузке лотов ({category.url}): {e}")
+        return last_best_key
 
-        # фильтр по минимальной цене
-        valid_lots = [l for l in lots if l.price >= price_floor]
-
-        # фильтр по ТИПУ/СПОСОБУ (если задан)
-        if method_filter:
-            mf = method_filter.lower()
-            valid_lots = [
-                l
-                for l in valid_lots
-                if mf in (l.method or "").lower()
-                or mf in (l.type or "").lower()
-            ]
-
-        if not valid_lots:
-            print("Нет валидных лотов (подходящих по цене/способу).")
-            time.sleep(interval_seconds)
-            continue
+    _match_alerts(alert_index, category, lots, outbox, state)
 
+    with events.span("filter", lots=len(lots)):
+        valid_lots = _filter_lots(lots, lot_filter)
+    if not valid_lots:
+        print(f"{prefix}Нет валидных лотов (подходящих под фильтр).")
+        return last_best_key
+
+    with events.span("diff"):
         cheapest = min(valid_lots, key=lambda l: l.price)
         fun_min_per_1000 = cheapest.price * 1000
         lot_key = f"{cheapest.seller.name}|{cheapest.price:.6f}|{cheapest.url}"
 
-        if lot_key != last_best_key:
-            stock_str = _parse_stock_amount(cheapest.stock)
+    if lot_key == last_best_key:
+        print(f"{prefix}Изменений нет, самый дешёвый тот же.")
+        return lot_key
+
+    with events.span("notify"):
+        state.set_fingerprint(watch_key, lot_key)
+        stock_str = _parse_stock_amount(cheapest.stock)
+        if not state.claim_alert(watch_key, "cheapest", lot_key):
             print(
-                f"Новый самый дешёвый лот: {cheapest.seller.name} "
-                f"по {cheapest.price:.4f} ₽ "
-                f"(наличие: {stock_str}, ссылка: {cheapest.url})"
+                f"{prefix}Самый дешёвый снова {cheapest.seller.name} "
+                f"по {cheapest.price:.4f} ₽ — об этом лоте уже уведомляли."
             )
-            log(
-                f"NOTIFY: новый минимум {cheapest.seller.name} "
-                f"цена {cheapest.price:.4f}, stock={stock_str}, url={cheapest.url}"
+            return lot_key
+
+        print(
+            f"{prefix}Новый самый дешёвый лот: {cheapest.seller.name} "
+            f"по {cheapest.price:.4f} ₽ "
+            f"(наличие: {stock_str}, ссылка: {cheapest.url})"
+        )
+        log(
+            f"NOTIFY: новый минимум {cheapest.seller.name} "
+            f"цена {cheapest.price:.4f}, stock={stock_str}, url={cheapest.url}"
+        )
+        _enqueue_alert(
+            outbox,
+            _alert_payload(cheapest, fun_min_per_1000, price_floor, category.name),
+            channels,
+        )
+    return lot_key
+
+
+def _poll_top_k(
+    client: FunPayClient,
+    category: Category,
+    price_floor: float,
+    lot_filter: LotFilter,
+    outbox: Outbox,
+    state: WatchStateStore,
+    watch_key: str,
+    tracker: TopKTracker,
+    alert_index: AlertIndex | None = None,
+    channels: tuple[str, ...] | None = None,
+) -> bool:
+    """
+    Как _poll_cheapest, но следим за K самыми дешёвыми лотами: уведомляем
+    о каждом лоте, который вошёл в топ-K (а не только о новом минимуме).
+    Возвращает True, если топ изменился.
+    """
+    prefix = "" if category.name == "Custom" else f"[{category.name}] "
+    try:
+        lots = _fetch_lots(client, category)
+    except Exception as e:
+        print(f"{prefix}Ошибка при загрузке лотов: {e}")
+        log(f"NOTIFY: ошибка при загрузке лотов ({category.url}): {e}")
+        return False
+
+    _match_alerts(alert_index, category, lots, outbox, state)
+
+    with events.span("filter", lots=len(lots)):
+        valid_lots = _filter_lots(lots, lot_filter)
+    with events.span("diff", top_k=tracker.k):
+        change = tracker.update(valid_lots)
+    if change is None:
+        print(f"{prefix}Изменений нет, топ-{tracker.k} тот же.")
+        return False
+
+    with events.span("notify"):
+        state.set_fingerprint(watch_key, tracker.fingerprint)
+        for lot in change.left:
+            log(f"NOTIFY: из топ-{tracker.k} ушёл {lot.seller.name} ({lot.price:.4f}, {lot.url})")
+        for lot, old_price in change.repriced:
+            log(f"NOTIFY: в топ-{tracker.k} {lot.seller.name}: {old_price:.4f} -> {lot.price:.4f}")
+
+        for lot in change.entered:
+            rank = change.rank(lot)
+            lot_key = f"{lot.seller.name}|{lot.price:.6f}|{lot.url}"
+            if not state.claim_alert(watch_key, f"top{tracker.k}", lot_key):
+                continue
+            print(
+                f"{prefix}В топ-{tracker.k} вошёл лот #{rank}: {lot.seller.name} "
+                f"по {lot.price:.4f} ₽ (ссылка: {lot.url})"
             )
-            _notify_windows(cheapest, fun_min_per_1000, category.name)
-            _send_telegram(cheapest, fun_min_per_1000, price_floor, token, chat_ids)
-            last_best_key = lot_key
-        else:
-            print("Изменений нет, самый дешёвый тот же.")
+            log(f"NOTIFY: топ-{tracker.k} #{rank} {lot.seller.name} цена {lot.price:.4f}, url={lot.url}")
+            payload = _alert_payload(lot, lot.price * 1000, price_floor, category.name)
+            payload["rank"] = rank
+            payload["top_k"] = tracker.k
+            _enqueue_alert(outbox, payload, channels)
+    return True
 
-        time.sleep(interval_seconds)
 
+def watch_cheapest(
+    client: FunPayClient,
+    category: Category,
+    interval_seconds: int = 30,
+    price_floor: float = 0.30,
+    method_filter: str | None = None,
+    tg_token: str | None = None,
+    tg_chat_ids: list[str] | None = None,
+    filter_expr: str | None = None,
+) -> None:
+    """
+    Простой цикл для одной категории (для своих скриптов). run_notifier
+    его больше не использует: даже одна категория идёт через watch_many,
+    иначе не работали бы личные правила /alert, статистика и панель.
+    """
+    token = tg_token or ""
+    chat_ids = tg_chat_ids or []
+    lot_filter = _build_filter(price_floor, method_filter, filter_expr)
 
+    _print_tg_status(token, chat_ids)
 
-def run_notifier() -> None:
-    cfg = load_settings()
-    if not cfg.get("golden_key") or not cfg.get("user_agent"):
-        print("Сначала запусти main.py и введи golden_key и User-Agent.")
-        return
+    outbox, subscribers, sender = _make_outbox(token, chat_ids)
+    outbox.start()
 
-    client = FunPayClient(cfg["golden_key"], cfg["user_agent"] or None)
+    # продолжаем с того места, где остановились в прошлый раз
+    state = WatchStateStore()
+    last_best_key = state.get_fingerprint(category.url)
 
-    category = _choose_category(client)
-    if category is None:
-        print("Мониторинг отменён.")
-        return
+    try:
+        while True:
+            with events.poll_cycle(category.url) as cycle:
+                prev = last_best_key
+                last_best_key = _poll_cheapest(
+                    client,
+                    category,
+                    price_floor,
+                    lot_filter,
+                    outbox,
+                    state,
+                    category.url,
+                    last_best_key,
+                )
+                cycle.changed = prev is not None and last_best_key != prev
+            time.sleep(interval_seconds)
+    finally:
+        _stop_delivery(outbox, subscribers, sender)
+
+
+def _best_summary(watch: Watch, best_key: Optional[str], tracker: TopKTracker | None) -> str:
+    """Лучшая цена подписки для панели: минимум или первые места топ-K."""
+    if not watch.notify_cheapest:
+        return "только правила /alert"
+    if tracker is not None:
+        top = tracker.top()
+        if not top:
+            return "—"
+        prices = " / ".join(f"{lot.price:.4f}" for lot in top[:3])
+        return prices + (" …" if len(top) > 3 else "")
+    if not best_key:
+        return "—"
+    seller, _, rest = best_key.partition("|")
+    price = rest.partition("|")[0]
+    try:
+        return f"{float(price):.4f} ₽ ({seller})"
+    except ValueError:
+        return "—"
+
+
+def _dashboard_frame(
+    watches: list[Watch],
+    stats: dict[str, WatchStats],
+    summaries: dict[str, str],
+    pending: int,
+    status_text: str,
+    recent: list[str],
+) -> list[str]:
+    """Кадр живой панели watch_many(dashboard=True)."""
+    now = time.monotonic()
+    total_rpm = sum(st.requests_per_minute for st in stats.values())
+    lines = [
+        f"=== Мониторинг: {len(watches)} подписок | {total_rpm:.1f} запр./мин | "
+        f"в очереди доставки: {pending} | {time.strftime('%H:%M:%S')} ===",
+    ]
+    if status_text:
+        lines.append(status_text)
+    lines.append("")
+    lines.append(
+        "Категория                      | Лучшая цена                    | Опросов | Измен./мин | Назад"
+    )
+    lines.append("-" * 92)
+    for watch in watches:
+        st = stats.get(watch.key)
+        if st is None:
+            continue
+        ago = f"{now - st.last_poll:4.0f}с" if st.last_poll is not None else "   —"
+        lines.append(
+            f"{watch.category.name[:30].ljust(30)} | "
+            f"{summaries.get(watch.key, 'ждёт первого опроса')[:30].ljust(30)} | "
+            f"{st.polls:7d} | {st.change_rate:10.2f} | {ago}"
+        )
+    lines.append("")
+    lines.append("Последние события:")
+    if recent:
+        lines.extend(f"  {line}" for line in recent)
+    else:
+        lines.append("  —")
+    lines.append("")
+    lines.append("Ctrl+C — остановить")
+    return lines
 
+
+def watch_many(
+    client: FunPayClient,
+    watches: list[Watch],
+    max_concurrency: int = 4,
+    max_requests_per_minute: float | None = None,
+    tg_token: str | None = None,
+    tg_chat_ids: list[str] | None = None,
+    reload: Callable[[], Optional[list[Watch]]] | None = None,
+    status: Callable[[], str] | None = None,
+    report_every: float = 300.0,
+    owns: Callable[[str], bool] | None = None,
+    poll_updates: bool = True,
+    outbox_path: str = OUTBOX_FILE,
+    dashboard: bool = False,
+    follow_settings: bool = False,
+    rate_limiter: RateLimiter | None = None,
+) -> None:
+    """
+    Мониторинг сразу нескольких категорий в одном процессе.
+
+    У каждой подписки свой интервал, джиттер и фильтры; опросами управляет
+    общий WatchScheduler, одновременно идёт не больше max_concurrency запросов,
+    а всего — не больше max_requests_per_minute в минуту (если задано).
+    Раз в report_every секунд печатается статистика: задержка обнаружения
+    против стоимости в запросах (и строка от status, если передан).
+
+    reload вызывается примерно раз в секунду; если он вернул новый список
+    подписок, планировщик переходит на него на ходу: неизменённые подписки
+    не трогаются, а последние снимки, дедупликация и очередь доставки
+    сохраняются.
+
+    Для шардов (kypisa.shards): owns(url) решает, опрашивает ли этот
+    процесс категорию из личных правил /alert; poll_updates=False —
+    подписчиков и правила читаем из файла, getUpdates ведёт другой процесс;
+    outbox_path — своя очередь доставки на каждый процесс.
+
+    dashboard=True — вместо ленты сообщений живая панель (kypisa.render):
+    таблица подписок с лучшей ценой, обновляемая раз в секунду
+    перерисовкой только изменившихся строк; print'ы опросов попадают
+    в блок "Последние события" внизу.
+
+    follow_settings=True — следить за config.json (kypisa.settings):
+    новые notifier_max_rpm и tg_chat_id применяются без перезапуска.
+
+    rate_limiter — готовый лимитер вместо max_requests_per_minute (шард
+    демона меняет его частоту, когда меняется число воркеров).
+    """
+    token = tg_token or ""
+    # обработчик telegram держит ссылку на этот список — меняем его на месте
+    chat_ids = list(tg_chat_ids or [])
+
+    _print_tg_status(token, chat_ids)
+
+    state = WatchStateStore()
+    last_best: dict[str, Optional[str]] = {w.key: state.get_fingerprint(w.key) for w in watches}
+    trackers: dict[str, TopKTracker] = {}
+    # строка "лучшая цена" для панели; пишется из потоков опроса целиком
+    summaries: dict[str, str] = {}
+    alert_index = AlertIndex()
+
+    def handle(watch: Watch) -> bool:
+        # все этапы опроса в журнале событий несут id этого цикла
+        with events.poll_cycle(watch.key) as cycle:
+            cycle.changed = poll(watch)
+            return cycle.changed
+
+    def poll(watch: Watch) -> bool:
+        if not watch.notify_cheapest:
+            # категория нужна только для личных правил подписчиков
+            try:
+                lots = _fetch_lots(client, watch.category)
+            except Exception as e:
+                log(f"NOTIFY: ошибка при загрузке лотов ({watch.category.url}): {e}")
+                return False
+            return _match_alerts(alert_index, watch.category, lots, outbox, state) > 0
+
+        lot_filter = _build_filter(watch.price_floor, watch.method_filter, watch.filter_expr)
+        channels = tuple(watch.channels) if watch.channels is not None else None
+        if watch.top_k > 1:
+            tracker = trackers.get(watch.key)
+            if tracker is None or tracker.k != watch.top_k:
+                known = (last_best.get(watch.key) or "").split("\n")
+                tracker = trackers[watch.key] = TopKTracker(watch.top_k, known=filter(None, known))
+            changed = _poll_top_k(
+                client,
+                watch.category,
+                watch.price_floor,
+                lot_filter,
+                outbox,
+                state,
+                watch.key,
+                tracker,
+                alert_index,
+                channels,
+            )
+            summaries[watch.key] = _best_summary(watch, None, tracker)
+            return changed
+
+        prev = last_best.get(watch.key)
+        cur = _poll_cheapest(
+            client,
+            watch.category,
+            watch.price_floor,
+            lot_filter,
+            outbox,
+            state,
+            watch.key,
+            prev,
+            alert_index,
+            channels,
+        )
+        last_best[watch.key] = cur
+        summaries[watch.key] = _best_summary(watch, cur, None)
+        return prev is not None and cur != prev
+
+    limiter = rate_limiter
+    if limiter is None and max_requests_per_minute:
+        limiter = RateLimiter(max_requests_per_minute)
+    scheduler = WatchScheduler(handle, max_concurrency=max_concurrency, rate_limiter=limiter)
+
+    def sync_rule_watches() -> None:
+        """Категории из правила /alert, которые никто не мониторит, — опрашиваем отдельно."""
+        watched = {w.category.url for w in scheduler.watches() if w.notify_cheapest}
+        wanted = {url for url in alert_index.categories() if owns is None or owns(url)} - watched
+        for w in scheduler.watches():
+            if not w.notify_cheapest and w.category.url not in wanted:
+                scheduler.remove(w.key)
+        current = {w.key for w in scheduler.watches()}
+        for url in wanted:
+            key = f"alerts:{url}"
+            if key not in current:
+                scheduler.add(
+                    Watch(
+                        category=Category(name="Custom", url=url, count=None),
+                        interval_seconds=ALERT_WATCH_INTERVAL,
+                        jitter_seconds=ALERT_WATCH_INTERVAL * 0.1,
+                        key=key,
+                        notify_cheapest=False,
+                    )
+                )
+
+    def on_rules_changed(owner: str, alerts: list[PriceAlert]) -> None:
+        alert_index.replace_owner(owner, alerts)
+        sync_rule_watches()
+
+    outbox, subscribers, sender = _make_outbox(token, chat_ids, on_rules_changed, poll_updates, outbox_path)
+    if subscribers is not None:
+        for alert in subscribers.alerts():
+            alert_index.add(alert)
+        if len(alert_index):
+            print(f"Личных правил подписчиков (/alert): {len(alert_index)}")
+    outbox.start()
+
+    def apply_reload() -> None:
+        new_watches = reload() if reload is not None else None
+        if new_watches is None:
+            return
+        current = {w.key: w for w in scheduler.watches() if w.notify_cheapest}
+        wanted = {w.key: w for w in new_watches}
+        for key in current.keys() - wanted.keys():
+            scheduler.remove(key)
+            trackers.pop(key, None)
+        added = changed = 0
+        for key, watch in wanted.items():
+            old = current.get(key)
+            if old == watch:
+                continue
+            if old is None:
+                added += 1
+                # подписка могла переехать к нам с другого шарда — берём её
+                # последний снимок из общего состояния, а не наш устаревший
+                last_best[key] = state.get_fingerprint(key)
+                trackers.pop(key, None)
+            else:
+                changed += 1
+                scheduler.remove(key)
+            scheduler.add(watch, delay=(added + changed) * 0.5)
+        sync_rule_watches()
+        removed = len(current.keys() - wanted.keys())
+        print(f"Подписки обновлены: +{added}, изменено {changed}, -{removed}.")
+        log(f"NOTIFY: перезагрузка подписок: +{added}, ~{changed}, -{removed}")
+
+    next_refresh = [0.0]
+    screen = Screen() if dashboard else None
+    tail = OutputTail(DASHBOARD_EVENTS) if dashboard else None
+
+    def draw_dashboard() -> None:
+        assert screen is not None and tail is not None
+        screen.draw(
+            _dashboard_frame(
+                scheduler.watches(),
+                scheduler.stats(),
+                summaries,
+                outbox.pending_count(),
+                status() if status is not None else "",
+                tail.recent(),
+            )
+        )
+
+    def on_settings(changed: set[str], cfg: dict) -> None:
+        if "notifier_max_rpm" in changed and limiter is not None:
+            limiter.set_rate(float(cfg.get("notifier_max_rpm") or 60))
+            print(f"Общий лимит из config.json: {limiter.per_minute:.0f} запросов в минуту.")
+        if "tg_chat_id" in changed and token:
+            chat_ids[:] = _get_chat_ids(cfg.get("tg_chat_id"))
+            _print_tg_status(token, chat_ids)
+        if "tg_bot_token" in changed:
+            print("Токен Telegram в config.json изменён — он подхватится после перезапуска.")
+        log(f"NOTIFY: настройки изменены: {', '.join(sorted(changed))}")
+
+    unsubscribe = (
+        get_store().subscribe(on_settings, keys=("notifier_max_rpm", "tg_chat_id", "tg_bot_token"))
+        if follow_settings
+        else None
+    )
+
+    def tick() -> None:
+        if follow_settings:
+            # stat config.json; подписчик вызовется, только если файл поменялся
+            get_store().refresh()
+        if not poll_updates and subscribers is not None and time.monotonic() >= next_refresh[0]:
+            next_refresh[0] = time.monotonic() + 5.0
+            subscribers.refresh()
+        apply_reload()
+        if screen is not None:
+            draw_dashboard()
+
+    def report() -> None:
+        text = format_stats(scheduler.watches(), scheduler.stats())
+        text += f"\nВ очереди доставки: {outbox.pending_count()}"
+        text += "\n" + client.metrics.summary()
+        if status is not None:
+            text += "\n" + status()
+        log("NOTIFY: статистика\n" + text)
+        if screen is not None:
+            # всё это и так видно на панели
+            return
+        print("\n=== Статистика нотификатора ===")
+        print(text)
+
+    # разносим первые опросы, чтобы не стрелять всеми запросами сразу
+    for i, watch in enumerate(watches):
+        scheduler.add(watch, delay=i * 0.5)
+    sync_rule_watches()
+    try:
+        # в режиме панели print'ы опросов уходят в её блок событий
+        with redirect_stdout(tail) if tail is not None else nullcontext():
+            scheduler.run_forever(
+                report=report,
+                report_every=report_every,
+                tick=tick if (reload is not None or not poll_updates or dashboard or follow_settings) else None,
+            )
+    finally:
+        if unsubscribe is not None:
+            unsubscribe()
+        _stop_delivery(outbox, subscribers, sender)
+    if screen is not None:
+        # итоговую статистику ниже печатаем уже обычным текстом
+        screen = None
+        print("\nМониторинг остановлен.")
+    report()
+
+
+def _ask_watch(category: Category) -> Watch:
+    """Спрашиваем интервал и фильтры для одной категории."""
     try:
         raw = input("Интервал проверки (в секундах, по умолчанию 30): ").strip()
         interval = int(raw) if raw else 30
@@ -398,6 +955,64 @@ def run_notifier() -> None:
     if not method_filter:
         method_filter = None
 
+    filter_expr = _ask_filter_expr(
+        "Доп. фильтр (например: rating >= 4 and online and not desc ~ аренда; можно пусто): "
+    )
+
+    try:
+        raw_k = input("Сколько самых дешёвых лотов отслеживать (топ-K, по умолчанию 1): ").strip()
+        top_k = max(1, int(raw_k)) if raw_k else 1
+    except Exception:
+        top_k = 1
+
+    return Watch(
+        category=category,
+        interval_seconds=interval,
+        # немного разброса, чтобы несколько категорий не опрашивались синхронно
+        jitter_seconds=min(5.0, interval * 0.1),
+        price_floor=price_floor,
+        method_filter=method_filter,
+        filter_expr=filter_expr,
+        top_k=top_k,
+    )
+
+
+def _ask_filter_expr(prompt: str) -> str | None:
+    while True:
+        raw = input(prompt).strip()
+        if not raw:
+            return None
+        try:
+            compile_filter(raw)
+        except FilterError as e:
+            print(f"Ошибка в фильтре: {e}")
+            continue
+        return raw
+
+
+def run_notifier() -> None:
+    cfg = load_settings()
+    if not cfg.get("golden_key") or not cfg.get("user_agent"):
+        print("Сначала запусти main.py и введи golden_key и User-Agent.")
+        return
+
+    client = FunPayClient(cfg["golden_key"], cfg["user_agent"] or None, cache_ttl=WATCH_CACHE_TTL_SECONDS)
+    startup.ready("notifier", ["kypisa.notifier"])
+
+    watches: list[Watch] = []
+    while True:
+        category = _choose_category(client)
+        if category is None:
+            break
+        watches.append(_ask_watch(category))
+        more = input("Добавить ещё категорию для мониторинга? [y/N]: ").strip().lower()
+        if more != "y":
+            break
+
+    if not watches:
+        print("Мониторинг отменён.")
+        return
+
     # === Telegram блок с сохранением в config.json ===
     print("\n=== Telegram настройки для этого нотификатора ===")
 
@@ -444,13 +1059,30 @@ def run_notifier() -> None:
 
     tg_chat_ids = _get_chat_ids(tg_chat_raw) if (tg_token and tg_chat_raw) else []
 
-    print(f"\nЗапускаю мониторинг '{category.name}' с интервалом {interval} с...")
-    watch_cheapest(
+    adaptive = input(
+        "Адаптивный интервал (чаще опрашивать активные категории, реже — пустые)? [y/N]: "
+    ).strip().lower() == "y"
+    if adaptive:
+        for watch in watches:
+            watch.adaptive = True
+            watch.min_interval_seconds = max(1.0, watch.interval_seconds / 4)
+            watch.max_interval_seconds = watch.interval_seconds * 10
+
+    max_rpm = cfg.get("notifier_max_rpm") or 60
+
+    print(f"\nЗапускаю мониторинг {len(watches)} категорий в одном процессе:")
+    for watch in watches:
+        print(f" - {watch.category.name}: каждые {watch.interval_seconds} с")
+    print(f"Общий лимит: не больше {max_rpm} запросов в минуту.")
+    dashboard = input(
+        "Показывать живую панель (таблица цен по категориям) вместо ленты? [y/N]: "
+    ).strip().lower() == "y"
+    watch_many(
         client,
-        category,
-        interval_seconds=interval,
-        price_floor=price_floor,
-        method_filter=method_filter,
+        watches,
+        max_requests_per_minute=float(max_rpm),
         tg_token=tg_token,
         tg_chat_ids=tg_chat_ids,
+        dashboard=dashboard,
+        follow_settings=True,
     )
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import copy
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List
+
+from .logger import log
+
+# обработчик канала: получает payload (или список payload'ов для каналов
+# со склейкой), при ошибке бросает исключение
+ChannelHandler = Callable[[Any], None]
+
+
+@dataclass
+class OutboxItem:
+    channel: str
+    payload: Dict[str, Any]
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    next_attempt: float = 0.0  # time.time(), чтобы переживать перезапуск
+    created: float = field(default_factory=time.time)
+
+
+class Outbox:
+    """
+    Очередь уведомлений с фоновой доставкой.
+
+    Цикл опроса только вызывает enqueue() и сразу идёт дальше. У каждого
+    канала (windows, telegram, ...) своя очередь и свои потоки-доставщики,
+    поэтому медленный Telegram не задерживает ни опрос, ни другие каналы.
+    Неудачная доставка повторяется с экспоненциальной паузой, а всё
+    недоставленное лежит в JSON-файле и подхватывается после перезапуска.
+
+    batch_windows: для перечисленных каналов доставщик ждёт указанное
+    число секунд, собирает всё, что накопилось (до max_batch штук), и
+    передаёт обработчику списком — так пачка событий уходит одним дайджестом.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        handlers: Dict[str, ChannelHandler],
+        workers_per_channel: int = 1,
+        max_attempts: int = 8,
+        base_delay: float = 2.0,
+        max_delay: float = 300.0,
+        flush_interval: float = 0.5,
+        batch_windows: Dict[str, float] | None = None,
+        max_batch: int = 20,
+    ) -> None:
+        self.path = path
+        self._handlers = handlers
+        self._batch_windows = batch_windows or {}
+        self.max_batch = max(1, max_batch)
+        self._workers_per_channel = max(1, workers_per_channel)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._conds: Dict[str, threading.Condition] = {
+            ch: threading.Condition(self._lock) for ch in handlers
+        }
+        self._queues: Dict[str, List[tuple[float, int, OutboxItem]]] = {ch: [] for ch in handlers}
+        self._pending: Dict[str, OutboxItem] = {}
+        self._seq = itertools.count()
+        self._dirty = False
+        self._stopped = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        self._load()
+
+    # ---------- диск ----------
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            log(f"OUTBOX: ошибка чтения {self.path}: {e}")
+            return
+        if not isinstance(data, list):
+            return
+        restored = 0
+        for raw in data:
+            try:
+                item = OutboxItem(**raw)
+            except Exception:
+                continue
+            if item.channel not in self._handlers:
+                continue
+            with self._lock:
+                self._add_locked(item)
+            restored += 1
+        if restored:
+            log(f"OUTBOX: восстановлено недоставленных уведомлений: {restored}")
+
+    def _flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = [asdict(item) for item in self._pending.values()]
+            self._dirty = False
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log(f"OUTBOX: ошибка записи {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
+
+    # ---------- очередь ----------
+
+    def _add_locked(self, item: OutboxItem) -> None:
+        self._pending[item.id] = item
+        heapq.heappush(self._queues[item.channel], (item.next_attempt, next(self._seq), item))
+        self._dirty = True
+        self._conds[item.channel].notify()
+
+    def enqueue(self, channel: str, payload: Dict[str, Any]) -> None:
+        """Положить уведомление в очередь канала. Не блокирует."""
+        if channel not in self._handlers:
+            log(f"OUTBOX: неизвестный канал {channel}, уведомление пропущено")
+            return
+        with self._lock:
+            self._add_locked(OutboxItem(channel=channel, payload=payload))
+
+    @property
+    def channels(self) -> List[str]:
+        return list(self._handlers)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    # ---------- потоки ----------
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stopped.clear()
+        for channel in self._handlers:
+            for i in range(self._workers_per_channel):
+                t = threading.Thread(
+                    target=self._worker,
+                    args=(channel,),
+                    name=f"kypisa-outbox-{channel}-{i}",
+                    daemon=True,
+                )
+                t.start()
+                self._threads.append(t)
+        t = threading.Thread(target=self._flusher, name="kypisa-outbox-flush", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Останавливаем доставщиков и сохраняем то, что не успели доставить."""
+        self._stopped.set()
+        with self._lock:
+            for cond in self._conds.values():
+                cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        self._flush()
+
+    def _flusher(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self._flush()
+            except Exception as e:
+                # поток не должен умирать: иначе очередь не сохранится до stop()
+                log(f"OUTBOX: ошибка сохранения очереди: {e}")
+
+    def _take(self, channel: str) -> List[OutboxItem]:
+        """Ждём первое готовое уведомление; для склеиваемых каналов — пачку."""
+        cond = self._conds[channel]
+        queue = self._queues[channel]
+        window = self._batch_windows.get(channel)
+        with cond:
+            while not self._stopped.is_set():
+                if not queue:
+                    cond.wait()
+                    continue
+                due = queue[0][0]
+                now = time.time()
+                if due > now:
+                    cond.wait(due - now)
+                    continue
+                batch = [heapq.heappop(queue)[2]]
+                if window is None:
+                    return batch
+                # даём событиям накопиться, потом забираем всё, что готово
+                deadline = time.time() + window
+                while not self._stopped.is_set() and time.time() < deadline:
+                    cond.wait(deadline - time.time())
+                now = time.time()
+                while queue and queue[0][0] <= now and len(batch) < self.max_batch:
+                    batch.append(heapq.heappop(queue)[2])
+                return batch
+        return []
+
+    def _worker(self, channel: str) -> None:
+        handler = self._handlers[channel]
+        batched = channel in self._batch_windows
+        while True:
+            items = self._take(channel)
+            if not items:
+                return
+            # обработчик получает копии: он может их менять (например, список
+            # уже доставленных чатов), а _flush тем временем сериализует оригиналы
+            with self._lock:
+                payloads = [copy.deepcopy(item.payload) for item in items]
+            try:
+                handler(payloads if batched else payloads[0])
+            except Exception as e:
+                for item, payload in zip(items, payloads):
+                    self._retry(item, e, payload)
+            else:
+                with self._lock:
+                    for item in items:
+                        self._pending.pop(item.id, None)
+                    self._dirty = True
+
+    def _retry(self, item: OutboxItem, error: Exception, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            # payload мог измениться (например, список уже доставленных чатов)
+            item.payload = payload
+            item.attempts += 1
+            if item.attempts >= self.max_attempts:
+                self._pending.pop(item.id, None)
+                self._dirty = True
+                log(
+                    f"OUTBOX: {item.channel}: уведомление {item.id} отброшено "
+                    f"после {item.attempts} попыток: {error}"
+                )
+                return
+            delay = min(self.max_delay, self.base_delay * (2 ** (item.attempts - 1)))
+            delay *= random.uniform(0.8, 1.2)
+            item.next_attempt = time.time() + delay
+            self._add_locked(item)
+        log(
+            f"OUTBOX: {item.channel}: ошибка доставки ({error}), "
+            f"повтор через {delay:.1f} с (попытка {item.attempts})"
+        )
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Простой token bucket: не больше per_minute запросов в минуту.
+
+    burst — сколько запросов можно сделать подряд после простоя.
+    Потокобезопасный, им можно делиться между планировщиком,
+    клиентом FunPay и фоновыми задачами.
+    """
+
+    def __init__(self, per_minute: float, burst: int | None = None) -> None:
+        self.per_minute = float(per_minute)
+        self.capacity = float(burst if burst is not None else max(1, int(per_minute // 6) or 1))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        rate = self.per_minute / 60.0
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        """Ждём токен. Возвращает False, если не дождались за timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait = (1.0 - self._tokens) * 60.0 / self.per_minute
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                wait = min(wait, left)
+            time.sleep(wait)
+
+    def set_rate(self, per_minute: float) -> None:
+        """Поменять лимит на ходу (накопленные токены сохраняются)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.per_minute = float(per_minute)
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import io
+import os
+import re
+import shutil
+import sys
+import threading
+import unicodedata
+from collections import deque
+from typing import Iterable, List, Optional, TextIO
+
+# CSI-последовательности: цвета, перемещение курсора и т.п.
+_ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+CLEAR = "\x1b[H\x1b[2J"
+RESET = "\x1b[0m"
+
+_ansi_ready: Optional[bool] = None
+
+# ZWJ и текстовый селектор варианта места на экране не занимают
+_ZERO_WIDTH = frozenset(map(chr, (0x200D, 0xFE0E)))
+_EMOJI_VS = chr(0xFE0F)
+
+
+def enable_ansi() -> bool:
+    """
+    Включить разбор ANSI-последовательностей в консоли Windows
+    (ENABLE_VIRTUAL_TERMINAL_PROCESSING). На остальных системах он и так есть.
+    """
+    global _ansi_ready
+    if _ansi_ready is not None:
+        return _ansi_ready
+    if os.name != "nt":
+        _ansi_ready = True
+        return True
+    try:
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            _ansi_ready = False
+        else:
+            _ansi_ready = bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))
+    except Exception:
+        _ansi_ready = False
+    return _ansi_ready
+
+
+def clear_screen(stream: Optional[TextIO] = None) -> None:
+    """Очистить экран одной записью в терминал, без запуска cls/clear."""
+    stream = stream or sys.stdout
+    if not enable_ansi():
+        os.system("cls")
+        return
+    # \x1b[3J — заодно и буфер прокрутки, как делает cls
+    stream.write(CLEAR + "\x1b[3J")
+    stream.flush()
+
+
+def _char_width(ch: str, prev: int = 0) -> int:
+    if ch == _EMOJI_VS:
+        # "✉️": узкий символ + селектор эмодзи терминал рисует в две колонки
+        return 1 if prev == 1 else 0
+    if unicodedata.combining(ch) or ch in _ZERO_WIDTH:
+        return 0
+    if unicodedata.east_asian_width(ch) in ("W", "F"):
+        return 2
+    return 1
+
+
+def visible_width(line: str) -> int:
+    """Сколько колонок строка займёт на экране (без учёта ANSI-кодов)."""
+    total = prev = 0
+    for ch in _ANSI_RE.sub("", line):
+        prev = _char_width(ch, prev)
+        total += prev
+    return total
+
+
+def fit(line: str, width: int) -> str:
+    """
+    Обрезать строку до width колонок, не ломая ANSI-коды. Перенос строки
+    терминалом сбил бы номера строк, по которым рисует Screen.
+    """
+    if width <= 0:
+        return ""
+    out: List[str] = []
+    used = prev = 0
+    pos = 0
+    styled = False
+    while pos < len(line):
+        m = _ANSI_RE.match(line, pos)
+        if m:
+            out.append(m.group())
+            styled = True
+            pos = m.end()
+            continue
+        ch = line[pos]
+        w = _char_width(ch, prev)
+        if used + w > width:
+            if styled:
+                out.append(RESET)
+            return "".join(out)
+        out.append(ch)
+        used += w
+        prev = w
+        pos += 1
+    return "".join(out)
+
+
+class Screen:
+    """
+    Дифференциальная отрисовка "живых" экранов (мониторы, панели).
+
+    Хранит последний кадр и на следующем draw() переписывает только
+    изменившиеся строки: курсор ставится на строку ANSI-последовательностью,
+    строка печатается и добивается \\x1b[K. Весь кадр уходит в терминал
+    одной записью, так что даже сотни строк, обновляемые раз в несколько
+    секунд, не мигают и почти ничего не стоят.
+
+    Последняя строка кадра — строка ввода: после отрисовки курсор стоит
+    в её конце. Если в терминал писал кто-то ещё (print, input), нужно
+    вызвать invalidate() — следующий кадр будет нарисован целиком.
+
+    Консоль без ANSI (старая Windows) курсор ставить не умеет: там каждый
+    изменившийся кадр рисуется заново — clear_screen() и строки без кодов.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        # запоминаем поток сразу: sys.stdout потом могут перенаправить
+        self._out = stream or sys.stdout
+        self._lines: List[str] = []
+        self._size: Optional[os.terminal_size] = None
+        self._full = True
+        self.frames = 0
+        self.last_bytes = 0
+        self._ansi = enable_ansi()
+
+    def invalidate(self) -> None:
+        self._full = True
+
+    def render(self, lines: Iterable[str]) -> str:
+        """Что нужно записать в терминал, чтобы показать кадр ("" — ничего)."""
+        size = shutil.get_terminal_size((100, 40))
+        frame: List[str] = []
+        for line in lines:
+            frame.extend(str(line).split("\n"))
+        if len(frame) > size.lines:
+            # не влезает — режем середину, строку ввода оставляем
+            frame = frame[: size.lines - 1] + frame[-1:]
+        # последняя колонка не занимается: иначе терминал сам переносит курсор
+        frame = [fit(line, size.columns - 1) for line in frame]
+
+        full = self._full or size != self._size
+        if not self._ansi:
+            frame = [_ANSI_RE.sub("", line) for line in frame]
+            if not full and frame == self._lines:
+                return ""
+            self._lines = frame
+            self._size = size
+            self._full = False
+            return "\n".join(frame)
+
+        old = [] if full else self._lines
+        changed = [i for i, line in enumerate(frame) if i >= len(old) or old[i] != line]
+        if not full and not changed and len(frame) == len(old):
+            return ""
+
+        parts = [HIDE_CURSOR]
+        if full:
+            parts.append(CLEAR)
+        for i in changed:
+            parts.append(f"\x1b[{i + 1};1H{frame[i]}\x1b[K")
+        if len(frame) < len(old):
+            parts.append(f"\x1b[{len(frame) + 1};1H\x1b[J")
+        if frame and (len(frame) - 1) not in changed:
+            last = len(frame) - 1
+            parts.append(f"\x1b[{last + 1};{visible_width(frame[last]) + 1}H")
+        parts.append(SHOW_CURSOR)
+
+        self._lines = frame
+        self._size = size
+        self._full = False
+        return "".join(parts)
+
+    def draw(self, lines: Iterable[str]) -> int:
+        """Показать кадр; возвращает число записанных символов."""
+        data = self.render(lines)
+        if data:
+            if not self._ansi:
+                clear_screen(self._out)
+            self._out.write(data)
+            self._out.flush()
+            self.frames += 1
+        self.last_bytes = len(data)
+        return self.last_bytes
+
+
+class OutputTail(io.TextIOBase):
+    """
+    Поток для contextlib.redirect_stdout: вместо прокрутки экрана
+    запоминает последние maxlen непустых строк, чтобы живая панель
+    показала их у себя внизу.
+    """
+
+    def __init__(self, maxlen: int = 8) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self._lines: deque[str] = deque(maxlen=maxlen)
+        self._partial = ""
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            *done, self._partial = (self._partial + text).split("\n")
+            for line in done:
+                line = line.rstrip("\r")
+                if line.strip():
+                    self._lines.append(line)
+        return len(text)
+
+    def recent(self) -> List[str]:
+        with self._lock:
+            return list(self._lines)
@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from .models import Category
+from .logger import log
+from .ratelimit import RateLimiter
+
+
+@dataclass
+class Watch:
+    """
+    Одна подписка нотификатора: какую категорию смотрим и как часто.
+
+    key — уникальный идентификатор подписки (по умолчанию URL категории).
+    jitter_seconds — случайная добавка к интервалу, чтобы сотня подписок
+    не стреляла запросами в одну и ту же секунду.
+    adaptive — подстраивать интервал под активность категории
+    в пределах [min_interval_seconds, max_interval_seconds].
+    channels — куда слать уведомления ("telegram", "windows"); None — во все.
+    top_k > 1 — следить не только за минимумом, а за K самыми дешёвыми
+    лотами (kypisa.topk).
+    notify_cheapest=False — категория опрашивается только ради личных
+    правил подписчиков (kypisa.alerts), без общего "новый минимум".
+    """
+
+    category: Category
+    interval_seconds: float = 30.0
+    jitter_seconds: float = 0.0
+    price_floor: float = 0.30
+    method_filter: Optional[str] = None
+    filter_expr: Optional[str] = None  # см. kypisa.filters
+    key: str = ""
+    adaptive: bool = False
+    min_interval_seconds: float = 5.0
+    max_interval_seconds: float = 600.0
+    top_k: int = 1
+    channels: Optional[List[str]] = None
+    notify_cheapest: bool = True
+
+    def __post_init__(self) -> None:
+        if not self.key:
+            self.key = self.category.url
+
+
+@dataclass
+class WatchStats:
+    """
+    Статистика одной подписки.
+
+    Задержку обнаружения оцениваем как половину промежутка между
+    опросами, на котором заметили изменение: само изменение могло
+    случиться в любой момент этого промежутка.
+    """
+
+    interval: float
+    polls: int = 0
+    changes: int = 0
+    latency_sum: float = 0.0
+    change_rate: float = 0.0  # изменений в минуту: ewma_changes / ewma_minutes
+    ewma_changes: float = 0.0  # EWMA числа изменений за опрос (0 или 1)
+    ewma_minutes: float = 0.0  # EWMA длины промежутка между опросами, мин
+    last_poll: Optional[float] = None
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def avg_latency(self) -> float:
+        return self.latency_sum / self.changes if self.changes else 0.0
+
+    @property
+    def requests_per_minute(self) -> float:
+        minutes = max(1e-9, (time.monotonic() - self.started) / 60.0)
+        return self.polls / minutes
+
+
+# сколько опросов хотим на одно изменение категории: интервал адаптивной
+# подписки = среднее время между изменениями / ADAPT_POLLS_PER_CHANGE
+ADAPT_POLLS_PER_CHANGE = 2.0
+# до стольких опросов частоте изменений не верим и держим исходный интервал
+ADAPT_WARMUP_POLLS = 3
+# вес нового наблюдения в EWMA частоты изменений
+ADAPT_EWMA_ALPHA = 0.2
+
+
+class WatchScheduler:
+    """
+    Планировщик для множества подписок в одном процессе.
+
+    Внутри — куча (heapq) с моментами следующего опроса и один поток,
+    который спит до ближайшего срока. Сами опросы уходят в общий пул
+    потоков, а семафор ограничивает число одновременных запросов
+    (глобальный бюджет). Пока опрос подписки не закончился, следующий
+    для неё не планируется — одна категория не опрашивается параллельно.
+
+    handler возвращает True, если снимок категории изменился: из этого
+    сигнала учится частота изменений (change_rate), от которой зависит
+    интервал адаптивных подписок. Общий
+    rate_limiter держит суммарную частоту запросов под лимитом.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Watch], Optional[bool]],
+        max_concurrency: int = 4,
+        rate_limiter: RateLimiter | None = None,
+    ) -> None:
+        self._handler = handler
+        self._rate_limiter = rate_limiter
+        self._max_concurrency = max(1, max_concurrency)
+        self._heap: List[tuple[float, int, Watch]] = []
+        self._seq = itertools.count()
+        self._watches: Dict[str, Watch] = {}
+        self._stats: Dict[str, WatchStats] = {}
+        self._cond = threading.Condition()
+        self._budget = threading.BoundedSemaphore(self._max_concurrency)
+        self._pool: ThreadPoolExecutor | None = None
+        self._thread: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    # ---------- список подписок ----------
+
+    def add(self, watch: Watch, delay: float = 0.0) -> None:
+        """Добавить (или заменить) подписку; первый опрос — через delay секунд."""
+        with self._cond:
+            self._watches[watch.key] = watch
+            if watch.key not in self._stats:
+                self._stats[watch.key] = WatchStats(interval=self._clamp(watch, watch.interval_seconds))
+            self._push(watch, time.monotonic() + delay)
+
+    def remove(self, key: str) -> None:
+        """Убрать подписку. Запись в куче останется, но будет пропущена."""
+        with self._cond:
+            self._watches.pop(key, None)
+            self._stats.pop(key, None)
+            self._cond.notify()
+
+    def watches(self) -> List[Watch]:
+        with self._cond:
+            return list(self._watches.values())
+
+    def stats(self) -> Dict[str, WatchStats]:
+        with self._cond:
+            return dict(self._stats)
+
+    def _push(self, watch: Watch, due: float) -> None:
+        heapq.heappush(self._heap, (due, next(self._seq), watch))
+        self._cond.notify()
+
+    @staticmethod
+    def _clamp(watch: Watch, interval: float) -> float:
+        if not watch.adaptive:
+            return max(1.0, float(interval))
+        lo = max(1.0, watch.min_interval_seconds)
+        hi = max(lo, watch.max_interval_seconds)
+        return min(hi, max(lo, float(interval)))
+
+    def _record(self, watch: Watch, changed: bool) -> None:
+        """Обновляем статистику и (для адаптивных подписок) интервал."""
+        st = self._stats.get(watch.key)
+        if st is None:
+            return
+        now = time.monotonic()
+        if changed and st.last_poll is not None:
+            st.changes += 1
+            st.latency_sum += (now - st.last_poll) / 2.0
+        if st.last_poll is not None:
+            # отношение двух EWMA, а не EWMA от 1/промежуток: та оценка
+            # зависит от самого интервала и раскачивает его
+            gap_min = (now - st.last_poll) / 60.0
+            st.ewma_changes += ADAPT_EWMA_ALPHA * ((1.0 if changed else 0.0) - st.ewma_changes)
+            st.ewma_minutes += ADAPT_EWMA_ALPHA * (gap_min - st.ewma_minutes)
+            st.change_rate = st.ewma_changes / st.ewma_minutes if st.ewma_minutes > 0 else 0.0
+        st.polls += 1
+        st.last_poll = now
+
+        if watch.adaptive and st.polls >= ADAPT_WARMUP_POLLS:
+            # интервал — из выученной частоты изменений, а не из последнего
+            # опроса: категория, меняющаяся "через раз", не скачет между
+            # min и max; ни разу не менявшаяся уходит к max
+            if st.change_rate > 0:
+                interval = 60.0 / (st.change_rate * ADAPT_POLLS_PER_CHANGE)
+            else:
+                interval = watch.max_interval_seconds
+            st.interval = self._clamp(watch, interval)
+
+    def _next_delay(self, watch: Watch) -> float:
+        st = self._stats.get(watch.key)
+        delay = st.interval if st is not None else self._clamp(watch, watch.interval_seconds)
+        if watch.jitter_seconds > 0:
+            delay += random.uniform(0, watch.jitter_seconds)
+        return delay
+
+    # ---------- запуск / остановка ----------
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._pool = ThreadPoolExecutor(
+            max_workers=self._max_concurrency,
+            thread_name_prefix="kypisa-watch",
+        )
+        self._thread = threading.Thread(
+            target=self._loop, name="kypisa-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def run_forever(
+        self,
+        report: Callable[[], None] | None = None,
+        report_every: float = 300.0,
+        tick: Callable[[], None] | None = None,
+    ) -> None:
+        """
+        Блокирующий запуск (для CLI): до Ctrl+C; report вызывается раз в
+        report_every секунд, tick — примерно раз в секунду (например,
+        проверить, не поменялся ли файл подписок).
+        """
+        self.start()
+        next_report = time.monotonic() + report_every
+        try:
+            while not self._stopped.wait(1.0):
+                if tick is not None:
+                    try:
+                        tick()
+                    except Exception as e:
+                        log(f"NOTIFY: ошибка в периодической задаче планировщика: {e}")
+                if report is not None and time.monotonic() >= next_report:
+                    report()
+                    next_report = time.monotonic() + report_every
+        except KeyboardInterrupt:
+            print("\nМониторинг остановлен (Ctrl+C).")
+        finally:
+            self.stop()
+
+    # ---------- основной цикл ----------
+
+    def _pop_due(self) -> Optional[Watch]:
+        """Ждём ближайшую подписку, у которой наступил срок опроса."""
+        with self._cond:
+            while not self._stopped.is_set():
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, watch = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                # подписку удалили или заменили — старую запись выкидываем
+                if self._watches.get(watch.key) is not watch:
+                    continue
+                return watch
+        return None
+
+    def _loop(self) -> None:
+        while not self._stopped.is_set():
+            watch = self._pop_due()
+            if watch is None:
+                return
+            # ждём свободный слот бюджета, не держа блокировку кучи
+            while not self._budget.acquire(timeout=1.0):
+                if self._stopped.is_set():
+                    return
+            # и токен общего лимита запросов в минуту
+            if self._rate_limiter is not None:
+                while not self._rate_limiter.acquire(timeout=1.0):
+                    if self._stopped.is_set():
+                        self._budget.release()
+                        return
+            assert self._pool is not None
+            self._pool.submit(self._run, watch)
+
+    def _run(self, watch: Watch) -> None:
+        changed = False
+        try:
+            changed = bool(self._handler(watch))
+        except Exception as e:
+            log(f"NOTIFY: ошибка в обработчике подписки {watch.key}: {e}")
+        finally:
+            self._budget.release()
+            with self._cond:
+                self._record(watch, changed)
+                if self._watches.get(watch.key) is watch:
+                    self._push(watch, time.monotonic() + self._next_delay(watch))
+
+
+def format_stats(watches: List[Watch], stats: Dict[str, WatchStats]) -> str:
+    """Табличка: интервал, частота изменений, задержка обнаружения и цена в запросах."""
+    lines = [
+        "Категория                      | Интервал | Измен./мин | Задержка | Запр./мин | Опросов",
+        "-" * 90,
+    ]
+    total_rpm = 0.0
+    for watch in watches:
+        st = stats.get(watch.key)
+        if st is None:
+            continue
+        total_rpm += st.requests_per_minute
+        name = watch.category.name[:30].ljust(30)
+        lines.append(
+            f"{name} | {st.interval:7.1f}с | {st.change_rate:10.2f} | "
+            f"{st.avg_latency:7.1f}с | {st.requests_per_minute:9.2f} | {st.polls}"
+        )
+    lines.append("-" * 90)
+    lines.append(f"Всего запросов в минуту: {total_rpm:.2f}")
+    return "\n".join(lines)
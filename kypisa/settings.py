@@ -1,6 +1,11 @@
+from __future__ import annotations
+
 import json
 import os
-from typing import Any, Dict
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
 DEFAULT_CONFIG: Dict[str, Any] = {
     "golden_key": "",
@@ -10,6 +15,12 @@ DEFAULT_CONFIG: Dict[str, Any] = {
     "log_enabled": True,
 }
 
+# config.json проверяем (stat, без чтения) не чаще, чем раз в столько секунд
+SETTINGS_CHECK_SECONDS = 1.0
+
+# callback(изменившиеся ключи, новый конфиг)
+SettingsCallback = Callable[[Set[str], Dict[str, Any]], None]
+
 
 def get_base_dir() -> str:
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -19,21 +30,192 @@ def get_config_path() -> str:
     return os.path.join(get_base_dir(), "config.json")
 
 
-def load_settings() -> Dict[str, Any]:
-    path = get_config_path()
-    cfg = DEFAULT_CONFIG.copy()
-    if os.path.exists(path):
+def _changed_keys(old: Dict[str, Any], new: Dict[str, Any]) -> Set[str]:
+    return {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+
+
+class SettingsStore:
+    """
+    Разобранный config.json в памяти.
+
+    Файл перечитывается, только если у него поменялись mtime или размер,
+    а проверяется это не чаще раза в check_interval секунд — так что
+    get()/get_setting() можно звать хоть на каждую строку лога.
+
+    Подписчики (subscribe) узнают об изменённых ключах: и после save()
+    в этом процессе, и когда config.json переписал другой процесс
+    (заметим при ближайшей проверке). save() пишет атомарно: во временный
+    файл рядом, fsync и os.replace — читатель видит либо старый файл,
+    либо новый, но не половину.
+    """
+
+    def __init__(self, path: str | None = None, check_interval: float = SETTINGS_CHECK_SECONDS) -> None:
+        self.path = path or get_config_path()
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._cfg: Optional[Dict[str, Any]] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._checked = 0.0
+        self._subscribers: List[Tuple[SettingsCallback, Optional[FrozenSet[str]]]] = []
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        """Конфиг поверх DEFAULT_CONFIG; None — файл есть, но не читается."""
+        cfg = DEFAULT_CONFIG.copy()
+        if not os.path.exists(self.path):
+            return cfg
         try:
-            with open(path, "r", encoding="utf-8") as f:
+            with open(self.path, "r", encoding="utf-8") as f:
                 data = json.load(f)
-            if isinstance(data, dict):
-                cfg.update(data)
         except Exception:
-            pass
-    return cfg
+            return None
+        if isinstance(data, dict):
+            cfg.update(data)
+        return cfg
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Перечитать config.json, если он изменился на диске. Без force —
+        не чаще раза в check_interval. True — какие-то значения поменялись.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._cfg is not None and now - self._checked < self.check_interval:
+                return False
+            self._checked = now
+            stamp = self._stat()
+            if self._cfg is not None and stamp == self._stamp:
+                return False
+            cfg = self._read()
+            old = self._cfg
+            self._stamp = stamp
+            if cfg is None:
+                # битый файл (правили руками) — живём со старыми значениями
+                if old is None:
+                    self._cfg = DEFAULT_CONFIG.copy()
+                return False
+            self._cfg = cfg
+        if old is None:
+            return False
+        changed = _changed_keys(old, cfg)
+        self._notify(changed, cfg)
+        return bool(changed)
+
+    def get(self) -> Dict[str, Any]:
+        """Копия конфига: её можно менять и потом отдать в save()."""
+        self.refresh()
+        with self._lock:
+            return dict(self._cfg or {})
+
+    def get_setting(self, key: str, default: Any = None) -> Any:
+        self.refresh()
+        with self._lock:
+            return (self._cfg or {}).get(key, default)
+
+    def save(self, cfg: Dict[str, Any]) -> None:
+        self._write_atomic(cfg)
+        new = DEFAULT_CONFIG.copy()
+        new.update(cfg)
+        with self._lock:
+            old = self._cfg
+            self._cfg = new
+            self._stamp = self._stat()
+            self._checked = time.monotonic()
+        if old is not None:
+            self._notify(_changed_keys(old, new), new)
+
+    def _write_atomic(self, cfg: Dict[str, Any]) -> None:
+        folder = os.path.dirname(self.path) or "."
+        fd, tmp = tempfile.mkstemp(prefix=".config.", suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(cfg, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            for attempt in range(5):
+                try:
+                    os.replace(tmp, self.path)
+                    break
+                except PermissionError:
+                    # Windows не даёт заменить файл, пока его кто-то читает
+                    if attempt == 4:
+                        raise
+                    time.sleep(0.05)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def subscribe(self, callback: SettingsCallback, keys: Iterable[str] | None = None) -> Callable[[], None]:
+        """
+        Звать callback(changed, cfg), когда поменялись ключи из keys (None —
+        любые). Возвращает функцию отписки.
+        """
+        entry = (callback, frozenset(keys) if keys is not None else None)
+        with self._lock:
+            self._subscribers.append(entry)
+            if self._cfg is None:
+                # отсюда считаем изменения
+                self.refresh(force=True)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+
+        return unsubscribe
+
+    def _notify(self, changed: Set[str], cfg: Dict[str, Any]) -> None:
+        if not changed:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, keys in subscribers:
+            wanted = changed if keys is None else changed & keys
+            if not wanted:
+                continue
+            try:
+                callback(set(wanted), dict(cfg))
+            except Exception as e:
+                # logger сам зависит от настроек — импортируем по месту
+                from .logger import log
+
+                log(f"SETTINGS: ошибка в подписчике на {', '.join(sorted(wanted))}: {e}")
+
+
+_store: Optional[SettingsStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> SettingsStore:
+    """Общий на процесс SettingsStore для config.json."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SettingsStore()
+    return _store
+
+
+def load_settings() -> Dict[str, Any]:
+    return get_store().get()
+
+
+def get_setting(key: str, default: Any = None) -> Any:
+    return get_store().get_setting(key, default)
 
 
 def save_settings(cfg: Dict[str, Any]) -> None:
-    path = get_config_path()
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(cfg, f, ensure_ascii=False, indent=2)
+    get_store().save(cfg)
+
+
+def subscribe(callback: SettingsCallback, keys: Iterable[str] | None = None) -> Callable[[], None]:
+    return get_store().subscribe(callback, keys)
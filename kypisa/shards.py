@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from typing import Iterable, List, Optional
+
+from .state import STATE_FILE
+from .logger import log
+
+# воркер, не отметившийся дольше этого, считается ушедшим
+DEFAULT_WORKER_TTL = 15.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    host      TEXT NOT NULL,
+    pid       INTEGER NOT NULL,
+    joined    REAL NOT NULL,
+    heartbeat REAL NOT NULL
+);
+"""
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Консистентное хеширование URL категорий по воркерам.
+
+    У каждого воркера vnodes точек на кольце; категория достаётся
+    первому воркеру по часовой стрелке от хеша её URL. Когда воркер
+    приходит или уходит, переезжает только ~1/N категорий, остальные
+    остаются на месте (и не теряют прогретое состояние).
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 160) -> None:
+        self.vnodes = vnodes
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect_right(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class ShardRegistry:
+    """
+    Таблица живых воркеров в общем SQLite-файле (по умолчанию том же, что
+    и у WatchStateStore, — там же атомарная дедупликация уведомлений).
+
+    Каждый воркер раз в несколько секунд обновляет heartbeat; кольцо
+    строится из тех, кто отмечался не дольше ttl назад. Несколько машин
+    могут работать с одним файлом, только если это честная общая ФС с
+    блокировками (не SMB/NFS без lockd).
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        path: str = STATE_FILE,
+        ttl: float = DEFAULT_WORKER_TTL,
+    ) -> None:
+        self.worker_id = worker_id
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def join(self) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO workers (worker_id, host, pid, joined, heartbeat) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(worker_id) DO UPDATE SET host = excluded.host, pid = excluded.pid, "
+                "joined = excluded.joined, heartbeat = excluded.heartbeat",
+                (self.worker_id, socket.gethostname(), os.getpid(), now, now),
+            )
+        log(f"SHARD: воркер {self.worker_id} подключился")
+
+    def heartbeat(self) -> None:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE workers SET heartbeat = ? WHERE worker_id = ?", (time.time(), self.worker_id)
+            )
+        if cur.rowcount == 0:
+            # запись удалили (например, чистка мёртвых) — заходим заново
+            self.join()
+
+    def leave(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        log(f"SHARD: воркер {self.worker_id} отключился")
+
+    def members(self) -> List[str]:
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT worker_id FROM workers WHERE heartbeat >= ? ORDER BY worker_id", (cutoff,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def ring(self) -> HashRing:
+        return HashRing(self.members())
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,236 @@
+"""
+Профиль запуска: сколько времени уходит до первого меню и на что.
+
+    python main.py --startup-profile           # этапы запуска и самые тяжёлые импорты
+    python bot_main.py --startup-profile
+    python plugins/Chat/main.py --startup-profile
+    python -m kypisa.startup --bench [-n 10]   # замер времени до первого меню
+
+С --startup-profile программа доходит до первого меню (или первого
+вопроса), печатает отчёт и выходит. --bench запускает main.py с этим
+флагом несколько раз и дописывает медианы в kypisa_startup_bench.jsonl,
+чтобы видеть, как время запуска меняется от версии к версии.
+
+Модуль лёгкий (только стандартная библиотека): его импортируют первым,
+от этого момента и считается время.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List, Optional, Sequence, Tuple
+
+_started = time.perf_counter()
+
+PROFILE_FLAG = "--startup-profile"
+# в этом режиме отчёт — одна JSON-строка для --bench
+BENCH_ENV = "KYPISA_STARTUP_BENCH"
+BENCH_FILE = "kypisa_startup_bench.jsonl"
+IMPORTS_SHOWN = 15
+
+_enabled = False
+_marks: List[Tuple[str, float]] = []
+
+
+def init(argv: List[str] | None = None) -> bool:
+    """Убрать --startup-profile из argv (по умолчанию sys.argv); True — профилируем."""
+    global _enabled
+    argv = sys.argv if argv is None else argv
+    if PROFILE_FLAG in argv:
+        argv[:] = [arg for arg in argv if arg != PROFILE_FLAG]
+        _enabled = True
+    return _enabled
+
+
+def profiling() -> bool:
+    return _enabled
+
+
+def mark(stage: str) -> None:
+    """Этап закончился: время от предыдущей отметки уходит в отчёт."""
+    if _enabled:
+        _marks.append((stage, time.perf_counter()))
+
+
+def import_times(modules: Sequence[str]) -> List[Tuple[str, int, int]]:
+    """
+    (модуль, собственное время, вместе с вложенными), мкс — по выводу
+    python -X importtime в отдельном процессе, где ничего ещё не загружено.
+    Вложенные импорты, как и в выводе importtime, с отступом.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    code = "; ".join(f"import {name}" for name in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=root,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    rows: List[Tuple[str, int, int]] = []
+    for line in proc.stderr.splitlines():
+        # "import time:       512 |       1024 |   requests"
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        rows.append((parts[2][1:].rstrip(), int(parts[0]), int(parts[1])))
+    return rows
+
+
+def format_report(target: str, modules: Sequence[str]) -> str:
+    lines = [f"=== Профиль запуска: {target} ==="]
+    if _marks:
+        lines.append(f"{'Этап':<34} | {'мс':>8} | {'с начала, мс':>12}")
+        lines.append("-" * 60)
+        prev = _started
+        for stage, at in _marks:
+            lines.append(f"{stage[:34]:<34} | {(at - prev) * 1000.0:8.1f} | {(at - _started) * 1000.0:12.1f}")
+            prev = at
+        total = (_marks[-1][1] - _started) * 1000.0
+        lines.append(f"До первого меню: {total:.0f} мс (без запуска самого интерпретатора)")
+
+    if modules:
+        rows = import_times(modules)
+        if rows:
+            if _marks:
+                lines.append("")
+            lines.append(f"Самые тяжёлые импорты ({', '.join(modules)}), отдельный процесс:")
+            lines.append(f"{'Модуль':<40} | {'своё, мс':>9} | {'всего, мс':>9}")
+            lines.append("-" * 64)
+            for name, own, cumulative in sorted(rows, key=lambda r: -r[1])[:IMPORTS_SHOWN]:
+                lines.append(f"{name.strip()[-40:]:<40} | {own / 1000.0:9.1f} | {cumulative / 1000.0:9.1f}")
+            total_us = sum(cumulative for name, _, cumulative in rows if not name.startswith(" "))
+            lines.append(f"Всего на импорт: {total_us / 1000.0:.0f} мс")
+    return "\n".join(lines)
+
+
+def ready(target: str, modules: Sequence[str] = ()) -> None:
+    """
+    Программа дошла до первого меню. В режиме --startup-profile печатаем
+    отчёт (импорты modules разбираем отдельно) и выходим, иначе ничего.
+    """
+    if not _enabled:
+        return
+    mark("первое меню")
+    if os.environ.get(BENCH_ENV):
+        ms = (_marks[-1][1] - _started) * 1000.0
+        print(json.dumps({"target": target, "ttfm_ms": round(ms, 3)}))
+    else:
+        print()
+        print(format_report(target, modules))
+    sys.stdout.flush()
+    raise SystemExit(0)
+
+
+# ---------- бенчмарк ----------
+
+
+def _bench_once(script: str) -> Tuple[float, Optional[float], str]:
+    """Один запуск: (время процесса целиком, время до меню изнутри или None, вывод)."""
+    env = dict(os.environ, **{BENCH_ENV: "1"})
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, script, PROFILE_FLAG],
+        cwd=os.path.dirname(os.path.abspath(script)),
+        env=env,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        timeout=120,
+    )
+    wall = (time.perf_counter() - started) * 1000.0
+    for line in reversed(proc.stdout.splitlines()):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and "ttfm_ms" in record:
+            return wall, float(record["ttfm_ms"]), proc.stdout
+    return wall, None, proc.stdout + proc.stderr
+
+
+def _previous(path: str, script: str) -> Optional[dict]:
+    last = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("script") == script:
+                    last = record
+    except OSError:
+        return None
+    return last
+
+
+def bench(script: str, runs: int, history: str) -> int:
+    walls: List[float] = []
+    inner: List[float] = []
+    for _ in range(runs):
+        wall, ttfm, output = _bench_once(script)
+        if ttfm is None:
+            print(f"{script} не дошёл до первого меню (нужен настроенный config.json). Вывод:")
+            print(output[-2000:])
+            return 1
+        walls.append(wall)
+        inner.append(ttfm)
+
+    walls.sort()
+    record = {
+        "ts": round(time.time(), 3),
+        "script": os.path.basename(script),
+        "runs": runs,
+        "python": sys.version.split()[0],
+        "ttfm_ms_median": round(statistics.median(inner), 1),
+        "process_ms_median": round(statistics.median(walls), 1),
+        "process_ms_max": round(walls[-1], 1),
+    }
+    prev = _previous(history, record["script"])
+
+    print(f"{record['script']}, запусков: {runs}")
+    print(f"  до первого меню (медиана):         {record['ttfm_ms_median']:.0f} мс")
+    print(f"  процесс целиком (медиана / макс.): {record['process_ms_median']:.0f} / {record['process_ms_max']:.0f} мс")
+    if prev is not None:
+        delta = record["process_ms_median"] - float(prev.get("process_ms_median") or 0.0)
+        print(f"  прошлый замер: {prev.get('process_ms_median')} мс ({delta:+.0f} мс)")
+
+    with open(history, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Время запуска Kypisa до первого меню")
+    parser.add_argument("--bench", action="store_true", help="замерить и дописать результат в историю")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="сколько раз запускать")
+    parser.add_argument("--script", default=os.path.join(root, "main.py"), help="что запускать")
+    parser.add_argument("--history", default=os.path.join(root, BENCH_FILE), help="JSONL с историей замеров")
+    args = parser.parse_args(argv)
+
+    if not args.bench:
+        # без --bench — просто разбор импортов ядра
+        print(format_report("kypisa.cli", ["kypisa.cli"]))
+        return 0
+    return bench(args.script, max(1, args.runs), args.history)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
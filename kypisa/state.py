@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .settings import get_base_dir
+from .logger import log
+
+STATE_FILE = os.path.join(get_base_dir(), "watch_state.db")
+
+# повторное уведомление о том же лоте в пределах окна не шлём
+DEFAULT_DEDUPE_WINDOW = 6 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    watch_key   TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    updated     REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    watch_key   TEXT NOT NULL,
+    rule        TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    fired       REAL NOT NULL,
+    PRIMARY KEY (watch_key, rule, fingerprint)
+);
+"""
+
+
+class WatchStateStore:
+    """
+    Состояние нотификатора, которое переживает перезапуск.
+
+    - snapshots: отпечаток последнего снимка каждой подписки (например,
+      ключ самого дешёвого лота), чтобы после старта не считать его новым;
+    - alerts: какие уведомления по какому правилу уже отправлены и когда —
+      окно дедупликации.
+
+    SQLite в режиме WAL: каждая запись — одна маленькая транзакция,
+    чтение при старте — пара SELECT'ов по первичному ключу.
+    """
+
+    def __init__(self, path: str = STATE_FILE, dedupe_window: float = DEFAULT_DEDUPE_WINDOW) -> None:
+        self.path = path
+        self.dedupe_window = dedupe_window
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- снимки ----------
+
+    def get_fingerprint(self, watch_key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint FROM snapshots WHERE watch_key = ?", (watch_key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_fingerprint(self, watch_key: str, fingerprint: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO snapshots (watch_key, fingerprint, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(watch_key) DO UPDATE SET fingerprint = excluded.fingerprint, "
+                "updated = excluded.updated",
+                (watch_key, fingerprint, time.time()),
+            )
+
+    # ---------- уведомления ----------
+
+    def claim_alert(self, watch_key: str, rule: str, fingerprint: str) -> bool:
+        """
+        Атомарно "забираем" право отправить уведомление.
+
+        True — такого уведомления в окне дедупликации ещё не было, оно
+        записано как отправленное; False — его уже отправили (в том числе
+        другой процесс, работающий с тем же файлом).
+        """
+        now = time.time()
+        cutoff = now - self.dedupe_window
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                row = self._conn.execute(
+                    "SELECT fired FROM alerts WHERE watch_key = ? AND rule = ? AND fingerprint = ?",
+                    (watch_key, rule, fingerprint),
+                ).fetchone()
+                if row is not None and row[0] >= cutoff:
+                    self._conn.execute("COMMIT")
+                    return False
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO alerts (watch_key, rule, fingerprint, fired) "
+                    "VALUES (?, ?, ?, ?)",
+                    (watch_key, rule, fingerprint, now),
+                )
+                # заодно чистим то, что вышло из окна
+                self._conn.execute(
+                    "DELETE FROM alerts WHERE watch_key = ? AND fired < ?", (watch_key, cutoff)
+                )
+                self._conn.execute("COMMIT")
+                return True
+            except sqlite3.Error as e:
+                try:
+                    self._conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                # лучше лишнее уведомление, чем потерянное
+                log(f"STATE: ошибка записи уведомления ({watch_key}): {e}")
+                return True
+
+    def last_alert(self, watch_key: str, rule: str) -> Optional[tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, fired FROM alerts WHERE watch_key = ? AND rule = ? "
+                "ORDER BY fired DESC LIMIT 1",
+                (watch_key, rule),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
@@ -0,0 +1,396 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .alerts import PriceAlert
+from .logger import log
+from .ratelimit import RateLimiter
+
+API_URL = "https://api.telegram.org"
+
+# лимиты Telegram Bot API: ~30 сообщений в секунду на бота,
+# ~1 в секунду в личный чат и ~20 в минуту в группу
+GLOBAL_PER_SECOND = 25
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+
+
+class TelegramSender:
+    """
+    Отправка сообщений ботом: одна сессия с пулом соединений, рассылка
+    по многим чатам параллельно, но в рамках лимитов Telegram.
+
+    На 429 Telegram присылает parameters.retry_after — ждём ровно столько
+    и пробуем ещё раз. Ошибки 400/403 (чат удалён, бот заблокирован)
+    повторять бессмысленно, такие чаты просто пропускаем.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        max_workers: int = 16,
+        global_per_second: int = GLOBAL_PER_SECOND,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+    ) -> None:
+        self.token = token
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+
+        self._global = RateLimiter(global_per_second * 60, burst=global_per_second)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kypisa-tg")
+        self._chat_lock = threading.Lock()
+        self._chat_next: Dict[str, float] = {}
+
+    def _url(self, method: str) -> str:
+        return f"{API_URL}/bot{self.token}/{method}"
+
+    def _wait_chat_slot(self, chat_id: str) -> None:
+        """Не чаще одного сообщения в секунду в личку и раз в 3 с в группу."""
+        interval = GROUP_CHAT_INTERVAL if chat_id.startswith("-") else PRIVATE_CHAT_INTERVAL
+        with self._chat_lock:
+            now = time.monotonic()
+            slot = max(now, self._chat_next.get(chat_id, 0.0))
+            self._chat_next[chat_id] = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _delay_chat(self, chat_id: str, seconds: float) -> None:
+        with self._chat_lock:
+            self._chat_next[chat_id] = max(
+                self._chat_next.get(chat_id, 0.0), time.monotonic() + seconds
+            )
+
+    def send_message(self, chat_id: str, text: str, parse_mode: str | None = "Markdown") -> bool:
+        """
+        Отправить одно сообщение. True — доставлено или повторять нет смысла
+        (чат недоступен), False — временная ошибка, стоит повторить позже.
+        """
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+
+        for _ in range(self.max_retries + 1):
+            self._wait_chat_slot(chat_id)
+            self._global.acquire()
+            try:
+                r = self.session.post(self._url("sendMessage"), json=payload, timeout=self.timeout)
+            except Exception as e:
+                log(f"TG: исключение при отправке в chat_id={chat_id}: {e}")
+                return False
+
+            if r.status_code == 200:
+                return True
+
+            if r.status_code == 429:
+                try:
+                    retry_after = float(r.json().get("parameters", {}).get("retry_after", 1))
+                except Exception:
+                    retry_after = 1.0
+                log(f"TG: 429 для chat_id={chat_id}, жду {retry_after:.0f} с")
+                self._delay_chat(chat_id, retry_after)
+                continue
+
+            if r.status_code in (400, 403):
+                log(f"TG: chat_id={chat_id} недоступен ({r.status_code}): {r.text}")
+                return True
+
+            log(f"TG: ошибка отправки ({r.status_code}) для chat_id={chat_id}: {r.text}")
+            return False
+        return False
+
+    def broadcast(self, chat_ids: Iterable[str], text: str, parse_mode: str | None = "Markdown") -> List[str]:
+        """Параллельная рассылка. Возвращает chat_id, куда не удалось доставить."""
+        ids = list(chat_ids)
+        results = self._pool.map(lambda cid: self.send_message(cid, text, parse_mode), ids)
+        return [cid for cid, ok in zip(ids, results) if not ok]
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+
+HELP_TEXT = (
+    "Команды:\n"
+    "/alert <ссылка на раздел> <макс. цена> [мин. рейтинг] — сообщить, когда цена опустится до порога\n"
+    "/alerts — мои правила\n"
+    "/unalert <номер> — удалить правило (/unalert all — все)"
+)
+
+
+class SubscriberService:
+    """
+    Подписчики бота: все, кто написал боту (/start и т.п.), и их ценовые
+    правила (/alert ...).
+
+    Фоновый поток держит long-poll getUpdates с сохранённым offset, так что
+    каждое обновление приходит ровно один раз. Список подписчиков живёт в
+    памяти, а в файл пишется только когда он (или offset) изменился, —
+    отправка уведомления больше не ходит в Telegram за списком.
+    on_rules_changed(chat_id, alerts) вызывается, когда подписчик поменял
+    свои правила.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        path: str,
+        poll_timeout: int = 25,
+        on_rules_changed: Callable[[str, List[PriceAlert]], None] | None = None,
+    ) -> None:
+        self.token = token
+        self.path = path
+        self.poll_timeout = poll_timeout
+        self.on_rules_changed = on_rules_changed
+        self.session = requests.Session()
+
+        self._lock = threading.Lock()
+        self._subscribers: set[str] = set()
+        # chat_id -> список правил {"url", "max_price", "min_rating"}
+        self._rules: Dict[str, List[dict]] = {}
+        self._offset = 0
+        self._mtime: float | None = None
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self._load()
+
+    # ---------- файл ----------
+
+    def _load(self) -> None:
+        """Старый формат — просто список chat_id, новый — {"offset", "subscribers", "rules"}."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            self._mtime = os.stat(self.path).st_mtime
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            log(f"TG_SUB: ошибка чтения {self.path}: {e}")
+            return
+        if isinstance(data, list):
+            subs = data
+        elif isinstance(data, dict):
+            subs = data.get("subscribers") or []
+            try:
+                self._offset = int(data.get("offset") or 0)
+            except (TypeError, ValueError):
+                self._offset = 0
+            rules = data.get("rules") or {}
+            if isinstance(rules, dict):
+                self._rules = {str(cid): list(items) for cid, items in rules.items() if isinstance(items, list)}
+        else:
+            subs = []
+        self._subscribers = {str(x) for x in subs}
+
+    def _save(self) -> None:
+        with self._lock:
+            data = {
+                "offset": self._offset,
+                "subscribers": sorted(self._subscribers),
+                "rules": self._rules,
+            }
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log(f"TG_SUB: ошибка записи {self.path}: {e}")
+
+    def refresh(self) -> bool:
+        """
+        Перечитать файл, если его поменял другой процесс (воркеры шардов
+        сами getUpdates не делают — подписчиков и правила ведёт один
+        процесс). True — что-то поменялось.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            old_rules = {cid: list(items) for cid, items in self._rules.items()}
+            old_subs = set(self._subscribers)
+            self._load()
+            new_rules = self._rules
+            changed_owners = [
+                cid for cid in set(old_rules) | set(new_rules)
+                if old_rules.get(cid) != new_rules.get(cid)
+            ]
+            changed = bool(changed_owners) or old_subs != self._subscribers
+        if self.on_rules_changed is not None:
+            for cid in changed_owners:
+                self.on_rules_changed(cid, self.alerts(cid))
+        return changed
+
+    # ---------- API ----------
+
+    def snapshot(self) -> List[str]:
+        with self._lock:
+            return sorted(self._subscribers)
+
+    def alerts(self, chat_id: str | None = None) -> List[PriceAlert]:
+        """Все правила (или правила одного подписчика) в виде PriceAlert."""
+        with self._lock:
+            owners = [chat_id] if chat_id is not None else list(self._rules)
+            return [
+                PriceAlert(
+                    owner=cid,
+                    category_url=r["url"],
+                    max_price=float(r["max_price"]),
+                    min_rating=int(r.get("min_rating") or 0),
+                )
+                for cid in owners
+                for r in self._rules.get(cid, [])
+                # правила, сохранённые до проверки цены в /alert
+                if math.isfinite(float(r["max_price"])) and float(r["max_price"]) > 0
+            ]
+
+    def start(self) -> None:
+        if self._thread is not None or not self.token:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._loop, name="kypisa-tg-updates", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # long-poll сам вернётся по таймауту; поток демонический, долго не ждём
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    # ---------- long-poll ----------
+
+    def poll_once(self) -> bool:
+        """Один запрос getUpdates. True — что-то поменялось и сохранено."""
+        params = {
+            "offset": self._offset,
+            "timeout": self.poll_timeout,
+            "allowed_updates": json.dumps(["message", "channel_post"]),
+        }
+        resp = self.session.get(
+            f"{API_URL}/bot{self.token}/getUpdates",
+            params=params,
+            timeout=self.poll_timeout + 10,
+        )
+        data = resp.json()
+        if not data.get("ok") or not isinstance(data.get("result"), list):
+            raise RuntimeError(f"getUpdates: {data.get('description') or resp.status_code}")
+
+        changed = False
+        commands: List[tuple[str, str]] = []
+        with self._lock:
+            for upd in data["result"]:
+                upd_id = upd.get("update_id")
+                if isinstance(upd_id, int) and upd_id >= self._offset:
+                    self._offset = upd_id + 1
+                    changed = True
+                msg = upd.get("message") or upd.get("channel_post") or {}
+                chat = msg.get("chat") or {}
+                cid = chat.get("id")
+                if cid is None:
+                    continue
+                if str(cid) not in self._subscribers:
+                    self._subscribers.add(str(cid))
+                    log(f"TG_SUB: новый подписчик chat_id={cid}")
+                text = (msg.get("text") or "").strip()
+                if text.startswith("/"):
+                    commands.append((str(cid), text))
+        if changed:
+            for cid, text in commands:
+                self._handle_command(cid, text)
+            self._save()
+        return changed
+
+    # ---------- правила подписчиков ----------
+
+    def _reply(self, chat_id: str, text: str) -> None:
+        try:
+            self.session.post(
+                f"{API_URL}/bot{self.token}/sendMessage",
+                json={"chat_id": chat_id, "text": text, "disable_web_page_preview": True},
+                timeout=10,
+            )
+        except Exception as e:
+            log(f"TG_SUB: не удалось ответить chat_id={chat_id}: {e}")
+
+    def _handle_command(self, chat_id: str, text: str) -> None:
+        parts = text.split()
+        cmd = parts[0].split("@")[0].lower()
+        args = parts[1:]
+
+        if cmd == "/alert":
+            if len(args) < 2 or not args[0].startswith("http"):
+                self._reply(chat_id, "Формат: /alert <ссылка на раздел> <макс. цена> [мин. рейтинг]")
+                return
+            try:
+                max_price = float(args[1].replace(",", "."))
+                min_rating = int(args[2]) if len(args) > 2 else 0
+            except ValueError:
+                max_price = math.nan
+            # nan в отсортированных порогах AlertIndex ломает bisect для всей категории
+            if not (math.isfinite(max_price) and max_price > 0):
+                self._reply(chat_id, "Цена — положительное число, рейтинг — целое от 0 до 5.")
+                return
+            rule = {"url": args[0], "max_price": max_price, "min_rating": max(0, min(5, min_rating))}
+            with self._lock:
+                self._rules.setdefault(chat_id, []).append(rule)
+            self._reply(chat_id, f"Ок, сообщу, когда цена будет ≤ {max_price:g} ₽ (рейтинг ≥ {rule['min_rating']}).")
+        elif cmd == "/alerts":
+            rules = self.alerts(chat_id)
+            if not rules:
+                self._reply(chat_id, "Правил нет.\n\n" + HELP_TEXT)
+                return
+            lines = [
+                f"{i}. {a.category_url} — ≤ {a.max_price:g} ₽, рейтинг ≥ {a.min_rating}"
+                for i, a in enumerate(rules, start=1)
+            ]
+            self._reply(chat_id, "\n".join(lines))
+            return
+        elif cmd == "/unalert":
+            with self._lock:
+                rules = self._rules.get(chat_id, [])
+                if args and args[0].lower() == "all":
+                    self._rules.pop(chat_id, None)
+                elif args and args[0].isdigit() and 1 <= int(args[0]) <= len(rules):
+                    del rules[int(args[0]) - 1]
+                else:
+                    rules = None
+            if rules is None:
+                self._reply(chat_id, "Формат: /unalert <номер из /alerts> или /unalert all")
+                return
+            self._reply(chat_id, "Удалено.")
+        else:
+            if cmd in ("/start", "/help"):
+                self._reply(chat_id, "Вы подписаны на уведомления.\n\n" + HELP_TEXT)
+            return
+
+        if self.on_rules_changed is not None:
+            self.on_rules_changed(chat_id, self.alerts(chat_id))
+
+    def _loop(self) -> None:
+        backoff = 1.0
+        while not self._stopped.is_set():
+            try:
+                self.poll_once()
+                backoff = 1.0
+            except Exception as e:
+                log(f"TG_SUB: ошибка getUpdates: {e}")
+                self._stopped.wait(backoff)
+                backoff = min(60.0, backoff * 2)
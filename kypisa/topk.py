@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .models import Lot
+
+
+def lot_identity(lot: Lot) -> str:
+    """Стабильный ключ лота между снимками (id в Lot — просто позиция на странице)."""
+    return lot.url or f"{lot.seller.name}|{lot.description}"
+
+
+@dataclass
+class TopKChange:
+    """Что поменялось в топ-K категории между двумя снимками."""
+
+    entered: List[Lot] = field(default_factory=list)
+    left: List[Lot] = field(default_factory=list)
+    # лот остался в топе, но цена изменилась: (лот, старая цена)
+    repriced: List[Tuple[Lot, float]] = field(default_factory=list)
+    top: List[Lot] = field(default_factory=list)
+
+    def rank(self, lot: Lot) -> int:
+        """Место лота в текущем топе (с 1), 0 — если его там нет."""
+        key = lot_identity(lot)
+        for i, item in enumerate(self.top, 1):
+            if lot_identity(item) == key:
+                return i
+        return 0
+
+
+class TopKTracker:
+    """
+    K самых дешёвых лотов категории, обновляемые по разнице снимков.
+
+    Снимок сравнивается с предыдущим по ключам лотов (словарь, без
+    сортировки страницы), дальше в кучи попадают только появившиеся,
+    пропавшие и подешевевшие/подорожавшие лоты. Топ — max-куча из K
+    элементов, остальные — min-куча "запаса", из которой топ
+    добирается, когда лот из него уходит. Устаревшие записи в кучах
+    удаляются лениво. Работа с кучами — O(изменений * log n), а не
+    O(размер страницы * log n) на каждый опрос.
+    """
+
+    def __init__(self, k: int, known: Iterable[str] = ()) -> None:
+        if k < 1:
+            raise ValueError("k должно быть >= 1")
+        self.k = k
+        self._lots: Dict[str, Lot] = {}
+        self._prices: Dict[str, float] = {}
+        self._top: Set[str] = set()
+        self._top_heap: List[Tuple[float, str]] = []  # (-цена, ключ)
+        self._rest: List[Tuple[float, str]] = []  # (цена, ключ)
+        # топ с прошлого запуска (из WatchStateStore): эти лоты не новые
+        self._known: Optional[Set[str]] = set(known) or None
+
+    def __len__(self) -> int:
+        return len(self._prices)
+
+    @property
+    def fingerprint(self) -> str:
+        return "\n".join(sorted(self._top))
+
+    def top(self) -> List[Lot]:
+        return sorted((self._lots[k] for k in self._top), key=lambda l: (l.price, lot_identity(l)))
+
+    # ---------- кучи ----------
+
+    def _worst_top(self) -> Optional[Tuple[float, str]]:
+        heap = self._top_heap
+        while heap:
+            neg, key = heap[0]
+            if key in self._top and self._prices.get(key) == -neg:
+                return -neg, key
+            heapq.heappop(heap)
+        return None
+
+    def _pop_rest(self) -> Optional[str]:
+        heap = self._rest
+        while heap:
+            price, key = heapq.heappop(heap)
+            if key not in self._top and self._prices.get(key) == price:
+                return key
+        return None
+
+    def _promote(self, key: str) -> None:
+        self._top.add(key)
+        heapq.heappush(self._top_heap, (-self._prices[key], key))
+
+    def _insert(self, key: str, price: float) -> None:
+        self._prices[key] = price
+        if len(self._top) < self.k:
+            self._promote(key)
+            return
+        worst = self._worst_top()
+        # при равной цене место в топе остаётся за тем, кто уже там
+        if worst is not None and price < worst[0]:
+            self._top.discard(worst[1])
+            heapq.heappush(self._rest, worst)
+            self._promote(key)
+        else:
+            heapq.heappush(self._rest, (price, key))
+
+    def _discard(self, key: str) -> None:
+        self._prices.pop(key, None)
+        if key in self._top:
+            self._top.discard(key)
+            nxt = self._pop_rest()
+            if nxt is not None:
+                self._promote(nxt)
+
+    def _compact(self) -> None:
+        """Выкинуть устаревшие записи, когда их стало больше живых."""
+        if len(self._rest) > 2 * len(self._prices) + 64:
+            self._rest = [(p, k) for k, p in self._prices.items() if k not in self._top]
+            heapq.heapify(self._rest)
+        if len(self._top_heap) > 2 * self.k + 64:
+            self._top_heap = [(-self._prices[k], k) for k in self._top]
+            heapq.heapify(self._top_heap)
+
+    # ---------- снимки ----------
+
+    def update(self, lots: Iterable[Lot]) -> Optional[TopKChange]:
+        """
+        Применить новый снимок (уже отфильтрованный). Возвращает изменения
+        топ-K или None, если набор и цены топа остались прежними.
+        """
+        current: Dict[str, Lot] = {}
+        for lot in lots:
+            if not lot.price or lot.price <= 0:
+                continue
+            key = lot_identity(lot)
+            # одинаковый ключ на странице — берём более дешёвый
+            if key not in current or lot.price < current[key].price:
+                current[key] = lot
+
+        before = dict.fromkeys(self._top)
+        before_prices = {key: self._prices[key] for key in before}
+        if self._known is not None:
+            before = dict.fromkeys(self._known)
+            self._known = None
+
+        for key in [k for k in self._prices if k not in current]:
+            self._discard(key)
+        for key, lot in current.items():
+            old = self._prices.get(key)
+            if old is None:
+                self._insert(key, lot.price)
+            elif old != lot.price:
+                self._discard(key)
+                self._insert(key, lot.price)
+        old_lots = self._lots
+        self._lots = current
+        self._compact()
+
+        change = TopKChange()
+        for key in self._top:
+            if key not in before:
+                change.entered.append(current[key])
+            elif key in before_prices and before_prices[key] != current[key].price:
+                change.repriced.append((current[key], before_prices[key]))
+        for key in before:
+            if key not in self._top and key in old_lots:
+                change.left.append(old_lots[key])
+        if not (change.entered or change.left or change.repriced):
+            return None
+        change.entered.sort(key=lambda l: l.price)
+        change.top = self.top()
+        return change
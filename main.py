@@ -1,4 +1,11 @@
-from kypisa.cli import main
+from kypisa import startup
+
+# --startup-profile: дойти до первого меню, напечатать профиль запуска и выйти
+startup.init()
+
+from kypisa.cli import main  # noqa: E402
+
+startup.mark("импорт kypisa.cli")
 
 if __name__ == "__main__":
     main()
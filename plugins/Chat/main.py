@@ -9,11 +9,14 @@
 
 import os
 import time
-import json
-import requests
-from typing import List, Dict, Optional
-
-from bs4 import BeautifulSoup
+import queue
+import selectors
+import sys
+import textwrap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
 
 try:
     import winsound
@@ -25,22 +28,46 @@ try:
 except ImportError:
     msvcrt = None
 
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+    tty = None
+
 try:
     from winotify import Notification, audio
-    print("[Chat] winotify: OK (будут Windows-уведомления)")
 except ImportError:
     Notification = None
     audio = None
-    print("[Chat] winotify: НЕ УСТАНОВЛЕН, уведомлений не будет")
 
 
-from typing import List, Dict, Optional
+# корень проекта — сами чаты живут в пакете kypisa (kypisa.chat),
+# здесь только консольный интерфейс
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from kypisa import startup  # noqa: E402
+
+startup.init()
+from kypisa.api import FunPayClient  # noqa: E402
+from kypisa.chat import (  # noqa: E402
+    CHAT_REQUESTS_PER_MINUTE,
+    ChatArchive,
+    ChatListWatcher,
+    ChatSession,
+    MessageCache,
+    UnreadPrefetcher,
+    fetch_chat_list,
+    fetch_chat_messages,
+    send_chat_message,
+)
+from kypisa.logger import log  # noqa: E402
+from kypisa.render import Screen  # noqa: E402
+from kypisa.settings import load_settings  # noqa: E402
 
-import requests
-from bs4 import BeautifulSoup
-from html import unescape
+startup.mark("импорт kypisa.chat")
 
-BASE_URL = "https://funpay.com"
+if Notification is None and os.name == "nt":
+    log("CHAT: winotify не установлен, Windows-уведомлений не будет")
 
 
 # ---------- цвета ANSI ----------
@@ -69,17 +96,6 @@ BG_GREEN   = "\033[42m"
 
 #--------бебебеб-----
 
-def _clear_screen() -> None:
-    """
-    Очистить консоль (Windows / Linux).
-    """
-    try:
-        os.system("cls" if os.name == "nt" else "clear")
-    except Exception:
-        # если по какой-то причине не сработало – просто напечатаем много переводов строк
-        print("\n" * 100)
-
-
 #------------- Звуууууууууууууууууууууууууууууууууууууууууууууууууук------------
 
 def _play_notify() -> None:
@@ -101,11 +117,10 @@ def _play_notify() -> None:
 
 def _notify_windows_chat(chat_name: str, last_message: str, chat_url: str) -> None:
     """
-    Windows-уведомление о новом сообщении в чате.
+    Windows-уведомление о новом сообщении в чате. Зовётся из монитора,
+    поэтому ничего не печатает (сбило бы кадр Screen) — ошибки идут в лог.
     """
-    print(f"[Chat] DEBUG: вызываю _notify_windows_chat для {chat_name}: {last_message}")
     if Notification is None:
-        print("[Chat] DEBUG: Notification is None, winotify не доступен")
         return  # winotify не установлен или не импортировался
 
     title = "FunPay CLI: новое сообщение"
@@ -121,15 +136,14 @@ def _notify_windows_chat(chat_name: str, last_message: str, chat_url: str) -> No
         try:
             toast.set_audio(audio.Default, loop=False)
         except Exception as e:
-            print(f"[Chat] DEBUG: ошибка установки звука уведомления: {e}")
+            log(f"CHAT: ошибка установки звука уведомления: {e}")
 
         if chat_url:
             toast.add_actions(label="Открыть чат", launch=chat_url)
 
         toast.show()
-        print("[Chat] DEBUG: toast.show() вызван")
     except Exception as e:
-        print(f"[Chat] DEBUG: ошибка при показе уведомления: {e}")
+        log(f"CHAT: ошибка при показе уведомления: {e}")
 
 
 
@@ -146,6 +160,14 @@ def _short(text: str, width: int = 60) -> str:
         return text[: width - 1] + "…"
 
 
+def _print_send_failed(chat_url: str, content: str, error: str) -> None:
+    """ChatSession.on_failed: отложенное сообщение так и не ушло."""
+    print(
+        f"\n{RED}[Chat]{RESET} Отложенное сообщение НЕ отправлено ({error}).\n"
+        f"  Диалог: {chat_url}\n  Текст: {_short(content)}"
+    )
+
+
 def _input(prompt: str) -> str:
     try:
         return input(prompt)
@@ -153,389 +175,30 @@ def _input(prompt: str) -> str:
         return ""
 
 
-# ---------- работа с config.json ----------
-
-def _load_config() -> dict:
-    """
-    Ищем config.json в корне проекта FunPay CLI и читаем golden_key / user_agent.
-    """
-    print("[Chat] Ищу config.json...")
-    here = os.path.abspath(__file__)
-    chat_dir = os.path.dirname(here)
-    plugins_dir = os.path.dirname(chat_dir)
-    project_root = os.path.dirname(plugins_dir)
-
-    cfg_path = os.path.join(project_root, "config.json")
-    print(f"[Chat] Путь до config.json: {cfg_path}")
-
-    if not os.path.exists(cfg_path):
-        print("[Chat] Не найден config.json в корне проекта.")
-        print("Сначала запусти основной FunPay CLI и настрой golden_key / user_agent.")
-        return {}
-
-    try:
-        with open(cfg_path, "r", encoding="utf-8") as f:
-            cfg = json.load(f)
-    except Exception as e:
-        print(f"[Chat] Ошибка чтения config.json: {e}")
-        return {}
-
-    return cfg
-
-
-def _make_session(cfg: dict) -> Optional[requests.Session]:
-    gk = cfg.get("golden_key") or ""
-    ua = cfg.get("user_agent") or "Mozilla/5.0 (FunPay CLI)"
-
-    if not gk:
-        print("[Chat] В config.json нет golden_key. Настрой FunPay CLI.")
-        return None
-
-    # Чиним user-agent, если там нелатинские символы.
-    try:
-        ua.encode("latin-1")
-    except UnicodeEncodeError:
-        try:
-            ua = ua.encode("latin-1", "ignore").decode("latin-1")
-        except Exception:
-            ua = "Mozilla/5.0 (FunPay CLI)"
-        if not ua.strip():
-            ua = "Mozilla/5.0 (FunPay CLI)"
-
-    print("[Chat] Создаю сессию FunPay...")
-    s = requests.Session()
-
-    # Только user-agent в заголовки:
-    s.headers.update(
-        {
-            "user-agent": ua,
-        }
-    )
-
-    # golden_key кладём как нормальную куку,
-    s.cookies.set("golden_key", gk, domain="funpay.com")
-
-    return s
-
-
-
-# ---------- список диалогов ----------
-
-def fetch_chat_list(session: requests.Session) -> List[Dict]:
-    """
-    Забирает список диалогов с https://funpay.com/chat/
-
-    Возвращает список словарей:
-        {
-            "name": str,
-            "last_message": str,
-            "time": str,
-            "url": str,
-            "unread": bool
-        }
-    """
-    url = f"{BASE_URL}/chat/"
-    print(f"[Chat] Загружаю список диалогов: {url}")
-    resp = session.get(url)
-    print(f"[Chat] Ответ /chat/: {resp.status_code}")
-    resp.raise_for_status()
-
-    html = resp.text
-    soup = BeautifulSoup(html, "html.parser")
-
-    items: List[Dict] = []
-
-    # пробуем сразу два варианта селектора
-    for a in soup.select(".contact-list .contact-item, .contact-item"):
-        classes = a.get("class", [])
-        unread = "unread" in classes
-
-        name_el = a.select_one(".media-user-name")
-        msg_el = a.select_one(".contact-item-message")
-        time_el = a.select_one(".contact-item-time")
-
-        name = name_el.get_text(strip=True) if name_el else "???"
-        last_message = msg_el.get_text(" ", strip=True) if msg_el else ""
-        time_str = time_el.get_text(strip=True) if time_el else ""
-
-        href = a.get("href") or ""
-        if href.startswith("http"):
-            chat_url = href
-        else:
-            chat_url = BASE_URL + href
-
-        items.append(
-            {
-                "name": name,
-                "last_message": last_message,
-                "time": time_str,
-                "url": chat_url,
-                "unread": unread,
-            }
-        )
-
-    if not items:
-        # Если вообще ничего не нашли – сохраним HTML, чтобы можно было посмотреть.
-        debug_path = os.path.join(os.path.dirname(__file__), "chat_debug.html")
-        try:
-            with open(debug_path, "w", encoding="utf-8") as f:
-                f.write(html)
-            print(f"[Chat] В списке чатов 0 диалогов. HTML сохранён в {debug_path}")
-        except Exception as e:
-            print(f"[Chat] Не удалось сохранить chat_debug.html: {e}")
-
-    print(f"[Chat] Найдено диалогов: {len(items)}")
-    return items
-
-
-
-
-# ---------- сообщения одного чата ----------
-
-def _extract_app_data(soup: BeautifulSoup) -> dict:
-    """
-    В <body data-app-data="..."> лежит JSON с csrf-token и userId.
-    """
-    body = soup.select_one("body")
-    if not body:
-        return {}
-
-    raw = body.get("data-app-data") or ""
-    if not raw:
-        return {}
-
-    try:
-        decoded = unescape(raw)
-        return json.loads(decoded)
-    except Exception:
-        return {}
-
-
-def fetch_chat_messages(
-    session: requests.Session,
+def show_chat(
+    client: FunPayClient,
     chat_url: str,
-    limit: int = 50,
-) -> (List[Dict], Dict):
-    """
-    Забирает сообщения из конкретного диалога (/chat/?node=...).
-
-    Возвращает (messages, meta).
-
-    messages: список словарей:
-        {
-            "author": str,
-            "time": str,
-            "day": str | None,
-            "text": str,
-        }
-
-    meta:
-        {
-            "node_id": int,
-            "node_name": str,
-            "user_id": int,
-            "other_id": int | None,
-            "csrf_token": str | None,
-            "last_message_id": int | None,
-            "chat_url": str,
-        }
-    """
-    print(f"[Chat] Загружаю чат: {chat_url}")
-    resp = session.get(chat_url)
-    resp.raise_for_status()
-
-    soup = BeautifulSoup(resp.text, "html.parser")
-
-    # данные из div.chat.chat-float
-    chat_div = soup.select_one(".chat.chat-float")
-    node_id = None
-    node_name = None
-    other_id = None
-
-    if chat_div:
-        try:
-            node_id = int(chat_div.get("data-id") or 0)
-        except (TypeError, ValueError):
-            node_id = None
-
-        node_name = chat_div.get("data-name")  # типа "users-10380273-17799650"
-        if node_name and "-" in node_name:
-            try:
-                other_id = int(node_name.split("-")[-1])
-            except ValueError:
-                other_id = None
-
-    # csrf-token и userId из data-app-data
-    app_data = _extract_app_data(soup)
-    csrf_token = app_data.get("csrf-token")
-    user_id = app_data.get("userId")
-
-    messages: List[Dict] = []
-    last_message_id: Optional[int] = None
-
-    # Каждый .chat-msg-item — одно сообщение
-    for item in soup.select(".chat-message-list .chat-msg-item"):
-        # id="message-4031282597"
-        msg_id_str = item.get("id") or ""
-        if msg_id_str.startswith("message-"):
-            try:
-                mid = int(msg_id_str.replace("message-", ""))
-                last_message_id = max(last_message_id or 0, mid)
-            except ValueError:
-                pass
-
-        # день (типа "30 ноября")
-        day_el = item.select_one(".chat-message-list-date .inside")
-        day_label = day_el.get_text(strip=True) if day_el else None
-
-        msg_block = item.select_one(".chat-message")
-        if not msg_block:
-            continue
-
-        author_el = msg_block.select_one(".media-user-name a.chat-msg-author-link")
-        time_el = msg_block.select_one(".chat-msg-date")
-        text_el = msg_block.select_one(".chat-msg-text")
-
-        if text_el is None:
-            continue
-
-        author = author_el.get_text(strip=True) if author_el else "?"
-        time_str = time_el.get_text(strip=True) if time_el else ""
-        text = text_el.get_text("\n", strip=True)
-
-        messages.append(
-            {
-                "author": author,
-                "time": time_str,
-                "day": day_label,
-                "text": text,
-            }
-        )
-
-    if limit and len(messages) > limit:
-        messages = messages[-limit:]
-
-    print(f"[Chat] Сообщений в чате: {len(messages)}")
-
-    meta = {
-        "node_id": node_id,
-        "node_name": node_name,
-        "user_id": user_id,
-        "other_id": other_id,
-        "csrf_token": csrf_token,
-        "last_message_id": last_message_id,
-        "chat_url": chat_url,
-    }
-
-    return messages, meta
-
-
-# ---------- отправка сообщения ----------
-
-def send_chat_message(
-    session: requests.Session,
-    meta: Dict,
-    content: str,
-) -> bool:
-    """
-    Отправка сообщения через /runner/ так же, как это делает браузер.
-
-    В HAR видно, что:
-    - параметр request = JSON: {"action":"chat_message","data":{...}}
-    - параметр objects = JSON-массив с orders_counters, chat_node, chat_bookmarks, c-p-u
-    """
-
-    csrf_token = meta.get("csrf_token")
-    user_id = meta.get("user_id")
-    node_name = meta.get("node_name")
-    node_id = meta.get("node_id")
-    last_message_id = meta.get("last_message_id")
-    other_id = meta.get("other_id")
-    chat_url = meta.get("chat_url") or f"{BASE_URL}/chat/"
-
-    if not csrf_token or not user_id or not node_name or not node_id:
-        print("[Chat] Нет csrf_token / user_id / node_name / node_id — не могу отправить сообщение.")
-        return False
-
-    if last_message_id is None:
-        last_message_id = 0
-
-    # То, что браузер кладёт в параметр request
-    request_obj = {
-        "action": "chat_message",
-        "data": {
-            "node": node_name,
-            "last_message": last_message_id,
-            "content": content,
-        },
-    }
-
-    # Минимальный набор объектов, как в HAR:
-    objects = [
-        {
-            "type": "orders_counters",
-            "id": str(user_id),
-            "tag": "cli-oc",
-            "data": False,
-        },
-        {
-            "type": "chat_node",
-            "id": node_name,
-            "tag": "cli-chat",
-            "data": {
-                "node": node_name,
-                "last_message": last_message_id,
-                "content": content,
-            },
-        },
-        {
-            "type": "chat_bookmarks",
-            "id": str(user_id),
-            "tag": "cli-bm",
-            "data": [
-                [int(node_id), int(last_message_id)],
-            ],
-        },
-        {
-            "type": "c-p-u",
-            "id": str(other_id) if other_id is not None else "",
-            "tag": "cli-cpu",
-            "data": False,
-        },
-    ]
-
-    payload = {
-        "objects": json.dumps(objects, separators=(",", ":")),
-        "request": json.dumps(request_obj, separators=(",", ":")),
-        "csrf_token": csrf_token,
-    }
-
-    url = f"{BASE_URL}/runner/"
-    headers = {
-        "Origin": BASE_URL,
-        "Referer": chat_url,
-        "Accept": "application/json, text/javascript, */*; q=0.01",
-        "X-Requested-With": "XMLHttpRequest",
-        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-    }
-
-    print("[Chat] Отправляю сообщение через /runner/...")
-    resp = session.post(url, data=payload, headers=headers)
-    print(f"[Chat] Ответ сервера: {resp.status_code}")
-    print("[Chat] Кусок ответа:", (resp.text or "")[:300].replace("\n", " "))
-
-    return resp.status_code == 200
-
-
-
-def show_chat(session: requests.Session, chat_url: str) -> None:
+    cache: Optional[MessageCache] = None,
+    last_message_id: Optional[int] = None,
+    sender: Optional[ChatSession] = None,
+) -> None:
     """
     Показать один диалог и дать возможность писать сообщения.
+    С cache повторные загрузки диалога — только новые сообщения, а если
+    в кэше уже есть last_message_id (его подгрузили заранее) — без сети.
+    С sender отправка — одна POST (см. ChatSession).
     """
     while True:
         print(f"\n{YELLOW}[Chat]{RESET} Загружаю диалог...\n")
         try:
-            messages, meta = fetch_chat_messages(session, chat_url, limit=100)
+            if cache is not None and cache.is_fresh(chat_url, last_message_id):
+                messages, meta = cache.get(chat_url, limit=100)
+                # после отправки сообщения — уже обычная дельта
+                last_message_id = None
+            elif cache is not None:
+                messages, meta = cache.fetch(chat_url, limit=100)
+            else:
+                messages, meta = fetch_chat_messages(client, chat_url, limit=100)
         except Exception as e:
             print(f"{RED}[Chat]{RESET} Ошибка при загрузке чата: {e}")
             _input("\nНажми Enter, чтобы вернуться к списку диалогов...")
@@ -595,14 +258,27 @@ def show_chat(session: requests.Session, chat_url: str) -> None:
             # назад к списку диалогов
             return
 
+        if sender is not None:
+            before = meta.get("last_message_id")
+            if not sender.send(chat_url, user_text):
+                print(f"{YELLOW}[Chat]{RESET} {sender.last_error}")
+                _input("\nСообщение пока НЕ отправлено. Нажми Enter, чтобы вернуться в список диалогов...")
+                return
+            _, meta = cache.get(chat_url, limit=1) if cache is not None else ({}, {})
+            if meta.get("last_message_id") and meta.get("last_message_id") != before:
+                # новое сообщение пришло в ответе на отправку — перерисуем из кэша
+                last_message_id = meta["last_message_id"]
+            print(f"{GREEN}[Chat]{RESET} Сообщение отправлено.")
+            continue
+
         ok = False
         try:
-            ok = send_chat_message(session, meta, user_text)
+            ok = send_chat_message(client, meta, user_text)
         except Exception as e:
             print(f"{RED}[Chat]{RESET} Ошибка при отправке сообщения: {e}")
 
         if not ok:
-            _input("\nСообщение НЕ отправлено. Нажми Enter, чтобы вернуться в список диалогов...")
+            _input("\nСообщение НЕ отправлено (причина в kypisa.log). Нажми Enter, чтобы вернуться в список диалогов...")
             return
 
         print(f"{GREEN}[Chat]{RESET} Сообщение отправлено, обновляю чат...")
@@ -610,9 +286,49 @@ def show_chat(session: requests.Session, chat_url: str) -> None:
 
 
 
+def search_archive_cli(
+    client: FunPayClient,
+    cache: MessageCache,
+    sender: Optional[ChatSession] = None,
+) -> None:
+    """
+    Поиск по локальному архиву сообщений (все диалоги сразу).
+    Найденный диалог можно открыть по номеру.
+    """
+    archive = cache.archive
+    if archive is None:
+        return
+    mode = "FTS5" if archive.fts else "LIKE (sqlite без FTS5)"
+    print(f"\n{BOLD}{YELLOW}=== Поиск по архиву ({archive.count()} сообщений, {mode}) ==={RESET}")
+    print("Пустая строка — выход.")
+
+    while True:
+        query = _input("\nНайти: ").strip()
+        if not query:
+            return
+
+        started = time.perf_counter()
+        results = archive.search(query)
+        took_ms = (time.perf_counter() - started) * 1000
+
+        if not results:
+            print(f"{GRAY}Ничего не нашлось ({took_ms:.1f} мс).{RESET}")
+            continue
+
+        print(f"{GREEN}Найдено: {len(results)}{RESET} {DIM}({took_ms:.1f} мс){RESET}")
+        for i, r in enumerate(results, start=1):
+            when = " ".join(x for x in (r["day"], r["time"]) if x)
+            author = f"{MAGENTA}{r['author']}{RESET}: " if r["author"] else ""
+            print(f"{CYAN}{i:2d}.{RESET} [{r['name']}] {DIM}{when}{RESET} {author}{_short(r['text'], 120)}")
+
+        choice = _input("\nНомер, чтобы открыть диалог (Enter — новый поиск): ").strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(results):
+            show_chat(client, results[int(choice) - 1]["url"], cache, sender=sender)
+
+
 # ---------- основной цикл CLI ----------
 
-def run_chat_cli(session: requests.Session) -> None:
+def run_chat_cli(client: FunPayClient) -> None:
     """
     Главное меню плагина чатов.
     """
@@ -629,13 +345,23 @@ def run_chat_cli(session: requests.Session) -> None:
     print("Режим отображения диалогов:")
     print("  1 - Все диалоги")
     print("  2 - Только с новыми сообщениями (мониторинг, звук) ✉️")
-    mode = _input("Выбери режим (1/2, по умолчанию 1): ").strip()
-    if mode not in ("1", "2"):
+    print("  3 - Поиск по архиву сообщений 🔎")
+    mode = _input("Выбери режим (1/2/3, по умолчанию 1): ").strip()
+    if mode not in ("1", "2", "3"):
         mode = "1"
 
+    # один архив и один кэш сообщений на всю сессию плагина
+    archive = ChatArchive()
+    cache = MessageCache(client, archive)
+    sender = ChatSession(client, cache, on_failed=_print_send_failed)
+
     if mode == "2":
         # режим мониторинга только новых чатов
-        monitor_unread_chats(session)
+        monitor_unread_chats(client, cache, sender)
+        return
+
+    if mode == "3":
+        search_archive_cli(client, cache, sender)
         return
 
     # ---------- обычный режим: все диалоги ----------
@@ -644,7 +370,7 @@ def run_chat_cli(session: requests.Session) -> None:
         print(f"\n{BOLD}{YELLOW}=== FunPay / Чаты (плагин Chat) ==={RESET}")
 
         try:
-            chats = fetch_chat_list(session)
+            chats = fetch_chat_list(client)
         except Exception as e:
             print(f"{YELLOW}[Chat]{RESET} Ошибка при загрузке списка диалогов: {e}")
             _input("\nНажми Enter для выхода...")
@@ -654,6 +380,7 @@ def run_chat_cli(session: requests.Session) -> None:
             print(f"{YELLOW}[Chat]{RESET} Диалогов не найдено.")
             _input("\nНажми Enter для выхода...")
             return
+        archive.add_dialogs(chats)
 
         for i, ch in enumerate(chats, start=1):
             unread = ch["unread"]
@@ -694,28 +421,245 @@ def run_chat_cli(session: requests.Session) -> None:
             continue
 
         chat = chats[idx - 1]
-        show_chat(session, chat["url"])
+        show_chat(client, chat["url"], cache, chat.get("last_message_id"), sender)
 
 
 
 
 #-------а зачем код мой читаешь мммммм?-----------
 
-def monitor_unread_chats(session: requests.Session) -> None:
+class _TerminalEvents:
+    """
+    События монитора в одном месте: нажатия клавиш, таймер и завершения
+    фоновых задач (post). Ожидание — без холостого опроса:
+
+    - Linux/macOS: selectors по stdin и self-pipe, терминал в режиме
+      cbreak (символы приходят сразу, без Enter); в простое процесс спит
+      в select() до клавиши, таймера или события;
+    - Windows: WaitForMultipleObjects по хэндлу ввода консоли и событию
+      пробуждения — спим до клавиши, таймера или post(). Если stdin не
+      консоль (перенаправлен) или WinAPI недоступен — запасной вариант:
+      msvcrt.kbhit() раз в WINDOWS_POLL_SECONDS.
+    """
+
+    WINDOWS_POLL_SECONDS = 0.1
+    # WaitForMultipleObjects
+    _WAIT_INFINITE = 0xFFFFFFFF
+    _WAIT_FAILED = 0xFFFFFFFF
+    _INPUT_RECORD_SIZE = 20
+
+    def __init__(self) -> None:
+        self._events: "queue.Queue[tuple]" = queue.Queue()
+        try:
+            self._fd: Optional[int] = sys.stdin.fileno()
+        except (AttributeError, OSError, ValueError):
+            # stdin подменён (IDE, pytest) или закрыт — клавиш не будет
+            self._fd = None
+        self._saved_tty = None
+        self.eof = self._fd is None
+        self._kernel32 = None
+        if msvcrt is not None:
+            self._wake = threading.Event()
+            self._selector = None
+            if self._fd is not None:
+                self._open_console()
+        else:
+            self._wake_r, self._wake_w = os.pipe()
+            os.set_blocking(self._wake_r, False)
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self._wake_r, selectors.EVENT_READ, "wake")
+            if self._fd is not None:
+                self._selector.register(self._fd, selectors.EVENT_READ, "stdin")
+
+    def _open_console(self) -> None:
+        """Хэндлы для ожидания на Windows; не вышло — останемся на kbhit()."""
+        try:
+            import ctypes
+            from ctypes import wintypes
+
+            # свой экземпляр: argtypes/restype не трогают общий ctypes.windll
+            kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+            kernel32.GetStdHandle.restype = wintypes.HANDLE
+            kernel32.GetStdHandle.argtypes = [wintypes.DWORD]
+            kernel32.GetConsoleMode.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD)]
+            kernel32.CreateEventW.restype = wintypes.HANDLE
+            kernel32.CreateEventW.argtypes = [ctypes.c_void_p, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR]
+            kernel32.SetEvent.argtypes = [wintypes.HANDLE]
+            kernel32.ResetEvent.argtypes = [wintypes.HANDLE]
+            kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+            kernel32.WaitForMultipleObjects.restype = wintypes.DWORD
+            kernel32.WaitForMultipleObjects.argtypes = [
+                wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE), wintypes.BOOL, wintypes.DWORD,
+            ]
+            kernel32.GetNumberOfConsoleInputEvents.argtypes = [wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD)]
+            kernel32.ReadConsoleInputW.argtypes = [
+                wintypes.HANDLE, ctypes.c_void_p, wintypes.DWORD, ctypes.POINTER(wintypes.DWORD),
+            ]
+
+            stdin = kernel32.GetStdHandle(-10)  # STD_INPUT_HANDLE
+            mode = wintypes.DWORD()
+            if not stdin or not kernel32.GetConsoleMode(stdin, ctypes.byref(mode)):
+                return  # stdin не консоль — ждать на нём нельзя
+            wake = kernel32.CreateEventW(None, True, False, None)  # с ручным сбросом
+            if not wake:
+                return
+        except Exception as e:
+            log(f"CHAT: ожидание ввода через WinAPI недоступно: {e}")
+            return
+        self._ctypes = ctypes
+        self._wintypes = wintypes
+        self._kernel32 = kernel32
+        self._stdin_handle = stdin
+        self._wake_handle = wake
+        self._handles = (wintypes.HANDLE * 2)(stdin, wake)
+
+    def _discard_console_events(self) -> None:
+        """
+        Хэндл ввода сигнален, пока в буфере есть записи, — и от отпускания
+        клавиш, мыши, фокуса, которые kbhit() не забирает. Выбрасываем их,
+        иначе WaitForMultipleObjects сразу возвращался бы снова.
+        """
+        count = self._wintypes.DWORD()
+        if not self._kernel32.GetNumberOfConsoleInputEvents(self._stdin_handle, self._ctypes.byref(count)):
+            return
+        # kbhit() смотрит весь буфер: если символов нет, то и среди
+        # посчитанных записей их нет — их можно прочитать и забыть
+        if not count.value or msvcrt.kbhit():
+            return
+        buf = self._ctypes.create_string_buffer(self._INPUT_RECORD_SIZE * count.value)
+        read = self._wintypes.DWORD()
+        self._kernel32.ReadConsoleInputW(self._stdin_handle, buf, count.value, self._ctypes.byref(read))
+
+    # ---------- терминал ----------
+
+    def _enter_cbreak(self) -> None:
+        if termios is None or self._fd is None or not os.isatty(self._fd):
+            return
+        self._saved_tty = termios.tcgetattr(self._fd)
+        tty.setcbreak(self._fd)
+
+    def _restore(self) -> None:
+        if self._saved_tty is not None:
+            termios.tcsetattr(self._fd, termios.TCSADRAIN, self._saved_tty)
+            self._saved_tty = None
+
+    def __enter__(self) -> "_TerminalEvents":
+        self._enter_cbreak()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._restore()
+        if self._kernel32 is not None:
+            self._kernel32.CloseHandle(self._wake_handle)
+            self._kernel32 = None
+        if self._selector is not None:
+            self._selector.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    @contextmanager
+    def paused(self):
+        """Обычный режим терминала на время input() (например, внутри show_chat)."""
+        self._restore()
+        try:
+            yield
+        finally:
+            self._enter_cbreak()
+
+    # ---------- события ----------
+
+    def post(self, event: tuple) -> None:
+        """Положить событие из любого потока и разбудить wait()."""
+        self._events.put(event)
+        if self._selector is None:
+            self._wake.set()
+            kernel32 = self._kernel32
+            if kernel32 is not None:
+                kernel32.SetEvent(self._wake_handle)
+        else:
+            try:
+                os.write(self._wake_w, b"x")
+            except (BlockingIOError, OSError):
+                pass
+
+    def _drain(self) -> List[tuple]:
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def wait(self, timeout: Optional[float]) -> Tuple[str, List[tuple]]:
+        """Ждать до timeout секунд. Возвращает (нажатые символы, события)."""
+        if self._selector is None:
+            return self._wait_windows(timeout)
+
+        keys = ""
+        for key, _ in self._selector.select(timeout):
+            if key.data == "wake":
+                try:
+                    os.read(self._wake_r, 4096)
+                except BlockingIOError:
+                    pass
+            else:
+                data = os.read(self._fd, 1024)
+                if not data:
+                    # stdin закрыт — дальше читать нечего
+                    self.eof = True
+                    self._selector.unregister(self._fd)
+                keys += data.decode("utf-8", errors="ignore")
+        return keys, self._drain()
+
+    def _wait_windows(self, timeout: Optional[float]) -> Tuple[str, List[tuple]]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            keys = ""
+            while msvcrt.kbhit():
+                keys += msvcrt.getwch()
+            if keys or self._wake.is_set():
+                self._wake.clear()
+                if self._kernel32 is not None:
+                    self._kernel32.ResetEvent(self._wake_handle)
+                return keys, self._drain()
+            left = None if deadline is None else deadline - time.monotonic()
+            if left is not None and left <= 0:
+                return "", self._drain()
+            if self._kernel32 is None:
+                step = self.WINDOWS_POLL_SECONDS
+                self._wake.wait(step if left is None else min(step, left))
+                continue
+            self._discard_console_events()
+            ms = self._WAIT_INFINITE if left is None else max(1, int(left * 1000))
+            if self._kernel32.WaitForMultipleObjects(2, self._handles, False, ms) == self._WAIT_FAILED:
+                log(f"CHAT: WaitForMultipleObjects: ошибка {self._ctypes.get_last_error()}, перехожу на kbhit()")
+                self._kernel32.CloseHandle(self._wake_handle)
+                self._kernel32 = None
+
+
+MONITOR_REFRESH_SECONDS = 5.0
+
+
+def monitor_unread_chats(
+    client: FunPayClient,
+    cache: Optional[MessageCache] = None,
+    sender: Optional[ChatSession] = None,
+) -> None:
     """
     Мониторинг только чатов с новыми сообщениями.
 
-    Автообновление каждые 5 секунд + неблокирующий ввод:
+    Автообновление каждые 5 секунд (через лёгкий /runner/, см.
+    ChatListWatcher) + неблокирующий ввод:
     - список чатов сам обновляется;
     - можно в любой момент набрать номер и нажать Enter, чтобы зайти в чат;
     - 0 + Enter — выход.
-    """
+    Непрочитанные диалоги в фоне подгружаются в кэш (UnreadPrefetcher),
+    так что открываются без ожидания сети.
 
-    if msvcrt is None:
-        print(f"{YELLOW}[Chat]{RESET} Неблокирующий режим доступен только на Windows. Включаю простой мониторинг.")
-        # простой резервный вариант: нужно жать Enter, чтобы обновлять
-        simple_monitor_unread_chats(session)
-        return
+    Цикл событийный (_TerminalEvents): опрос /runner/ идёт в фоновом
+    потоке, а главный поток спит, пока не придёт клавиша, таймер или
+    результат опроса, — и реагирует на ввод сразу, даже во время запроса.
+    """
 
     print(f"\n{BOLD}{YELLOW}Режим мониторинга новых сообщений (✉️){RESET}")
     print("Проверяю новые сообщения каждые 5 секунд.")
@@ -723,20 +667,35 @@ def monitor_unread_chats(session: requests.Session) -> None:
     print("0 + Enter — выход.\n")
 
     prev_last: dict[str, str] = {}
-    last_refresh = 0.0
     input_buffer = ""
     last_unread: List[Dict] = []
-
-    def refresh():
-        nonlocal prev_last, last_refresh, last_unread, input_buffer
-
-        _clear_screen()  # ← вот это добавили
-
-        try:
-            chats = fetch_chat_list(session)
-        except Exception as e:
-            print(f"{YELLOW}[Chat]{RESET} Ошибка при загрузке списка диалогов: {e}")
-            return
+    if cache is None:
+        cache = MessageCache(client)
+    watcher = ChatListWatcher(client, cache)
+    if sender is None:
+        sender = ChatSession(client, cache)
+    poller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-poll")
+    events = _TerminalEvents()
+    # пока на экране монитор, о неотправленном сообщении говорим строкой статуса
+    on_failed = sender.on_failed
+    sender.on_failed = lambda url, content, error: events.post(("send_failed", url, content, error))
+    prefetcher = UnreadPrefetcher(cache, on_done=lambda *_: events.post(("prefetched",)))
+    screen = Screen()
+    # последние новые сообщения — держим в кадре до следующих
+    notices: List[str] = []
+    status_line = ""
+
+    def start_poll() -> None:
+        future = poller.submit(watcher.poll)
+        future.add_done_callback(lambda f: events.post(("polled", f)))
+
+    def collect() -> None:
+        """Разобрать свежий список: уведомления о новых сообщениях и список unread."""
+        nonlocal last_unread, notices
+
+        chats = watcher.chats
+        if cache is not None and cache.archive is not None:
+            cache.archive.add_dialogs(chats)
 
         unread_chats = [ch for ch in chats if ch["unread"]]
         new_events: list[Dict] = []
@@ -752,29 +711,31 @@ def monitor_unread_chats(session: requests.Session) -> None:
 
             prev_last[key] = last_msg
 
-
         if new_events:
             _play_notify()
-            print(f"\n{GREEN}[Chat]{RESET} Новые сообщения в диалогах:")
+            notices = [f"{GREEN}[Chat]{RESET} Новые сообщения в диалогах:"]
 
             for ch in new_events:
                 name_plain = ch["name"]
                 name_colored = f"{MAGENTA}{name_plain}{RESET}"
                 last = _short(ch["last_message"])
-                print(f"  ✉️ {name_colored}: {last}")
+                notices.append(f"  ✉️ {name_colored}: {last}")
 
                 # Windows-тост
                 _notify_windows_chat(name_plain, last, ch["url"])
 
-            print()
-
+            notices.append("")
 
+        last_unread = unread_chats
 
-        print(f"{BOLD}{YELLOW}=== Новые диалоги (unread) ==={RESET}")
-        if not unread_chats:
-            print(f"{GRAY}Пока нет новых сообщений. Жду...{RESET}")
+    def draw() -> None:
+        """Кадр монитора; на экран уходят только изменившиеся строки."""
+        lines = list(notices)
+        lines.append(f"{BOLD}{YELLOW}=== Новые диалоги (unread) ==={RESET}")
+        if not last_unread:
+            lines.append(f"{GRAY}Пока нет новых сообщений. Жду...{RESET}")
         else:
-            for i, ch in enumerate(unread_chats, start=1):
+            for i, ch in enumerate(last_unread, start=1):
                 name = f"{MAGENTA}{ch['name']}{RESET}"
                 last = _short(ch["last_message"])
                 if ch["time"]:
@@ -782,70 +743,127 @@ def monitor_unread_chats(session: requests.Session) -> None:
                     line = f"{CYAN}{i:2d}.{RESET} [✉️] {name}: {last}  {time_str}"
                 else:
                     line = f"{CYAN}{i:2d}.{RESET} [✉️] {name}: {last}"
-                print(line)
-
-        print("\nВведите номер диалога (0 - выход) > ", end="", flush=True)
-        print(input_buffer, end="", flush=True)
-
-        last_unread = unread_chats
-        last_refresh = time.time()
-
+                lines.append(line)
+
+        lines.append("")
+        lines.append(
+            f"{DIM}/runner/: {watcher.runner_polls} опросов, последний ответ "
+            f"{watcher.last_bytes} Б; полных загрузок /chat/: {watcher.page_loads}; "
+            f"синхронизировано диалогов: {watcher.synced_nodes} (+{watcher.synced_messages} сообщ.); "
+            f"подгружается в фоне: {prefetcher.pending()}{RESET}"
+        )
+        lines.append(f"{DIM}{client.metrics.summary()}{RESET}")
+        if status_line:
+            lines.append(status_line)
+        lines.append("")
+        lines.append(f"Введите номер диалога (0 - выход) > {input_buffer}")
+        screen.draw(lines)
+
+    def handle_line(cmd: str) -> bool:
+        """Enter в строке ввода. False — выйти из монитора."""
+        nonlocal prev_last, status_line
+        status_line = ""
+
+        if cmd == "0":
+            print(f"\n{YELLOW}[Chat]{RESET} Выход из мониторинга.")
+            return False
+
+        if cmd.isdigit():
+            idx = int(cmd)
+            if 1 <= idx <= len(last_unread):
+                chat = last_unread[idx - 1]
+                print()
+                with events.paused():
+                    show_chat(client, chat["url"], cache, chat.get("last_message_id"), sender)
+                # после выхода из чата форсим обновление
+                prev_last = {}
+                screen.invalidate()
+                collect()
+            else:
+                status_line = f"{YELLOW}[Chat]{RESET} Нет диалога с таким номером."
+        else:
+            status_line = f"{YELLOW}[Chat]{RESET} Введи номер или 0."
+        draw()
+        return True
 
+    polling = True
+    next_poll = time.monotonic()
     try:
-        refresh()  # первый вывод
-
-        while True:
-            now = time.time()
-            if now - last_refresh >= 5.0:
-                print()  # перенос строки перед новым выводом
-                refresh()
-
-            if msvcrt.kbhit():
-                ch = msvcrt.getwch()
-
-                # Enter — обработка введённого
-                if ch in ("\r", "\n"):
-                    cmd = input_buffer.strip()
-                    input_buffer = ""
-                    print()  # перенос строки после ввода
-
-                    if cmd == "0":
-                        print(f"{YELLOW}[Chat]{RESET} Выход из мониторинга.")
-                        return
-
-                    if cmd.isdigit():
-                        idx = int(cmd)
-                        if 1 <= idx <= len(last_unread):
-                            chat = last_unread[idx - 1]
-                            show_chat(session, chat["url"])
-                            # после выхода из чата форсим обновление
-                            prev_last = {}
-                            last_refresh = 0.0
-                            print()
-                            refresh()
-                        else:
-                            print(f"{YELLOW}[Chat]{RESET} Нет диалога с таким номером.")
-                            print("Введите номер диалога (0 - выход) > ", end="", flush=True)
-                    else:
-                        print(f"{YELLOW}[Chat]{RESET} Введи номер или 0.")
-                        print("Введите номер диалога (0 - выход) > ", end="", flush=True)
-
-                # Backspace
-                elif ch in ("\x08", "\x7f"):
-                    if input_buffer:
-                        input_buffer = input_buffer[:-1]
-                        # стираем символ в консоли
-                        print("\b \b", end="", flush=True)
-
-                else:
-                    # добавляем символ в буфер и печатаем
-                    input_buffer += ch
-                    print(ch, end="", flush=True)
-
-            time.sleep(0.1)
+        with events:
+            start_poll()  # первый кадр — когда придёт ответ
+
+            while True:
+                timeout = None if polling else max(0.0, next_poll - time.monotonic())
+                keys, happened = events.wait(timeout)
+                redraw = False
+
+                for event in happened:
+                    if event[0] == "prefetched":
+                        # обновить счётчик "подгружается в фоне"
+                        redraw = True
+                        continue
+                    if event[0] == "send_failed":
+                        _, url, content, error = event
+                        status_line = (
+                            f"{RED}[Chat]{RESET} Отложенное сообщение НЕ отправлено ({error}): "
+                            f"{_short(content, 40)} — {url}"
+                        )
+                        redraw = True
+                        continue
+                    if event[0] != "polled":
+                        continue
+                    polling = False
+                    next_poll = time.monotonic() + MONITOR_REFRESH_SECONDS
+                    try:
+                        changed = event[1].result()
+                    except Exception as e:
+                        status_line = f"{YELLOW}[Chat]{RESET} Ошибка при загрузке списка диалогов: {e}"
+                        redraw = True
+                        continue
+                    prefetcher.schedule(watcher.chats)
+                    # /runner/ сказал, что список тот же — нечего разбирать,
+                    # но счётчики в подвале всё равно обновятся
+                    if changed or not screen.frames:
+                        collect()
+                    redraw = True
+
+                if not polling and time.monotonic() >= next_poll:
+                    polling = True
+                    start_poll()
+
+                for ch in keys:
+                    # Enter — обработка введённого
+                    if ch in ("\r", "\n"):
+                        cmd = input_buffer.strip()
+                        input_buffer = ""
+                        if not handle_line(cmd):
+                            return
+                        redraw = False
+
+                    # Backspace
+                    elif ch in ("\x08", "\x7f"):
+                        if input_buffer:
+                            input_buffer = input_buffer[:-1]
+                            redraw = True
+
+                    elif ch.isprintable():
+                        # добавляем символ в буфер — перерисуется только строка ввода
+                        input_buffer += ch
+                        redraw = True
+
+                if redraw and (screen.frames or not polling):
+                    draw()
+
+                if events.eof:
+                    print(f"\n{YELLOW}[Chat]{RESET} Ввод закрыт, выхожу из мониторинга.")
+                    return
 
     except KeyboardInterrupt:
         print(f"\n{YELLOW}[Chat]{RESET} Мониторинг остановлен (Ctrl+C).")
+    finally:
+        sender.on_failed = on_failed
+        prefetcher.close()
+        poller.shutdown(wait=False, cancel_futures=True)
 
 
 
@@ -855,17 +873,20 @@ def monitor_unread_chats(session: requests.Session) -> None:
 
 def main() -> None:
     print("[Chat] Старт плагина чатов FunPay CLI.")
-    cfg = _load_config()
-    if not cfg:
+    cfg = load_settings()
+    if not cfg.get("golden_key"):
+        print("[Chat] В config.json нет golden_key. Сначала запусти основной FunPay CLI и настрой его.")
         _input("\nНажми Enter для выхода...")
         return
 
-    session = _make_session(cfg)
-    if session is None:
-        _input("\nНажми Enter для выхода...")
-        return
-
-    run_chat_cli(session)
+    # тот же клиент, что у ядра: пул соединений, лимит запросов и метрики
+    client = FunPayClient(
+        cfg["golden_key"],
+        cfg.get("user_agent") or None,
+        max_requests_per_minute=CHAT_REQUESTS_PER_MINUTE,
+    )
+    startup.ready("plugins/Chat/main.py", ["kypisa.api", "kypisa.chat"])
+    run_chat_cli(client)
 
 
 if __name__ == "__main__":
@@ -18,8 +18,13 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 # Теперь можно импортировать kypisa
+from kypisa import startup
+
+startup.init()
 from kypisa.notifier import run_notifier
 
+startup.mark("импорт kypisa.notifier")
+
 
 if __name__ == "__main__":
     run_notifier()